@@ -1,60 +1,440 @@
 import logging
 import sys
-from os import listdir, getcwd, chdir
-from os.path import isfile, abspath
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import namedtuple
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from math import ceil
+from os import scandir, pread
+from os.path import abspath
 
-import boto3
 import botocore
 
-S3_SERVICE_NAME = 's3'
+from checksum import CHECKSUM_ALGORITHM, CHECKSUM_FIELD, FULL_OBJECT, crc32_checksum, crc32_combine, combine_checksums, \
+    encode_crc32
+from clients import ClientFactory, LazyClient, LIMITED_MAX_ATTEMPTS
+from compress import Compressor, CODECS, is_compressed
+from limiter import AdaptiveLimiter
+from manifest import Manifest
+from metrics import Metrics, PROGRESS_INTERVAL
+from pack import Packer
+
+PROGRAM_DESCRIPTION = 'A tool that uploads local files to an S3 archive'
+PROGRAM_EPILOGUE = 'Have a nice day!'
 LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
 LOG_LEVEL = logging.INFO
-MAX_POOL_CONNECTIONS = 100
+NUMBER_OF_UPLOAD_THREADS = 10
+MAX_UPLOAD_THREADS = 32
+MB = 1024 * 1024
+PART_SIZE_MB = 64
+MIN_PART_SIZE_MB = 5
+MAX_PARTS = 10000
+NUMBER_OF_PART_THREADS = 4
+THREADS_FLAG_HELP_MESSAGE = (f'number of requests in flight at the start (default: {NUMBER_OF_UPLOAD_THREADS}). The number '
+                             f'grows while S3 keeps up and is cut back when S3 answers with SlowDown')
+MAX_THREADS_FLAG_HELP_MESSAGE = (f'maximum number of requests in flight, and of files uploaded in parallel '
+                                 f'(default: {MAX_UPLOAD_THREADS}). At most MAX_THREADS parts are held in memory at once, '
+                                 f'or with --compress up to two parts per file uploaded in parallel')
+PART_SIZE_FLAG_HELP_MESSAGE = (f'files larger than this are sent as a multipart upload, split into parts of this size '
+                               f'in MB (default: {PART_SIZE_MB}, minimum: {MIN_PART_SIZE_MB})')
+INDEX_FLAG_HELP_MESSAGE = ('incremental backup: only upload files that are new or changed since the last run. '
+                           'Uploaded files are tracked in the SQLite database INDEX, which is rebuilt from the '
+                           'bucket listing if it does not exist')
+PACK_THRESHOLD_FLAG_HELP_MESSAGE = ('pack files up to this size in KB into tar bundles uploaded as a single object, '
+                                    'with an index of where each file is stored (default: 0, no packing)')
+BUNDLE_SIZE_MB = 256
+BUNDLE_SIZE_FLAG_HELP_MESSAGE = f'target size of a bundle in MB (default: {BUNDLE_SIZE_MB})'
+PART_THREADS_FLAG_HELP_MESSAGE = f'number of parts of a single file uploaded in parallel (default: {NUMBER_OF_PART_THREADS})'
+COMPRESS_FLAG_HELP_MESSAGE = ('compress files with this codec in a pool of processes while they are uploaded. The codec '
+                              'is stored in the object metadata, decompress objects with compress.py. Bundles and '
+                              'files that are already compressed are uploaded as they are. zstd needs zstandard')
+COMPRESS_PROCESSES_FLAG_HELP_MESSAGE = 'number of compression processes (default: one per CPU)'
+METRICS_FLAG_HELP_MESSAGE = ('write the file counts, bytes, request latencies, retries and throttles to METRICS at '
+                             'every progress line: in the Prometheus text format if METRICS ends with .prom, '
+                             'as JSON otherwise')
+PROGRESS_INTERVAL_FLAG_HELP_MESSAGE = f'seconds between progress lines (default: {PROGRESS_INTERVAL})'
+METRIC_UPLOADED = 'uploaded'
+METRIC_SKIPPED = 'skipped'
+METRIC_FAILED = 'failed'
+
+# members is only set for bundles of small files built by the Packer
+FileEntry = namedtuple('FileEntry', ['key', 'path', 'size', 'mtime', 'members'], defaults=[None])
 
-s3 = boto3.client(S3_SERVICE_NAME, config=botocore.config.Config(
-    max_pool_connections=MAX_POOL_CONNECTIONS,
-))
-s3_rsrc = boto3.resource(S3_SERVICE_NAME)
+# Created at its first request, with a pool sized to the upload threads. Every request goes through the limiter,
+# which retries it, so the client makes a single attempt. The listing of an index rebuild has botocore's retries
+client_factory = ClientFactory()
+s3 = LazyClient(client_factory, max_pool_connections=MAX_UPLOAD_THREADS, max_attempts=LIMITED_MAX_ATTEMPTS)
+listing_s3 = LazyClient(client_factory)
+limiter = AdaptiveLimiter('upload', NUMBER_OF_UPLOAD_THREADS, MAX_UPLOAD_THREADS)
+metrics = Metrics(METRIC_UPLOADED)
 
 def bucket_exists(bucket_name):
     try:
-        response = s3.head_bucket(Bucket=bucket_name)
+        response = limiter.call('', s3.head_bucket, Bucket=bucket_name)
     except botocore.exceptions.ClientError as e:
         logging.debug(e)
         return False
     return True
 
-def get_paths(folder):
-    initial_dir = getcwd()
-    chdir(folder)
-    onlyfiles = [(f, abspath(f)) for f in listdir() if isfile(f)]
-    chdir(initial_dir)
-    return onlyfiles
+def walk_files(folder):
+    # Depth-first scandir walk: entries are yielded as soon as their directory is read,
+    # so uploads start long before a huge tree is fully walked
+    pending = [(abspath(folder), '')]
+    while pending:
+        (directory, key_prefix) = pending.pop()
+        try:
+            with scandir(directory) as entries:
+                for entry in entries:
+                    key = f'{key_prefix}{entry.name}'
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append((entry.path, f'{key}/'))
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        yield FileEntry(key, entry.path, stat.st_size, stat.st_mtime)
+        except OSError as e:
+            logging.error(f'Skipping {directory}: {e}')
+
+def put_file(file, bucket, key, prefix, storage_class='GLACIER'):
+    # botocore computes the checksum while it streams the body, S3 checks it and sends it back.
+    # Returns the checksum
+    object_key = f'{prefix}/{key}'
+    with open(file, 'rb') as body:
+        response = limiter.call(
+            object_key,
+            s3.put_object,
+            on_retry=partial(body.seek, 0),
+            Body=body,
+            ACL='private',
+            Key=object_key,
+            Bucket=bucket,
+            StorageClass=storage_class,
+            ChecksumAlgorithm=CHECKSUM_ALGORITHM
+        )
+    return response.get(CHECKSUM_FIELD)
+
+def get_part_size(file_size, part_size):
+    # S3 allows at most MAX_PARTS parts per upload, so huge files get bigger parts
+    min_part_size = ceil(file_size / MAX_PARTS / MB) * MB
+    return max(part_size, min_part_size)
+
+
+def upload_part(data, **kwargs):
+    # The checksum is taken from the buffer that is sent and kept for the checksum of the whole file.
+    # S3 rejects a part that doesn't match it, but not every S3 implementation sends it back
+    checksum = crc32_checksum(data)
+    response = s3.upload_part(Body=data, ChecksumCRC32=checksum, **kwargs)
+    return {**response, CHECKSUM_FIELD: checksum}
+
+
+def read_and_put_part(fd, bucket, key, upload_id, part_size, file_size, part_number):
+    offset = (part_number - 1) * part_size
+    data = pread(fd, min(part_size, file_size - offset), offset)
+    return upload_part(data, Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number)
+
+
+def put_limited_part(key, part_number, function, *args, **kwargs):
+    # The limiter retries a throttled or failed part on its own, without the rest of the file
+    response = limiter.call(key, function, *args, **kwargs)
+    return {'ETag': response['ETag'], 'PartNumber': part_number, CHECKSUM_FIELD: response[CHECKSUM_FIELD]}
+
+
+def put_part(fd, bucket, key, upload_id, part_size, file_size, part_number):
+    # The part is only read once the limiter lets its request through,
+    # so parts waiting for their turn hold no memory
+    return put_limited_part(
+        key,
+        part_number,
+        read_and_put_part,
+        fd, bucket, key, upload_id, part_size, file_size, part_number
+    )
+
+
+def complete_multipart(bucket, key, upload_id, parts, part_sizes):
+    # S3 combines the part checksums into the checksum of the whole object, and checks it against
+    # the one combined here. Returns the checksum
+    checksum = combine_checksums(
+        (part.get(CHECKSUM_FIELD), part_size) for (part, part_size) in zip(parts, part_sizes)
+    )
+    checksum_args = {}
+    if checksum is not None:
+        checksum_args = {CHECKSUM_FIELD: checksum, 'ChecksumType': FULL_OBJECT}
+    response = limiter.call(
+        key,
+        s3.complete_multipart_upload,
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': parts},
+        **checksum_args
+    )
+    return response.get(CHECKSUM_FIELD, checksum)
+
+
+def put_file_multipart(file, bucket, key, prefix, file_size, part_size, part_threads, storage_class='GLACIER'):
+    object_key = f'{prefix}/{key}'
+    part_size = get_part_size(file_size, part_size)
+    part_numbers = range(1, ceil(file_size / part_size) + 1)
+    upload = limiter.call(
+        object_key,
+        s3.create_multipart_upload,
+        ACL='private',
+        Key=object_key,
+        Bucket=bucket,
+        StorageClass=storage_class,
+        ChecksumAlgorithm=CHECKSUM_ALGORITHM,
+        ChecksumType=FULL_OBJECT
+    )
+    upload_id = upload['UploadId']
+    try:
+        with open(file, 'rb') as f, ThreadPool(processes=part_threads) as pool:
+            parts = pool.map(partial(put_part, f.fileno(), bucket, object_key, upload_id, part_size, file_size), part_numbers)
+        part_sizes = [min(part_size, file_size - (part_number - 1) * part_size) for part_number in part_numbers]
+        return complete_multipart(bucket, object_key, upload_id, parts, part_sizes)
+    except BaseException:
+        limiter.call(object_key, s3.abort_multipart_upload, Bucket=bucket, Key=object_key, UploadId=upload_id)
+        raise
+
+
+def put_compressed_part(key, upload_id, bucket, part_number, data):
+    return put_limited_part(
+        key,
+        part_number,
+        upload_part,
+        data,
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number
+    )
+
+
+def put_file_compressed(file, bucket, key, prefix, file_size, part_size, compressor, storage_class='GLACIER'):
+    # Compressed chunks are gathered into parts as they come out of the compressor and sent right away.
+    # The compressed size isn't known up front: a file that fits in one part is sent with a single PUT.
+    # Returns the CRC32 of the file's content, for the index: the object's own checksum is of the compressed bytes
+    object_key = f'{prefix}/{key}'
+    part_size = get_part_size(file_size, part_size)
+    metadata = compressor.metadata(file_size)
+    upload_id = None
+    parts = []
+    part_sizes = []
+    buffer = bytearray()
+    content_crc = 0
+    try:
+        for (chunk, chunk_crc, chunk_size) in compressor.compress_file(file, file_size):
+            content_crc = crc32_combine(content_crc, chunk_crc, chunk_size)
+            buffer.extend(chunk)
+            if len(buffer) < part_size:
+                continue
+            if upload_id is None:
+                upload_id = limiter.call(
+                    object_key,
+                    s3.create_multipart_upload,
+                    ACL='private',
+                    Key=object_key,
+                    Bucket=bucket,
+                    StorageClass=storage_class,
+                    Metadata=metadata,
+                    ChecksumAlgorithm=CHECKSUM_ALGORITHM,
+                    ChecksumType=FULL_OBJECT
+                )['UploadId']
+            (data, buffer) = (bytes(buffer[:part_size]), buffer[part_size:])
+            parts.append(put_compressed_part(object_key, upload_id, bucket, len(parts) + 1, data))
+            part_sizes.append(len(data))
+        if upload_id is None:
+            data = bytes(buffer)
+            checksum = crc32_checksum(data)
+            limiter.call(
+                object_key,
+                s3.put_object,
+                Body=data,
+                ACL='private',
+                Key=object_key,
+                Bucket=bucket,
+                StorageClass=storage_class,
+                Metadata=metadata,
+                ChecksumCRC32=checksum
+            )
+            return encode_crc32(content_crc)
+        if buffer:
+            data = bytes(buffer)
+            parts.append(put_compressed_part(object_key, upload_id, bucket, len(parts) + 1, data))
+            part_sizes.append(len(data))
+        complete_multipart(bucket, object_key, upload_id, parts, part_sizes)
+        return encode_crc32(content_crc)
+    except BaseException:
+        if upload_id is not None:
+            limiter.call(object_key, s3.abort_multipart_upload, Bucket=bucket, Key=object_key, UploadId=upload_id)
+        raise
+
+
+def upload_file(bucket, prefix, part_size, part_threads, manifest, packer, storage_class, compressor, file):
+    error = None
+    try:
+        md5 = None
+        if manifest is not None and file.members is None:
+            (needed, md5) = manifest.needs_upload(file)
+            if not needed:
+                logging.debug(f'File {file.key} unchanged, skipped')
+                metrics.count(METRIC_SKIPPED, file.size)
+                return file.key, None
+        if compressor is not None and file.members is None and not is_compressed(file.key):
+            checksum = put_file_compressed(file.path, bucket, file.key, prefix, file.size, part_size, compressor, storage_class)
+        elif file.size > part_size:
+            checksum = put_file_multipart(file.path, bucket, file.key, prefix, file.size, part_size, part_threads, storage_class)
+        else:
+            checksum = put_file(file.path, bucket, file.key, prefix, storage_class)
+        if manifest is not None and file.members is None:
+            manifest.record(file.key, file.size, file.mtime, md5, checksum)
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError) as e:
+        logging.error(f'File {file.key} failed: {e}')
+        error = e
+    finally:
+        if file.members is not None:
+            packer.finish_bundle(file, error)
+    if error is None:
+        logging.info(f'File {file.key} uploaded')
+        metrics.count(METRIC_UPLOADED, file.size)
+    else:
+        metrics.count(METRIC_FAILED, file.size)
+    return file.key, error
+
+
+def put_files(
+        files,
+        bucket,
+        prefix,
+        threads,
+        part_size=PART_SIZE_MB * MB,
+        part_threads=NUMBER_OF_PART_THREADS,
+        manifest=None,
+        packer=None,
+        storage_class='GLACIER',
+        compressor=None
+):
+    with ThreadPool(processes=threads) as pool:
+        results = pool.imap_unordered(
+            partial(upload_file, bucket, prefix, part_size, part_threads, manifest, packer, storage_class, compressor),
+            files
+        )
+        failures = [(filename, error) for (filename, error) in results if error is not None]
+    return failures
+
+
+def put_bundle_index(packer, bucket, prefix):
+    index_path = packer.close()
+    if packer.bundle_count == 0:
+        return []
+    try:
+        # The index stays in STANDARD so it can be read without a restore
+        put_file(index_path, bucket, packer.index_key, prefix, storage_class='STANDARD')
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError) as e:
+        logging.error(f'Bundle index {packer.index_key} failed: {e}')
+        return [(packer.index_key, e)]
+    logging.info(f'Bundle index uploaded to {prefix}/{packer.index_key}')
+    return []
 
-def put_file(file, bucket, key, prefix):
-    s3.put_object(Body=open(file, 'rb'), ACL='private', Key=f'{prefix}/{key}', Bucket=bucket, StorageClass='GLACIER')
 
 def main():
     logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
 
-    # ./archive.py <folder> <bucket> <prefix>
-    folder = sys.argv[1]
-    bucket = sys.argv[2]
-    prefix = ''
-    if len(sys.argv) > 3:
-        prefix = sys.argv[3]
+    parser = ArgumentParser(
+        description=PROGRAM_DESCRIPTION,
+        epilog=PROGRAM_EPILOGUE
+    )
+
+    parser.add_argument('folder')
+    parser.add_argument('bucket')
+    parser.add_argument('prefix', nargs='?', default='')
+    parser.add_argument('-t', '--threads', type=int, default=NUMBER_OF_UPLOAD_THREADS, help=THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--max-threads', type=int, default=MAX_UPLOAD_THREADS, help=MAX_THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--part-size', type=int, default=PART_SIZE_MB, help=PART_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--part-threads', type=int, default=NUMBER_OF_PART_THREADS, help=PART_THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-i', '--index', help=INDEX_FLAG_HELP_MESSAGE)
+    parser.add_argument('--pack-threshold', type=int, default=0, help=PACK_THRESHOLD_FLAG_HELP_MESSAGE)
+    parser.add_argument('--bundle-size', type=int, default=BUNDLE_SIZE_MB, help=BUNDLE_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument('-z', '--compress', choices=CODECS, help=COMPRESS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--compress-processes', type=int, help=COMPRESS_PROCESSES_FLAG_HELP_MESSAGE)
+    parser.add_argument('--metrics', help=METRICS_FLAG_HELP_MESSAGE)
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        default=PROGRESS_INTERVAL,
+        help=PROGRESS_INTERVAL_FLAG_HELP_MESSAGE
+    )
+
+    args = parser.parse_args()
+
+    folder = args.folder
+    bucket = args.bucket
+    prefix = args.prefix
+    part_size = max(args.part_size, MIN_PART_SIZE_MB) * MB
+    limiter.set_limits(args.threads, args.max_threads)
+    # The limiter keeps at most MAX_THREADS requests in flight
+    s3.configure(args.max_threads)
 
     if not bucket_exists(bucket):
         logging.error(f'''Bucket {bucket} doesn't exist''')
         return 1
 
-    logging.info('Populating list of objects...')
+    logging.info(f'Uploading files from {folder}...')
+
+    manifest = None
+    if args.index:
+        manifest = Manifest(args.index)
+        if manifest.is_new:
+            logging.info(f'Index {args.index} not found, rebuilding it from the bucket listing...')
+            manifest.rebuild(listing_s3, bucket, prefix, args.compress is not None)
 
-    files = get_paths(folder)
-    for (filename, path) in files:
-        put_file(path, bucket, filename, prefix)
-        logging.info(f'File {filename} uploaded')
+    files = walk_files(folder)
+    packer = None
+    bundle_dir = None
+    if args.pack_threshold > 0:
+        bundle_dir = tempfile.TemporaryDirectory()
+        run_id = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        packer = Packer(bundle_dir.name, run_id, args.pack_threshold * 1024, args.bundle_size * MB, manifest)
+        files = packer.pack(files)
+    compressor = None
+    if args.compress:
+        try:
+            compressor = Compressor(args.compress, processes=args.compress_processes)
+        except ImportError:
+            logging.error(f'{args.compress} compression needs zstandard: pip install zstandard')
+            return 1
+    metrics.instrument(s3)
+    metrics.watch(limiter)
+    metrics.start(args.progress_interval, args.metrics)
+    try:
+        failures = put_files(
+            files,
+            bucket,
+            prefix,
+            args.max_threads,
+            part_size,
+            args.part_threads,
+            manifest,
+            packer,
+            compressor=compressor
+        )
+        if packer is not None:
+            failures.extend(put_bundle_index(packer, bucket, prefix))
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if bundle_dir is not None:
+            bundle_dir.cleanup()
+        if compressor is not None:
+            compressor.close()
+        metrics.stop(args.metrics)
+    if failures:
+        logging.error(f'{len(failures)} file(s) failed to upload:')
+        for (filename, error) in failures:
+            logging.error(f'{filename}: {error}')
+        return 1
 
+    logging.info('All files uploaded.')
     return 0
 
 
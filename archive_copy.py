@@ -1,27 +1,133 @@
 import logging
+import math
+import os
+import subprocess
 import sys
 import time
 from argparse import ArgumentParser
+from collections import Counter
 from functools import partial
 from multiprocessing.pool import ThreadPool
 
-import boto3
 import botocore
 
+from async_copier import AsyncCopier, aiobotocore_client_factory, IN_FLIGHT
+from clients import ClientFactory, LIMITED_MAX_ATTEMPTS
+from checksum import MISMATCHED, MISSING, compare_heads
+from copier import Copier, RestoreExpired, MB, COPY_PART_SIZE_MB, MIN_COPY_PART_SIZE_MB, MAX_COPY_PART_SIZE_MB
+from inventory import read_inventory, sort_s3objects
+from journal import Journal, STATE_RESTORE_REQUESTED, STATE_RESTORED, STATE_COPIED, STATE_FAILED
+from limiter import AdaptiveLimiter, AsyncAdaptiveLimiter, LimitedClient
+from listing import find_boundaries, list_range, list_sharded
+from metrics import Metrics, PROGRESS_INTERVAL
+from report import Report, parse_shard, shard_path, shard_s3objects, merge_report_files
+from s3object import NO_RESTORE, RESTORE_UNKNOWN, RESTORE_IN_PROGRESS, RESTORE_DONE, parse_restore
+from scheduler import RestoreScheduler, RestoreEvents
+from selection import Selector, parse_size, parse_time, read_key_list
+
 PROGRAM_DESCRIPTION = 'A tool that helps organizing S3 archives'
 PROGRAM_EPILOGUE = 'Have a nice day!'
-S3_SERVICE_NAME = 's3'
 LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
-MAX_POOL_CONNECTIONS = 100
 NUMBER_OF_COPY_THREADS = 10
+MAX_COPY_THREADS = 100
+NUMBER_OF_RESTORE_THREADS = 50
+MAX_RESTORE_THREADS = 100
 SOURCE_ARCHIVE_PROFILE_NAME = 'source_archive_profile'
 RESTORE_DAYS = 7
-POLLING_INTERVAL_SECONDS = 300
+SECONDS_PER_DAY = 24 * 60 * 60
 TIER = 'Standard'
 LOG_LEVEL = logging.INFO
+LIST_SHARDS = 16
+THREADS_ENGINE = 'threads'
+ASYNCIO_ENGINE = 'asyncio'
+ARCHIVE_STORAGE_CLASSES = ('GLACIER', 'DEEP_ARCHIVE')
+READY = '📦'
+REQUESTING_RESTORE = '🤙'
+RESTORING = '📼'
+RESTORED = '🪆'
+# Object counts of the metrics. Objects that are still being restored are not counted again at every check
+METRIC_STATES = {
+    READY: 'ready',
+    REQUESTING_RESTORE: 'restore_requested',
+    RESTORED: 'restored',
+}
+METRIC_COPIED = 'copied'
+METRIC_FAILED = 'failed'
+NOT_FOUND_ERROR_CODES = ('404', 'NoSuchKey')
+JOURNAL_STATES = {
+    READY: STATE_RESTORED,
+    REQUESTING_RESTORE: STATE_RESTORE_REQUESTED,
+    RESTORING: STATE_RESTORE_REQUESTED,
+    RESTORED: STATE_RESTORED,
+}
 FAST_ACCESS_FLAG_HELP_MESSAGE = ("don't use StorageClass=GLACIER, instead use StorageClass=STANDARD for faster access. "
                                  "Read more about Amazon S3 Storage Classes: "
                                  "https://aws.amazon.com/s3/storage-classes/")
+JOURNAL_FLAG_HELP_MESSAGE = ("record the state of every object in the SQLite database JOURNAL. If the job is "
+                             "interrupted, running it again with the same JOURNAL resumes where it stopped: "
+                             "objects are not listed, restored or copied again")
+RESTORE_EVENTS_FLAG_HELP_MESSAGE = ("file that S3 restore-completed event notifications are appended to, one message "
+                                    "per line (e.g. by an SQS consumer). Objects are checked as soon as their event "
+                                    "arrives instead of at their next polling time")
+THREADS_FLAG_HELP_MESSAGE = (f'number of copies in flight at the start (default: {NUMBER_OF_COPY_THREADS}). The number '
+                             f'grows while S3 keeps up and is cut back when S3 answers with SlowDown. Whole objects '
+                             f'and parts of big objects are copied from the same queue')
+MAX_THREADS_FLAG_HELP_MESSAGE = f'maximum number of copies in flight (default: {MAX_COPY_THREADS})'
+PART_SIZE_FLAG_HELP_MESSAGE = (f'objects larger than this are copied as a multipart upload, split into parts of this '
+                               f'size in MB that are copied in parallel (default: {COPY_PART_SIZE_MB}, '
+                               f'minimum: {MIN_COPY_PART_SIZE_MB}, maximum: {MAX_COPY_PART_SIZE_MB})')
+ENGINE_FLAG_HELP_MESSAGE = (f'copy engine (default: {THREADS_ENGINE}). The {ASYNCIO_ENGINE} engine keeps up to IN_FLIGHT '
+                            f'copies running at once on a single thread, which suits millions of small objects. '
+                            f'Its copies have the same adaptive limit, from THREADS up to IN_FLIGHT. It needs aiobotocore')
+IN_FLIGHT_FLAG_HELP_MESSAGE = f'number of copies in flight with the {ASYNCIO_ENGINE} engine (default: {IN_FLIGHT})'
+LIST_SHARDS_FLAG_HELP_MESSAGE = (f'list the buckets in up to LIST_SHARDS key ranges at once, split at their folders '
+                                 f'(default: {LIST_SHARDS}, 1 lists sequentially)')
+SYNC_FLAG_HELP_MESSAGE = ("only copy objects that are missing from the destination bucket or differ from it "
+                          "in size or ETag")
+INVENTORY_FLAG_HELP_MESSAGE = ("read the objects of the source bucket from the manifest.json of one of its S3 Inventory "
+                               "reports (CSV, Parquet or ORC) instead of listing the bucket. INVENTORY is a local path "
+                               "or an s3:// URL. Parquet and ORC need pyarrow")
+DESTINATION_INVENTORY_FLAG_HELP_MESSAGE = ("with --sync, read the objects of the destination bucket from an S3 Inventory "
+                                           "manifest.json instead of listing the bucket")
+EMOJI_FLAG_HELP_MESSAGE = ('print a symbol for every object that is checked or copied, instead of only the periodic '
+                           'progress lines')
+METRICS_FLAG_HELP_MESSAGE = ('write the object counts, bytes, request latencies, retries and throttles to METRICS '
+                             'at every progress line: in the Prometheus text format if METRICS ends with .prom, '
+                             'as JSON otherwise')
+PROGRESS_INTERVAL_FLAG_HELP_MESSAGE = f'seconds between progress lines (default: {PROGRESS_INTERVAL})'
+SHARD_FLAG_HELP_MESSAGE = ("only copy shard I of N, e.g. 0/4: the objects whose key hashes to I. Running every shard "
+                           "from 0 to N - 1, on one host or several, copies the whole bucket without any coordination, "
+                           "but every shard lists the whole bucket (or prefix), so the listing costs N times as many "
+                           "requests. The journal and report paths get a .I-of-N suffix")
+PROCESSES_FLAG_HELP_MESSAGE = ("split the job into PROCESSES shards and run each in its own process on this host "
+                               "(default: 1). The bucket's folders are listed once to split it into key ranges, and "
+                               "each process only lists its own range. With --inventory or --keys, the processes are "
+                               "hash shards like with --shard")
+KEY_RANGE_FLAG_HELP_MESSAGE = ("only work on the keys from START (included) to END (excluded), an empty string for "
+                               "either end leaves it open. Set by --processes for the processes it starts, with --shard "
+                               "for the journal and report paths")
+REPORT_FLAG_HELP_MESSAGE = ("write a JSON report of the objects and bytes copied and the failures to REPORT. The "
+                            "reports of several shards can be merged with report.py")
+VERIFY_FLAG_HELP_MESSAGE = ("don't copy anything, check that every object of the source bucket is in the destination "
+                            "bucket with the same content, from the metadata of both: sizes, checksums, or ETags of "
+                            "single part uploads. Objects are neither restored nor downloaded")
+PREFIX_FLAG_HELP_MESSAGE = ("only work on the keys that start with PREFIX. S3 lists the keys under PREFIX only, "
+                            "instead of the whole bucket")
+INCLUDE_FLAG_HELP_MESSAGE = ("only work on the keys that match the glob PATTERN, e.g. 'logs/2024-*.gz' (* also matches "
+                             "/). Can be repeated, a key has to match one of them")
+EXCLUDE_FLAG_HELP_MESSAGE = "skip the keys that match the glob PATTERN. Can be repeated, applied after --include"
+MIN_SIZE_FLAG_HELP_MESSAGE = 'only work on objects of at least SIZE, e.g. 1MB (B, KB, MB, GB, TB)'
+MAX_SIZE_FLAG_HELP_MESSAGE = 'only work on objects of at most SIZE, e.g. 4GB'
+MODIFIED_SINCE_FLAG_HELP_MESSAGE = ("only work on objects last modified at or after DATE, e.g. 2024-01-31 or "
+                                    "2024-01-31T12:00:00+01:00 (UTC unless a time zone is given)")
+MODIFIED_BEFORE_FLAG_HELP_MESSAGE = 'only work on objects last modified before DATE'
+KEYS_FLAG_HELP_MESSAGE = ("work on the keys listed in the file KEYS, one per line, instead of listing the bucket. "
+                          "Each key is looked up with a HEAD, missing keys are reported and skipped")
+PIPELINE_FLAG_HELP_MESSAGE = ("copy objects as soon as they are ready instead of waiting for every restore to finish. "
+                              "Restored objects are copied in order of expiry, objects whose restored copy expires "
+                              "before it is copied are restored again")
+
+metrics = Metrics(METRIC_COPIED)
 
 
 def bucket_exists(s3_bucket, bucket_name):
@@ -33,71 +139,311 @@ def bucket_exists(s3_bucket, bucket_name):
     return True
 
 
-def get_s3objects(source_client, bucket):
-    paginator = source_client.get_paginator('list_objects_v2')
-    pages = paginator.paginate(Bucket=bucket)
+def get_s3objects(source_client, bucket, shards=1, prefix=None, key_range=None):
+    # Objects are yielded page by page as the listing arrives, as compact S3Object records, sorted by key.
+    # key_range is (start, end), None for an open end
+    (start, end) = key_range or (None, None)
+    if shards > 1:
+        yield from list_sharded(source_client, bucket, shards, prefix, start, end)
+        return
+    for page in list_range(source_client, bucket, start, end, prefix):
+        yield from page
+
+
+def get_listing(client, bucket, inventory, shards, sort, prefix=None, keys=None, key_range=None):
+    # The sync diff needs the objects sorted by key, which listings already are and inventories
+    # and key lists aren't
+    if keys is not None:
+        listing = read_key_list(client, bucket, keys)
+    elif inventory is None:
+        return get_s3objects(client, bucket, shards, prefix, key_range)
+    else:
+        listing = read_inventory(client, inventory, bucket)
+    if sort:
+        listing = sort_s3objects(listing)
+    return listing
+
+
+def is_changed(s3object, destination):
+    if s3object.size != destination.size:
+        return True
+    # A multipart ETag ('-' and a part count) depends on the part size, so it can't be compared.
+    # Sizes are all there is to go on then
+    if '-' in (s3object.etag or '-') or '-' in (destination.etag or '-'):
+        return False
+    return s3object.etag != destination.etag
+
+
+def diff_s3objects(s3objects, destination_s3objects):
+    # Both listings are sorted by key (UTF-8 byte order, which is also Python's str order),
+    # so a single merge pass finds the missing and changed keys without holding either listing
+    destination_s3objects = iter(destination_s3objects)
+    destination = next(destination_s3objects, None)
+    skipped_count = 0
+    for s3object in s3objects:
+        while destination is not None and destination.key < s3object.key:
+            destination = next(destination_s3objects, None)
+        if destination is not None and destination.key == s3object.key and not is_changed(s3object, destination):
+            skipped_count = skipped_count + 1
+            continue
+        yield s3object
+    logging.info(f'{skipped_count} objects are already in the destination bucket and were skipped')
 
-    s3objects = []
-    for page in pages:
-        s3objects.extend(page['Contents'])
 
-    return s3objects
+def stage_s3objects(s3objects, staged):
+    for s3object in s3objects:
+        staged.append(s3object)
+        yield s3object
 
 
-def count_remaining_and_request_restores(s3_rsrc, bucket, s3objects):
-    restored_count = 0
-    pending_count = 0
-    just_requested_count = 0
-    not_glacier_count = 0
+def request_restore(source_client, bucket, s3object):
+    try:
+        response = source_client.restore_object(
+            Bucket=bucket,
+            Key=s3object.key,
+            RestoreRequest={'Days': RESTORE_DAYS, 'GlacierJobParameters': {'Tier': TIER}}
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'RestoreAlreadyInProgress':
+            raise
+        s3object.restore = RESTORE_UNKNOWN
+        return RESTORING
+    if response['ResponseMetadata']['HTTPStatusCode'] == 200:
+        # 200 instead of 202 means a restored copy is already there, and it now expires RESTORE_DAYS from now
+        s3object.restore = RESTORE_DONE
+        s3object.restore_expiry = time.time() + RESTORE_DAYS * SECONDS_PER_DAY
+        return RESTORED
+    s3object.restore = RESTORE_UNKNOWN
+    return REQUESTING_RESTORE
+
+
+def check_s3object(source_client, bucket, s3object):
+    # The restore state comes from the listing. Once a restore is pending it can change at any time,
+    # so it becomes RESTORE_UNKNOWN and is looked up with a HEAD on the next check
+    if s3object.storage_class not in ARCHIVE_STORAGE_CLASSES:
+        return READY
+    if s3object.restore == NO_RESTORE:
+        return request_restore(source_client, bucket, s3object)
+    if s3object.restore == RESTORE_UNKNOWN:
+        response = source_client.head_object(Bucket=bucket, Key=s3object.key)
+        restore = response.get('Restore')
+        if restore is None:
+            return request_restore(source_client, bucket, s3object)
+        parse_restore(s3object, restore)
+    if s3object.restore == RESTORE_IN_PROGRESS:
+        s3object.restore = RESTORE_UNKNOWN
+        return RESTORING
+    return RESTORED
+
+
+def check_s3object_status(source_client, bucket, s3object):
+    return s3object, check_s3object(source_client, bucket, s3object)
+
+
+def check_s3objects(source_client, bucket, s3objects, journal=None):
     logging.info('Checking storage class for the requested objects')
     logging.info('Objects in Glacier or Deep Archive need to be restored before they can be copied')
-    logging.info('Legend: 📦 ready to copy    🤙 requesting restore    📼 restoring    🪆 restored')
+    if metrics.emoji:
+        logging.info('Legend: 📦 ready to copy    🤙 requesting restore    📼 restoring    🪆 restored')
+    with ThreadPool(processes=MAX_RESTORE_THREADS) as pool:
+        for (s3object, status) in pool.imap_unordered(partial(check_s3object_status, source_client, bucket), s3objects):
+            metrics.show(status)
+            if status in METRIC_STATES:
+                metrics.count(METRIC_STATES[status], s3object.size)
+            if journal is not None:
+                journal.update(s3object, JOURNAL_STATES[status])
+            yield s3object, status
+    metrics.end_line()
+
+
+def log_counts(counts):
+    logging.info('📦 Ready to copy:      ' + str(counts[READY]))
+    logging.info('🤙 Requesting restore: ' + str(counts[REQUESTING_RESTORE]))
+    logging.info('📼 Restoring:          ' + str(counts[RESTORING]))
+    logging.info('🪆 Restored:           ' + str(counts[RESTORED]))
+
+
+def restore_s3objects(source_client, bucket, s3objects, scheduler, journal=None):
+    # Yields objects as soon as they are ready to copy. Objects whose restore is pending are
+    # handed to the scheduler, and only those are checked again, when they are due
+    while True:
+        counts = Counter()
+        for (s3object, status) in check_s3objects(source_client, bucket, s3objects, journal):
+            counts[status] = counts[status] + 1
+            if status == READY or status == RESTORED:
+                scheduler.done(s3object)
+                yield s3object
+            else:
+                scheduler.add(s3object, status == REQUESTING_RESTORE)
+        log_counts(counts)
+        s3objects = scheduler.next_due()
+        if not s3objects:
+            return
+
+
+def record_copy(journal, failures, s3object, error):
+    if error is None:
+        if journal is not None:
+            journal.update(s3object, STATE_COPIED)
+        metrics.count(METRIC_COPIED, s3object.size)
+        metrics.show('💾')
+        return
+    logging.error(f'Copying {s3object.key} failed: {error}')
+    metrics.count(METRIC_FAILED, s3object.size)
+    failures.append((s3object.key, error))
+    if journal is not None:
+        journal.update(s3object, STATE_FAILED, str(error))
+
+
+def copy_s3objects(copier, s3objects, journal=None):
+    failures = []
+    on_done = partial(record_copy, journal, failures)
     for s3object in s3objects:
-        obj = s3_rsrc.Object(bucket, s3object['Key'])
-        if obj.storage_class == 'GLACIER' or obj.storage_class == 'DEEP_ARCHIVE':
-            if obj.restore is None:
-                obj.restore_object(RestoreRequest={'Days': RESTORE_DAYS, 'GlacierJobParameters': {'Tier': TIER}})
-                just_requested_count = just_requested_count + 1
-                print('🤙', end='')
-                sys.stdout.flush()
-            elif 'ongoing-request="true"' in obj.restore:
-                print('📼', end='')
-                sys.stdout.flush()
-                pending_count = pending_count + 1
-            elif 'ongoing-request="false"' in obj.restore:
-                print('🪆', end='')
-                sys.stdout.flush()
-                restored_count = restored_count + 1
-        else:
-            print('📦', end='')
-            sys.stdout.flush()
-            not_glacier_count = not_glacier_count + 1
-    print('')
-    logging.info('📦 Ready to copy:      ' + str(not_glacier_count))
-    logging.info('🤙 Requesting restore: ' + str(just_requested_count))
-    logging.info('📼 Restoring:          ' + str(pending_count))
-    logging.info('🪆 Restored:           ' + str(restored_count))
-    return pending_count + just_requested_count
-
-
-def copy_s3object(source_client, source_bucket, dest_bucket, copy_to_glacier, s3object):
-    sys.stdout.flush()
-    extra_args = None
-    if copy_to_glacier:
-        extra_args = {'StorageClass': 'GLACIER'}
-    source_client.copy(
-        CopySource={'Bucket': source_bucket, 'Key': s3object['Key']},
-        Bucket=dest_bucket,
-        Key=s3object['Key'],
-        ExtraArgs=extra_args
-    )
-    print('💾', end='')
+        copier.submit(s3object, on_done, copy_priority(s3object))
+    copier.join()
+    metrics.end_line()
+    return failures
+
+
+def copy_priority(s3object):
+    # Restored copies that expire first are copied first, objects that don't expire go last
+    return s3object.restore_expiry if s3object.restore_expiry is not None else math.inf
+
+
+def restore_again(scheduler, s3object):
+    logging.warning(f'Restored copy of {s3object.key} expired before it was copied, restoring it again')
+    s3object.restore = NO_RESTORE
+    s3object.restore_expiry = None
+    scheduler.check_now(s3object)
+
+
+def record_pipelined_copy(scheduler, journal, failures, s3object, error):
+    if isinstance(error, RestoreExpired) or (
+            isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] == 'InvalidObjectState'
+    ):
+        restore_again(scheduler, s3object)
+        return
+    record_copy(journal, failures, s3object, error)
+
+
+def copy_pipelined(source_client, source_bucket, copier, s3objects, scheduler, journal=None):
+    # Ready objects are copied while the rest are still being restored. The restore checks run
+    # in this thread, the copies in the copier's workers in order of expiry
+    failures = []
+    on_done = partial(record_pipelined_copy, scheduler, journal, failures)
+    while True:
+        for s3object in restore_s3objects(source_client, source_bucket, s3objects, scheduler, journal):
+            copier.submit(s3object, on_done, copy_priority(s3object))
+        # Copies of expired objects go back to the scheduler, the job is done once none came back
+        copier.join()
+        s3objects = scheduler.next_due()
+        if not s3objects:
+            break
+    metrics.end_line()
+    return failures
+
+
+def restore_and_copy(source_client, source_bucket, copier, listing, scheduler, journal=None):
+    # The first pass checks objects while they are being listed. Without a journal they are
+    # kept in memory for the copy, with one they are read back from it
+    s3objects = []
+    if journal is None:
+        listing = stage_s3objects(listing, s3objects)
 
+    ready_count = sum(1 for _ in restore_s3objects(source_client, source_bucket, listing, scheduler, journal))
+    logging.info(f'{ready_count} objects are ready to copy')
 
-def copy_s3objects(source_client, source_bucket, dest_bucket, s3objects, copy_to_glacier):
-    pool = ThreadPool(processes=NUMBER_OF_COPY_THREADS)
-    pool.map(partial(copy_s3object, source_client, source_bucket, dest_bucket, copy_to_glacier), s3objects)
-    print('')
+    if journal is not None:
+        s3objects = journal.pending()
+    logging.info('Copying objects from ' + source_bucket + ' to ' + copier.dest_bucket)
+    return copy_s3objects(copier, s3objects, journal)
+
+
+def verify_s3object(source_client, destination_client, source_bucket, destination_bucket, s3object):
+    # A HEAD on an archived object doesn't need a restore
+    try:
+        source = source_client.head_object(Bucket=source_bucket, Key=s3object.key, ChecksumMode='ENABLED')
+        try:
+            destination = destination_client.head_object(
+                Bucket=destination_bucket,
+                Key=s3object.key,
+                ChecksumMode='ENABLED'
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in NOT_FOUND_ERROR_CODES:
+                raise
+            return s3object, MISSING
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+        logging.error(f'Verifying {s3object.key} failed: {e}')
+        return s3object, METRIC_FAILED
+    return s3object, compare_heads(source, destination)
+
+
+def verify_s3objects(source_client, destination_client, source_bucket, destination_bucket, s3objects):
+    # Returns the keys that are missing, differ or couldn't be checked
+    failures = []
+    counts = Counter()
+    with ThreadPool(processes=MAX_RESTORE_THREADS) as pool:
+        for (s3object, status) in pool.imap_unordered(
+                partial(verify_s3object, source_client, destination_client, source_bucket, destination_bucket),
+                s3objects
+        ):
+            counts[status] = counts[status] + 1
+            metrics.count(status, s3object.size)
+            if status in (MISMATCHED, MISSING, METRIC_FAILED):
+                if status != METRIC_FAILED:
+                    logging.error(f'{s3object.key} is {status} in {destination_bucket}')
+                failures.append((s3object.key, status))
+    logging.info(f'Verified objects: {dict(counts)}')
+    return failures
+
+
+def without_option(argv, option):
+    # Drops an option and its value from a command line
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        elif not arg.startswith(option + '='):
+            stripped.append(arg)
+    return stripped
+
+
+def parse_key_range(key_range):
+    # The empty strings of --key-range are open ends
+    if key_range is None:
+        return None
+    return tuple(key or None for key in key_range)
+
+
+def launch_shards(argv, processes, report_path, boundaries=None):
+    # Runs the same job once per shard, each in its own process, and merges their reports. With boundaries,
+    # shard I lists the key range between boundaries I - 1 and I, there can be fewer shards than processes
+    # when the bucket has few folders. Without, every shard lists everything and keeps the keys that hash to it
+    key_ranges = [[] for _ in range(processes)]
+    if boundaries is not None:
+        key_ranges = [['--key-range', start, end] for (start, end) in zip([''] + boundaries, boundaries + [''])]
+        processes = len(key_ranges)
+    logging.info(f'Starting {processes} shard processes')
+    shards = [(index, processes) for index in range(processes)]
+    workers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv, '--shard', f'{index}/{count}', *key_range])
+        for ((index, count), key_range) in zip(shards, key_ranges)
+    ]
+    exit_codes = [worker.wait() for worker in workers]
+
+    if report_path is not None:
+        report_paths = [shard_path(report_path, shard) for shard in shards]
+        merge_report_files(report_path, [path for path in report_paths if os.path.exists(path)])
+
+    failed_shards = [f'{index}/{count}' for ((index, count), exit_code) in zip(shards, exit_codes) if exit_code != 0]
+    if failed_shards:
+        logging.error(f'Shard(s) {", ".join(failed_shards)} failed')
+        return 1
+    return 0
 
 
 def main():
@@ -111,21 +457,100 @@ def main():
     parser.add_argument('source_bucket')
     parser.add_argument('destination_bucket')
     parser.add_argument('-f', '--fast-access', action='store_true', help=FAST_ACCESS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-p', '--pipeline', action='store_true', help=PIPELINE_FLAG_HELP_MESSAGE)
+    parser.add_argument('-j', '--journal', help=JOURNAL_FLAG_HELP_MESSAGE)
+    parser.add_argument('--restore-events', help=RESTORE_EVENTS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-s', '--sync', action='store_true', help=SYNC_FLAG_HELP_MESSAGE)
+    parser.add_argument('--verify', action='store_true', help=VERIFY_FLAG_HELP_MESSAGE)
+    parser.add_argument('--inventory', help=INVENTORY_FLAG_HELP_MESSAGE)
+    parser.add_argument('--destination-inventory', help=DESTINATION_INVENTORY_FLAG_HELP_MESSAGE)
+    parser.add_argument('--list-shards', type=int, default=LIST_SHARDS, help=LIST_SHARDS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--prefix', help=PREFIX_FLAG_HELP_MESSAGE)
+    parser.add_argument('--include', action='append', metavar='PATTERN', help=INCLUDE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--exclude', action='append', metavar='PATTERN', help=EXCLUDE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--min-size', type=parse_size, metavar='SIZE', help=MIN_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--max-size', type=parse_size, metavar='SIZE', help=MAX_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--modified-since', type=parse_time, metavar='DATE', help=MODIFIED_SINCE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--modified-before', type=parse_time, metavar='DATE', help=MODIFIED_BEFORE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--keys', help=KEYS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-t', '--threads', type=int, default=NUMBER_OF_COPY_THREADS, help=THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--max-threads', type=int, default=MAX_COPY_THREADS, help=MAX_THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--part-size', type=int, default=COPY_PART_SIZE_MB, help=PART_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument(
+        '--engine',
+        choices=[THREADS_ENGINE, ASYNCIO_ENGINE],
+        default=THREADS_ENGINE,
+        help=ENGINE_FLAG_HELP_MESSAGE
+    )
+    parser.add_argument('--in-flight', type=int, default=IN_FLIGHT, help=IN_FLIGHT_FLAG_HELP_MESSAGE)
+    parser.add_argument('-e', '--emoji', action='store_true', help=EMOJI_FLAG_HELP_MESSAGE)
+    parser.add_argument('--metrics', help=METRICS_FLAG_HELP_MESSAGE)
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        default=PROGRESS_INTERVAL,
+        help=PROGRESS_INTERVAL_FLAG_HELP_MESSAGE
+    )
+    parser.add_argument('--shard', type=parse_shard, help=SHARD_FLAG_HELP_MESSAGE)
+    parser.add_argument('--processes', type=int, default=1, help=PROCESSES_FLAG_HELP_MESSAGE)
+    parser.add_argument('--key-range', nargs=2, metavar=('START', 'END'), help=KEY_RANGE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--report', help=REPORT_FLAG_HELP_MESSAGE)
 
     parser.print_usage()
 
     args = parser.parse_args()
 
+    if args.processes > 1:
+        if args.shard is not None or args.key_range is not None:
+            logging.error('--shard or --key-range and --processes can\'t be used together')
+            return 1
+        boundaries = None
+        if args.inventory is None and args.keys is None:
+            # The folders are listed once here, instead of every process listing the whole bucket
+            client = ClientFactory().client(SOURCE_ARCHIVE_PROFILE_NAME)
+            boundaries = find_boundaries(client, args.source_bucket, args.processes, args.prefix or '')
+        return launch_shards(without_option(sys.argv[1:], '--processes'), args.processes, args.report, boundaries)
+
+    if args.keys is not None and args.inventory is not None:
+        logging.error('--keys and --inventory can\'t be used together')
+        return 1
+
+    key_range = parse_key_range(args.key_range)
+    if key_range is not None and (args.keys is not None or args.inventory is not None):
+        logging.error('--key-range only works with bucket listings, not with --keys or --inventory')
+        return 1
+    # A key range is the shard's own keys already, a hash shard has to be picked out of the whole listing
+    hash_shard = args.shard if key_range is None else None
+
+    journal_path = args.journal
+    report_path = args.report
+    metrics_path = args.metrics
+    if args.shard is not None:
+        logging.info(f'Copying shard {args.shard[0]}/{args.shard[1]}')
+        if journal_path:
+            journal_path = shard_path(journal_path, args.shard)
+        if report_path is not None:
+            report_path = shard_path(report_path, args.shard)
+        if metrics_path is not None:
+            # The extension tells the format of the metrics, so the shard goes before it
+            (root, extension) = os.path.splitext(metrics_path)
+            metrics_path = shard_path(root, args.shard) + extension
+
     source_bucket = args.source_bucket
     destination_bucket = args.destination_bucket
     copy_to_glacier = not args.fast_access
 
-    botocore_config = botocore.config.Config(max_pool_connections=MAX_POOL_CONNECTIONS)
-    destination_client = boto3.client(S3_SERVICE_NAME, config=botocore_config)
-
-    source_session = boto3.Session(profile_name=SOURCE_ARCHIVE_PROFILE_NAME)
-    source_client = source_session.client(S3_SERVICE_NAME, config=botocore_config)
-    s3_rsrc = source_session.resource(S3_SERVICE_NAME)
+    # Every listing shard has a thread. Restore checks and verification HEADs use MAX_RESTORE_THREADS,
+    # copies up to MAX_THREADS. Restores and copies are retried by their limiters, so they have a source
+    # client of their own that makes a single attempt, and botocore doesn't retry a SlowDown behind their back
+    clients = ClientFactory()
+    destination_client = clients.client(max_pool_connections=MAX_RESTORE_THREADS + args.list_shards)
+    source_client = clients.client(SOURCE_ARCHIVE_PROFILE_NAME, max_pool_connections=args.list_shards)
+    limited_source_client = clients.client(
+        SOURCE_ARCHIVE_PROFILE_NAME,
+        max_pool_connections=args.max_threads + MAX_RESTORE_THREADS,
+        max_attempts=LIMITED_MAX_ATTEMPTS
+    )
 
     if not bucket_exists(source_client, source_bucket):
         logging.error(f'''Bucket {source_bucket} doesn't exist''')
@@ -135,16 +560,153 @@ def main():
         logging.error(f'''Bucket {destination_bucket} doesn't exist''')
         return 1
 
-    logging.info('Populating list of objects...')
-
-    s3objects = get_s3objects(source_client, source_bucket)
+    # Restores and copies back off on their own, a throttled copy shouldn't hold up the restore requests
+    restore_client = LimitedClient(
+        limited_source_client,
+        AdaptiveLimiter('restore', NUMBER_OF_RESTORE_THREADS, MAX_RESTORE_THREADS)
+    )
+    copy_client = LimitedClient(limited_source_client, AdaptiveLimiter('copy', args.threads, args.max_threads))
+    metrics.emoji = args.emoji
+    metrics.instrument(source_client)
+    metrics.instrument(limited_source_client)
+    metrics.instrument(destination_client)
+    metrics.watch(restore_client.limiter)
+    metrics.watch(copy_client.limiter)
+
+    # Only the prefix is seen by S3, the other filters drop objects as they are listed,
+    # before anything is restored, copied or verified
+    selector = Selector(
+        args.prefix,
+        args.include,
+        args.exclude,
+        args.min_size,
+        args.max_size,
+        args.modified_since,
+        args.modified_before
+    )
 
-    while count_remaining_and_request_restores(s3_rsrc, source_bucket, s3objects) >= 1:
-        logging.info(f'😴 Sleeping {POLLING_INTERVAL_SECONDS} seconds')
-        time.sleep(POLLING_INTERVAL_SECONDS)
+    if args.verify:
+        logging.info(f'Verifying the objects of {source_bucket} against {destination_bucket}...')
+        listing = get_listing(
+            source_client,
+            source_bucket,
+            args.inventory,
+            args.list_shards,
+            False,
+            args.prefix,
+            args.keys,
+            key_range
+        )
+        if selector.active:
+            listing = selector.select(listing)
+        if hash_shard is not None:
+            listing = shard_s3objects(listing, hash_shard)
+        metrics.start(args.progress_interval, metrics_path)
+        try:
+            failures = verify_s3objects(restore_client, destination_client, source_bucket, destination_bucket, listing)
+        finally:
+            metrics.stop(metrics_path)
+        if failures:
+            logging.error(f'{len(failures)} object(s) are missing from {destination_bucket}, differ or failed to verify')
+            return 1
+        logging.info('Objects verified.')
+        return 0
+
+    events = None
+    if args.restore_events:
+        events = RestoreEvents(args.restore_events)
+    scheduler = RestoreScheduler(TIER, events)
+
+    if args.engine == ASYNCIO_ENGINE:
+        try:
+            create_client = aiobotocore_client_factory(SOURCE_ARCHIVE_PROFILE_NAME, args.in_flight)
+        except ImportError:
+            logging.error(f'The {ASYNCIO_ENGINE} engine needs aiobotocore: pip install aiobotocore')
+            return 1
+        async_copy_limiter = AsyncAdaptiveLimiter('copy', args.threads, args.in_flight)
+        copier = AsyncCopier(
+            create_client,
+            source_bucket,
+            destination_bucket,
+            copy_to_glacier,
+            args.part_size * MB,
+            args.in_flight,
+            async_copy_limiter
+        )
+        # aiobotocore emits the same events as botocore, and calls plain functions as well as coroutines
+        metrics.instrument(copier.client)
+        metrics.watch(async_copy_limiter)
+    else:
+        copier = Copier(
+            copy_client,
+            source_bucket,
+            destination_bucket,
+            copy_to_glacier,
+            args.part_size * MB,
+            args.max_threads
+        )
+    journal = None
+    if journal_path:
+        journal = Journal(journal_path)
+    report = None
+    if report_path is not None:
+        report = Report(args.shard)
+    metrics.start(args.progress_interval, metrics_path)
+    try:
+        if journal is not None and journal.listing_complete:
+            logging.info(f'Resuming from journal {journal_path}: {journal.counts()}')
+            listing = journal.pending()
+        else:
+            logging.info('Populating list of objects...')
+            listing = get_listing(
+                source_client,
+                source_bucket,
+                args.inventory,
+                args.list_shards,
+                args.sync,
+                args.prefix,
+                args.keys,
+                key_range
+            )
+            if selector.active:
+                listing = selector.select(listing)
+            if hash_shard is not None:
+                listing = shard_s3objects(listing, hash_shard)
+            if args.sync:
+                destination_listing = get_listing(
+                    destination_client,
+                    destination_bucket,
+                    args.destination_inventory,
+                    args.list_shards,
+                    args.sync,
+                    args.prefix,
+                    key_range=key_range
+                )
+                if hash_shard is not None:
+                    destination_listing = shard_s3objects(destination_listing, hash_shard)
+                listing = diff_s3objects(listing, destination_listing)
+            if journal is not None:
+                listing = journal.add(listing)
+        if report is not None:
+            listing = report.count(listing)
+
+        if args.pipeline:
+            logging.info('Copying objects from ' + source_bucket + ' to ' + destination_bucket + ' as they are restored')
+            failures = copy_pipelined(restore_client, source_bucket, copier, listing, scheduler, journal)
+        else:
+            failures = restore_and_copy(restore_client, source_bucket, copier, listing, scheduler, journal)
+        if report is not None:
+            report.failures = failures
+            report.write(report_path, journal.counts() if journal is not None else None)
+        if failures:
+            logging.error(f'{len(failures)} object(s) failed to copy')
+            return 1
+    finally:
+        copier.close()
+        if journal is not None:
+            journal.close()
+        metrics.stop(metrics_path)
 
-    logging.info('Copying objects from ' + source_bucket + ' to ' + destination_bucket)
-    copy_s3objects(source_client, source_bucket, destination_bucket, s3objects, copy_to_glacier)
     logging.info('Objects copied.')
     logging.info('Restoration complete.')
 
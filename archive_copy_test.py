@@ -1,31 +1,55 @@
+import json
+import math
+import os
+import tempfile
+import time
+import types
 import unittest
 from argparse import Namespace
-from unittest.mock import patch, call
+from datetime import datetime, timezone
+from unittest.mock import patch, call, MagicMock, ANY
+
+import botocore
 
 import archive_copy
+import clients
+from copier import Copier, MB
+from journal import STATE_COPIED, STATE_FAILED, STATE_RESTORED
+from limiter import AsyncAdaptiveLimiter
+from report import in_shard
+from s3object import S3Object, RESTORE_UNKNOWN, RESTORE_IN_PROGRESS, RESTORE_DONE
+from scheduler import RestoreScheduler
+
+
+def profile_sessions(mock_boto3_session):
+    # One session per profile, so the source client (source_archive_profile) and the destination client
+    # (default profile) can be told apart
+    sessions = {None: MagicMock(), archive_copy.SOURCE_ARCHIVE_PROFILE_NAME: MagicMock()}
+    mock_boto3_session.side_effect = lambda profile_name=None: sessions[profile_name]
+    return sessions[archive_copy.SOURCE_ARCHIVE_PROFILE_NAME], sessions[None]
 
 
 @patch('archive_copy.ArgumentParser')
 @patch('boto3.Session')
-@patch('boto3.client')
 @patch('botocore.config.Config')
 @patch('logging.info')
 @patch('logging.error')
 @patch('logging.basicConfig')
 @patch('archive_copy.bucket_exists', return_value=True)
-@patch('archive_copy.copy_s3objects')
-@patch('archive_copy.count_remaining_and_request_restores', return_value=0)
+@patch('archive_copy.copy_s3objects', return_value=[])
+@patch('archive_copy.restore_s3objects', side_effect=lambda client, bucket, s3objects, scheduler, journal: iter(list(s3objects)))
+@patch('archive_copy.Copier')
 class TestArchiveCopy(unittest.TestCase):
     def test_main(
             self,
-            mock_count_remaining_and_request_restores,
+            mock_copier_constructor,
+            mock_restore_s3objects,
             mock_copy_s3objects,
             mock_bucket_exists,
             mock_logging_basic_config,
             mock_logging_error,
             mock_logging_info,
             mock_botocore_config_constructor,
-            mock_boto3_client,
             mock_boto3_session,
             mock_argument_parser
     ):
@@ -41,20 +65,22 @@ class TestArchiveCopy(unittest.TestCase):
         expected_s3_objects = ['file1.csv', 'file2.csv']
         expected_source_bucket = 'my-old-archives'
         expected_destination_bucket = 'my-new-archives'
-        expected_args = Namespace(source_bucket=expected_source_bucket, destination_bucket=expected_destination_bucket, fast_access=False)
+        expected_args = Namespace(source_bucket=expected_source_bucket, destination_bucket=expected_destination_bucket, fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
         expected_exit_code = 0
         expected_log_format = archive_copy.LOG_FORMAT
-        expected_s3_service_name = archive_copy.S3_SERVICE_NAME
+        expected_s3_service_name = clients.S3_SERVICE_NAME
         expected_profile_name = archive_copy.SOURCE_ARCHIVE_PROFILE_NAME
-        expected_max_pool_connections = archive_copy.MAX_POOL_CONNECTIONS
+        expected_max_pool_connections = 100 + archive_copy.MAX_RESTORE_THREADS
         expected_copy_to_glacier = True
+        expected_part_size = 256 * archive_copy.MB
+        expected_threads = 10
+        expected_max_threads = 100
 
         mock_parser = mock_argument_parser.return_value
-        mock_source_session = mock_boto3_session.return_value
+        (mock_source_session, mock_destination_session) = profile_sessions(mock_boto3_session)
         mock_source_client = mock_source_session.client.return_value
-        mock_s3_rsrc = mock_source_session.resource.return_value
         mock_botocore_config = mock_botocore_config_constructor.return_value
-        mock_destination_client = mock_boto3_client.Client.return_value
+        mock_destination_client = mock_destination_session.client.return_value
         mock_parser.parse_args.return_value = expected_args
 
         expected_add_argument_calls = [
@@ -79,35 +105,44 @@ class TestArchiveCopy(unittest.TestCase):
             mock_parser.print_usage.assert_called()
             mock_parser.parse_args.assert_called()
             mock_logging_basic_config.assert_called_with(level=archive_copy.LOG_LEVEL, format=expected_log_format)
-            mock_botocore_config_constructor.assert_called_with(max_pool_connections=expected_max_pool_connections)
-            mock_boto3_client.assert_called_with(expected_s3_service_name, config=mock_botocore_config)
+            mock_botocore_config_constructor.assert_called_with(
+                max_pool_connections=expected_max_pool_connections,
+                retries={'mode': clients.RETRY_MODE, 'total_max_attempts': clients.LIMITED_MAX_ATTEMPTS},
+                tcp_keepalive=True
+            )
+            mock_destination_session.client.assert_called_with(expected_s3_service_name, config=mock_botocore_config)
             mock_boto3_session.assert_called_with(profile_name=expected_profile_name)
             mock_source_session.client.assert_called_with(expected_s3_service_name, config=mock_botocore_config)
             mock_bucket_exists.asset_has_calls(expected_bucket_exists_calls)
-            mock_get_s3objects.assert_called_with(mock_source_client, expected_source_bucket)
-            mock_count_remaining_and_request_restores.assert_called_with(
-                mock_s3_rsrc,
-                expected_source_bucket,
-                expected_s3_objects
-            )
-            mock_copy_s3objects.assert_called_with(
-                mock_source_client,
+            mock_get_s3objects.assert_called_with(mock_source_client, expected_source_bucket, 16, None, None)
+            (actual_restore_client, actual_restore_bucket) = mock_restore_s3objects.call_args.args[:2]
+            self.assertIs(actual_restore_client.client, mock_source_client)
+            self.assertEqual(actual_restore_client.limiter.maximum, archive_copy.MAX_RESTORE_THREADS)
+            self.assertEqual(actual_restore_bucket, expected_source_bucket)
+            mock_copier_constructor.assert_called_with(
+                ANY,
                 expected_source_bucket,
                 expected_destination_bucket,
-                expected_s3_objects,
-                expected_copy_to_glacier
+                expected_copy_to_glacier,
+                expected_part_size,
+                expected_max_threads
             )
+            actual_copy_client = mock_copier_constructor.call_args.args[0]
+            self.assertIs(actual_copy_client.client, mock_source_client)
+            self.assertEqual((actual_copy_client.limiter.limit, actual_copy_client.limiter.maximum), (expected_threads, expected_max_threads))
+            mock_copy_s3objects.assert_called_with(mock_copier_constructor.return_value, expected_s3_objects, None)
+            mock_copier_constructor.return_value.close.assert_called()
 
     def test_main_fast_access(
             self,
-            mock_count_remaining_and_request_restores,
+            mock_copier_constructor,
+            mock_restore_s3objects,
             mock_copy_s3objects,
             mock_bucket_exists,
             mock_logging_basic_config,
             mock_logging_error,
             mock_logging_info,
             mock_botocore_config_constructor,
-            mock_boto3_client,
             mock_boto3_session,
             mock_argument_parser
     ):
@@ -122,20 +157,22 @@ class TestArchiveCopy(unittest.TestCase):
         expected_s3_objects = ['file1.csv', 'file2.csv']
         expected_source_bucket = 'my-old-archives'
         expected_destination_bucket = 'my-new-archives'
-        expected_args = Namespace(source_bucket=expected_source_bucket, destination_bucket=expected_destination_bucket, fast_access=True)
+        expected_args = Namespace(source_bucket=expected_source_bucket, destination_bucket=expected_destination_bucket, fast_access=True, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
         expected_exit_code = 0
         expected_log_format = archive_copy.LOG_FORMAT
-        expected_s3_service_name = archive_copy.S3_SERVICE_NAME
+        expected_s3_service_name = clients.S3_SERVICE_NAME
         expected_profile_name = archive_copy.SOURCE_ARCHIVE_PROFILE_NAME
-        expected_max_pool_connections = archive_copy.MAX_POOL_CONNECTIONS
+        expected_max_pool_connections = 100 + archive_copy.MAX_RESTORE_THREADS
         expected_copy_to_glacier = False
+        expected_part_size = 256 * archive_copy.MB
+        expected_threads = 10
+        expected_max_threads = 100
 
         mock_parser = mock_argument_parser.return_value
-        mock_source_session = mock_boto3_session.return_value
+        (mock_source_session, mock_destination_session) = profile_sessions(mock_boto3_session)
         mock_source_client = mock_source_session.client.return_value
-        mock_s3_rsrc = mock_source_session.resource.return_value
         mock_botocore_config = mock_botocore_config_constructor.return_value
-        mock_destination_client = mock_boto3_client.Client.return_value
+        mock_destination_client = mock_destination_session.client.return_value
         mock_parser.parse_args.return_value = expected_args
 
         expected_add_argument_calls = [
@@ -160,161 +197,945 @@ class TestArchiveCopy(unittest.TestCase):
             mock_parser.print_usage.assert_called()
             mock_parser.parse_args.assert_called()
             mock_logging_basic_config.assert_called_with(level=archive_copy.LOG_LEVEL, format=expected_log_format)
-            mock_botocore_config_constructor.assert_called_with(max_pool_connections=expected_max_pool_connections)
-            mock_boto3_client.assert_called_with(expected_s3_service_name, config=mock_botocore_config)
+            mock_botocore_config_constructor.assert_called_with(
+                max_pool_connections=expected_max_pool_connections,
+                retries={'mode': clients.RETRY_MODE, 'total_max_attempts': clients.LIMITED_MAX_ATTEMPTS},
+                tcp_keepalive=True
+            )
+            mock_destination_session.client.assert_called_with(expected_s3_service_name, config=mock_botocore_config)
             mock_boto3_session.assert_called_with(profile_name=expected_profile_name)
             mock_source_session.client.assert_called_with(expected_s3_service_name, config=mock_botocore_config)
             mock_bucket_exists.asset_has_calls(expected_bucket_exists_calls)
-            mock_get_s3objects.assert_called_with(mock_source_client, expected_source_bucket)
-            mock_count_remaining_and_request_restores.assert_called_with(
-                mock_s3_rsrc,
+            mock_get_s3objects.assert_called_with(mock_source_client, expected_source_bucket, 16, None, None)
+            (actual_restore_client, actual_restore_bucket) = mock_restore_s3objects.call_args.args[:2]
+            self.assertIs(actual_restore_client.client, mock_source_client)
+            self.assertEqual(actual_restore_client.limiter.maximum, archive_copy.MAX_RESTORE_THREADS)
+            self.assertEqual(actual_restore_bucket, expected_source_bucket)
+            mock_copier_constructor.assert_called_with(
+                ANY,
                 expected_source_bucket,
-                expected_s3_objects
+                expected_destination_bucket,
+                expected_copy_to_glacier,
+                expected_part_size,
+                expected_max_threads
             )
-            mock_copy_s3objects.assert_called_with(
-                mock_source_client,
+            actual_copy_client = mock_copier_constructor.call_args.args[0]
+            self.assertIs(actual_copy_client.client, mock_source_client)
+            self.assertEqual((actual_copy_client.limiter.limit, actual_copy_client.limiter.maximum), (expected_threads, expected_max_threads))
+            mock_copy_s3objects.assert_called_with(mock_copier_constructor.return_value, expected_s3_objects, None)
+            mock_copier_constructor.return_value.close.assert_called()
+    def test_main_pipeline(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_s3_objects = ['file1.csv', 'file2.csv']
+        expected_source_bucket = 'my-old-archives'
+        expected_destination_bucket = 'my-new-archives'
+        expected_args = Namespace(source_bucket=expected_source_bucket, destination_bucket=expected_destination_bucket, fast_access=False, pipeline=True, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        mock_source_client = mock_boto3_session.return_value.client.return_value
+
+        with patch('archive_copy.get_s3objects', return_value=expected_s3_objects), \
+                patch('archive_copy.copy_pipelined', return_value=[]) as mock_copy_pipelined:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            mock_copy_pipelined.assert_called_with(
+                ANY,
                 expected_source_bucket,
-                expected_destination_bucket,
+                mock_copier_constructor.return_value,
                 expected_s3_objects,
-                expected_copy_to_glacier
+                ANY,
+                None
             )
+            self.assertIs(mock_copy_pipelined.call_args.args[0].client, mock_source_client)
+            self.assertIsInstance(mock_copy_pipelined.call_args.args[4], RestoreScheduler)
+            mock_restore_s3objects.assert_not_called()
+            mock_copy_s3objects.assert_not_called()
 
-@patch('boto3.client')
-class TestCopyS3Object(unittest.TestCase):
-    def test_copy_s3object_fast_access(
+    def test_main_resume_from_journal(
             self,
-            mock_boto3_client
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
     ):
         # Arrange
-        mock_source_client = mock_boto3_client.return_value
-        expected_source_bucket = 'my-old-archives'
-        expected_dest_bucket = 'my-new-archives'
-        expected_key = 'file1.csv'
-        expected_s3object = {
-            'Key': expected_key
+        expected_journal_path = 'job.sqlite'
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=expected_journal_path, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+
+        with patch('archive_copy.get_s3objects') as mock_get_s3objects, \
+                patch('archive_copy.Journal') as mock_journal_constructor:
+            mock_journal = mock_journal_constructor.return_value
+            mock_journal.listing_complete = True
+            mock_journal.pending.return_value = ['file1.csv']
+
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            mock_journal_constructor.assert_called_with(expected_journal_path)
+            mock_get_s3objects.assert_not_called()
+            self.assertIs(mock_restore_s3objects.call_args.args[4], mock_journal)
+            self.assertIs(mock_copy_s3objects.call_args.args[2], mock_journal)
+            mock_journal.close.assert_called()
+
+    def test_main_sync(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_source_s3objects = [S3Object('a.csv', 10, '"a"'), S3Object('b.csv', 10, '"b"')]
+        expected_destination_s3objects = [S3Object('a.csv', 10, '"a"')]
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=True, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        (mock_source_session, mock_destination_session) = profile_sessions(mock_boto3_session)
+        mock_source_client = mock_source_session.client.return_value
+        mock_destination_client = mock_destination_session.client.return_value
+
+        with patch('archive_copy.get_s3objects', side_effect=[iter(expected_source_s3objects), iter(expected_destination_s3objects)]) as mock_get_s3objects:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            mock_get_s3objects.assert_has_calls([
+                call(mock_source_client, 'my-old-archives', 16, None, None),
+                call(mock_destination_client, 'my-new-archives', 16, None, None),
+            ])
+            self.assertEqual(mock_copy_s3objects.call_args.args[1], expected_source_s3objects[1:])
+
+    def test_main_sync_inventory(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_source_s3objects = [S3Object('b.csv', 10, '"b"'), S3Object('a.csv', 10, '"a"')]
+        expected_destination_s3objects = [S3Object('a.csv', 10, '"a"')]
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=True, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory='s3://my-inventories/manifest.json', destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        (mock_source_session, mock_destination_session) = profile_sessions(mock_boto3_session)
+        mock_source_client = mock_source_session.client.return_value
+        mock_destination_client = mock_destination_session.client.return_value
+
+        with patch('archive_copy.read_inventory', return_value=iter(expected_source_s3objects)) as mock_read_inventory, \
+                patch('archive_copy.get_s3objects', return_value=iter(expected_destination_s3objects)) as mock_get_s3objects:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            mock_read_inventory.assert_called_with(mock_source_client, 's3://my-inventories/manifest.json', 'my-old-archives')
+            mock_get_s3objects.assert_called_once_with(mock_destination_client, 'my-new-archives', 16, None, None)
+            self.assertEqual(mock_copy_s3objects.call_args.args[1], expected_source_s3objects[:1])
+
+    def test_main_selection(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_source_s3objects = [
+            S3Object('logs/2024-01.gz', 10, '"a"'),
+            S3Object('logs/2024-02.gz', 10, '"b"'),
+            S3Object('logs/2024-02.txt', 10, '"c"'),
+            S3Object('logs/2024-03.gz', 10, '"d"'),
+        ]
+        expected_destination_s3objects = [S3Object('logs/2024-01.gz', 10, '"a"')]
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=True, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix='logs/', include=['*.gz'], exclude=['*-03.*'], min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        (mock_source_session, mock_destination_session) = profile_sessions(mock_boto3_session)
+        mock_source_client = mock_source_session.client.return_value
+        mock_destination_client = mock_destination_session.client.return_value
+
+        with patch('archive_copy.get_s3objects', side_effect=[iter(expected_source_s3objects), iter(expected_destination_s3objects)]) as mock_get_s3objects:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            mock_get_s3objects.assert_has_calls([
+                call(mock_source_client, 'my-old-archives', 16, 'logs/', None),
+                call(mock_destination_client, 'my-new-archives', 16, 'logs/', None),
+            ])
+            self.assertEqual(mock_copy_s3objects.call_args.args[1], expected_source_s3objects[1:2])
+
+    def test_main_keys_and_inventory(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory='manifest.json', destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys='keys.txt', key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+
+        # Act
+        actual_exit_code = archive_copy.main()
+
+        # Assert
+        self.assertEqual(actual_exit_code, 1)
+        mock_copy_s3objects.assert_not_called()
+
+    def test_main_shard(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        s3objects = [S3Object(f'file{i}.csv', 10, f'"{i}"') for i in range(20)]
+        expected_s3objects = [s3object for s3object in s3objects if in_shard(s3object.key, (1, 4))]
+        with tempfile.TemporaryDirectory() as directory:
+            expected_report_path = os.path.join(directory, 'report.json')
+            expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=(1, 4), processes=1, report=expected_report_path, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+            mock_argument_parser.return_value.parse_args.return_value = expected_args
+
+            with patch('archive_copy.get_s3objects', return_value=iter(s3objects)):
+                # Act
+                actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            self.assertEqual(mock_copy_s3objects.call_args.args[1], expected_s3objects)
+            with open(expected_report_path + '.1-of-4') as f:
+                actual_report = json.load(f)
+            self.assertEqual(actual_report['shards'], ['1-of-4'])
+            self.assertEqual(actual_report['objects'], len(expected_s3objects))
+            self.assertEqual(actual_report['copied'], len(expected_s3objects))
+
+    @patch('subprocess.Popen')
+    def test_main_processes(
+            self,
+            mock_popen,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal='copy.db', restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=3, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        mock_popen.return_value.wait.side_effect = [0, 1, 0]
+        argv = ['archive_copy.py', 'my-old-archives', 'my-new-archives', '--processes', '3', '-j', 'copy.db']
+
+        with patch('sys.argv', argv), \
+                patch('archive_copy.find_boundaries', return_value=['logs/', 'photos/']) as mock_find_boundaries:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+        # Assert
+        self.assertEqual(actual_exit_code, 1)
+        mock_find_boundaries.assert_called_once_with(mock_boto3_session.return_value.client.return_value, 'my-old-archives', 3, '')
+        actual_commands = [c.args[0] for c in mock_popen.call_args_list]
+        self.assertEqual([command[2:] for command in actual_commands], [
+            ['my-old-archives', 'my-new-archives', '-j', 'copy.db', '--shard', '0/3', '--key-range', '', 'logs/'],
+            ['my-old-archives', 'my-new-archives', '-j', 'copy.db', '--shard', '1/3', '--key-range', 'logs/', 'photos/'],
+            ['my-old-archives', 'my-new-archives', '-j', 'copy.db', '--shard', '2/3', '--key-range', 'photos/', ''],
+        ])
+        mock_logging_error.assert_called_with('Shard(s) 1/3 failed')
+
+    @patch('subprocess.Popen')
+    def test_main_processes_inventory(
+            self,
+            mock_popen,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory='manifest.json', destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=2, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        mock_popen.return_value.wait.return_value = 0
+        argv = ['archive_copy.py', 'my-old-archives', 'my-new-archives', '--processes', '2', '--inventory', 'manifest.json']
+
+        with patch('sys.argv', argv):
+            # Act
+            actual_exit_code = archive_copy.main()
+
+        # Assert
+        self.assertEqual(actual_exit_code, 0)
+        actual_commands = [c.args[0] for c in mock_popen.call_args_list]
+        self.assertEqual([command[2:] for command in actual_commands], [
+            ['my-old-archives', 'my-new-archives', '--inventory', 'manifest.json', '--shard', '0/2'],
+            ['my-old-archives', 'my-new-archives', '--inventory', 'manifest.json', '--shard', '1/2'],
+        ])
+        mock_boto3_session.assert_not_called()
+
+    def test_main_key_range(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        s3objects = [S3Object(f'logs/file{i}.csv', 10, f'"{i}"') for i in range(20)]
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='threads', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=(1, 3), processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=['logs/', 'photos/'])
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+        (mock_source_session, _) = profile_sessions(mock_boto3_session)
+
+        with patch('archive_copy.get_s3objects', return_value=iter(s3objects)) as mock_get_s3objects:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+        # Assert
+        self.assertEqual(actual_exit_code, 0)
+        mock_get_s3objects.assert_called_with(mock_source_session.client.return_value, 'my-old-archives', 16, None, ('logs/', 'photos/'))
+        self.assertEqual(mock_copy_s3objects.call_args.args[1], s3objects)
+
+
+    def test_main_asyncio_engine(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_s3_objects = ['file1.csv', 'file2.csv']
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='asyncio', in_flight=1000, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+
+        with patch('archive_copy.get_s3objects', return_value=expected_s3_objects), \
+                patch('archive_copy.aiobotocore_client_factory') as mock_client_factory, \
+                patch('archive_copy.AsyncCopier') as mock_async_copier_constructor:
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            mock_client_factory.assert_called_with(archive_copy.SOURCE_ARCHIVE_PROFILE_NAME, 1000)
+            mock_async_copier_constructor.assert_called_with(
+                mock_client_factory.return_value,
+                'my-old-archives',
+                'my-new-archives',
+                True,
+                256 * archive_copy.MB,
+                1000,
+                ANY
+            )
+            actual_limiter = mock_async_copier_constructor.call_args.args[6]
+            self.assertIsInstance(actual_limiter, AsyncAdaptiveLimiter)
+            self.assertEqual((int(actual_limiter.limit), actual_limiter.maximum), (10, 1000))
+            mock_copier_constructor.assert_not_called()
+            actual_events = mock_async_copier_constructor.return_value.client.meta.events
+            self.assertEqual(
+                [c.args[0] for c in actual_events.register.call_args_list],
+                ['before-parameter-build.s3', 'after-call.s3', 'needs-retry.s3']
+            )
+            mock_copy_s3objects.assert_called_with(mock_async_copier_constructor.return_value, expected_s3_objects, None)
+            mock_async_copier_constructor.return_value.close.assert_called()
+
+    def test_main_asyncio_engine_not_installed(
+            self,
+            mock_copier_constructor,
+            mock_restore_s3objects,
+            mock_copy_s3objects,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+            mock_botocore_config_constructor,
+            mock_boto3_session,
+            mock_argument_parser
+    ):
+        # Arrange
+        expected_args = Namespace(source_bucket='my-old-archives', destination_bucket='my-new-archives', fast_access=False, pipeline=False, journal=None, restore_events=None, sync=False, threads=10, max_threads=100, part_size=256, engine='asyncio', in_flight=500, list_shards=16, inventory=None, destination_inventory=None, emoji=False, metrics=None, progress_interval=30, shard=None, processes=1, report=None, verify=False, prefix=None, include=None, exclude=None, min_size=None, max_size=None, modified_since=None, modified_before=None, keys=None, key_range=None)
+        mock_argument_parser.return_value.parse_args.return_value = expected_args
+
+        with patch('archive_copy.aiobotocore_client_factory', side_effect=ImportError):
+            # Act
+            actual_exit_code = archive_copy.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 1)
+            mock_logging_error.assert_called_with('The asyncio engine needs aiobotocore: pip install aiobotocore')
+            mock_copy_s3objects.assert_not_called()
+
+class TestCheckS3Object(unittest.TestCase):
+    def test_check_s3object_standard(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        expected_s3object = S3Object('file1.csv', storage_class='STANDARD')
+
+        # Act
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.READY)
+        mock_source_client.head_object.assert_not_called()
+        mock_source_client.restore_object.assert_not_called()
+
+    def test_check_s3object_requests_restore(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        mock_source_client.restore_object.return_value = {'ResponseMetadata': {'HTTPStatusCode': 202}}
+        expected_s3object = S3Object('file1.csv', storage_class='DEEP_ARCHIVE')
+
+        # Act
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.REQUESTING_RESTORE)
+        mock_source_client.head_object.assert_not_called()
+        mock_source_client.restore_object.assert_called_with(
+            Bucket='my-old-archives',
+            Key='file1.csv',
+            RestoreRequest={'Days': archive_copy.RESTORE_DAYS, 'GlacierJobParameters': {'Tier': archive_copy.TIER}}
+        )
+        self.assertEqual(expected_s3object.restore, RESTORE_UNKNOWN)
+
+    def test_check_s3object_restore_already_in_progress(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        mock_source_client.restore_object.side_effect = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'RestoreAlreadyInProgress'}},
+            'RestoreObject'
+        )
+        expected_s3object = S3Object('file1.csv', storage_class='GLACIER')
+
+        # Act
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.RESTORING)
+
+    def test_check_s3object_already_restored(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        mock_source_client.restore_object.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        expected_s3object = S3Object('file1.csv', storage_class='GLACIER')
+
+        # Act
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.RESTORED)
+
+    def test_check_s3object_restoring_from_listing(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        expected_s3object = S3Object('file1.csv', storage_class='GLACIER', restore=RESTORE_IN_PROGRESS)
+
+        # Act
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.RESTORING)
+        mock_source_client.head_object.assert_not_called()
+        self.assertEqual(expected_s3object.restore, RESTORE_UNKNOWN)
+
+    def test_check_s3object_restored_from_listing(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        expected_s3object = S3Object('file1.csv', storage_class='GLACIER', restore=RESTORE_DONE)
+
+        # Act
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.RESTORED)
+        mock_source_client.head_object.assert_not_called()
+
+    def test_check_s3object_pending(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        mock_source_client.head_object.return_value = {
+            'StorageClass': 'GLACIER',
+            'Restore': 'ongoing-request="false", expiry-date="Fri, 21 Dec 2012 00:00:00 GMT"'
         }
-        expected_copy_to_glacier = False
+        expected_s3object = S3Object('file1.csv', storage_class='GLACIER', restore=RESTORE_UNKNOWN)
 
         # Act
-        archive_copy.copy_s3object(
-            mock_source_client,
-            expected_source_bucket,
-            expected_dest_bucket,
-            expected_copy_to_glacier,
-            expected_s3object,
+        actual_status = archive_copy.check_s3object(mock_source_client, 'my-old-archives', expected_s3object)
+
+        # Assert
+        self.assertEqual(actual_status, archive_copy.RESTORED)
+        mock_source_client.head_object.assert_called_with(Bucket='my-old-archives', Key='file1.csv')
+        self.assertEqual(expected_s3object.restore, RESTORE_DONE)
+        self.assertEqual(expected_s3object.restore_expiry, datetime(2012, 12, 21, tzinfo=timezone.utc).timestamp())
+
+
+class TestGetS3Objects(unittest.TestCase):
+    def test_get_s3objects(self):
+        # Arrange
+        mock_source_client = MagicMock()
+        expected_s3objects = [
+            S3Object('file1.csv', 10, '"etag1"', 'STANDARD'),
+            S3Object('file2.csv', 20, '"etag2"', 'GLACIER', RESTORE_DONE, 1356048000.0),
+            S3Object('file3.csv', 30, '"etag3"', 'DEEP_ARCHIVE', RESTORE_IN_PROGRESS),
+        ]
+        mock_source_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
+                {'Key': 'file1.csv', 'Size': 10, 'ETag': '"etag1"', 'StorageClass': 'STANDARD', 'Owner': {'ID': 'owner'}},
+                {'Key': 'file2.csv', 'Size': 20, 'ETag': '"etag2"', 'StorageClass': 'GLACIER', 'RestoreStatus': {
+                    'IsRestoreInProgress': False,
+                    'RestoreExpiryDate': datetime(2012, 12, 21, tzinfo=timezone.utc)
+                }},
+            ]},
+            {'Contents': [
+                {'Key': 'file3.csv', 'Size': 30, 'ETag': '"etag3"', 'StorageClass': 'DEEP_ARCHIVE', 'RestoreStatus': {
+                    'IsRestoreInProgress': True
+                }},
+            ]},
+            {},
+        ]
+
+        # Act
+        actual_s3objects = archive_copy.get_s3objects(mock_source_client, 'my-old-archives')
+
+        # Assert
+        self.assertIsInstance(actual_s3objects, types.GeneratorType)
+        self.assertEqual(list(actual_s3objects), expected_s3objects)
+        mock_source_client.get_paginator.return_value.paginate.assert_called_with(
+            Bucket='my-old-archives',
+            OptionalObjectAttributes=['RestoreStatus']
         )
 
+
+class TestGetListing(unittest.TestCase):
+    def test_get_listing_prefix(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [{'Key': 'customer-42/file1.csv', 'Size': 10}]},
+        ]
+
+        # Act
+        actual_keys = [s3object.key for s3object in archive_copy.get_listing(mock_client, 'my-old-archives', None, 1, False, 'customer-42/')]
+
         # Assert
-        mock_source_client.copy.assert_called_with(
-            CopySource={'Bucket': expected_source_bucket, 'Key': expected_key},
-            Bucket=expected_dest_bucket,
-            Key=expected_key,
-            ExtraArgs=None
+        self.assertEqual(actual_keys, ['customer-42/file1.csv'])
+        mock_client.get_paginator.return_value.paginate.assert_called_with(
+            Bucket='my-old-archives',
+            OptionalObjectAttributes=['RestoreStatus'],
+            Prefix='customer-42/'
         )
 
-    def test_copy_s3object_glacier(
+    def test_get_listing_keys_sorted(self):
+        # Arrange
+        s3objects = [S3Object('b.csv', 10), S3Object('a.csv', 20)]
+
+        with patch('archive_copy.read_key_list', return_value=iter(s3objects)) as mock_read_key_list:
+            # Act
+            actual_s3objects = list(archive_copy.get_listing('client', 'my-old-archives', None, 16, True, keys='keys.txt'))
+
+            # Assert
+            self.assertEqual(actual_s3objects, s3objects[::-1])
+            mock_read_key_list.assert_called_with('client', 'my-old-archives', 'keys.txt')
+
+
+class TestDiffS3Objects(unittest.TestCase):
+    @patch('logging.info')
+    def test_diff_s3objects(self, mock_logging_info):
+        # Arrange
+        source = [
+            S3Object('a.csv', 10, '"aaaa"'),
+            S3Object('b.csv', 10, '"bbbb"'),
+            S3Object('c.csv', 10, '"cccc"'),
+            S3Object('d.csv', 10, '"dddd"'),
+            S3Object('e.csv', 20, '"eeee-2"'),
+            S3Object('f.csv', 20, '"ffff"'),
+            S3Object('g.csv', 10, '"gggg"'),
+        ]
+        destination = [
+            S3Object('0.csv', 10, '"0000"'),
+            S3Object('a.csv', 10, '"aaaa"'),
+            S3Object('c.csv', 10, '"cccc2"'),
+            S3Object('d.csv', 11, '"dddd"'),
+            S3Object('e.csv', 20, '"eeee-4"'),
+            S3Object('f.csv', 20, '"ffff-3"'),
+        ]
+        expected_keys = ['b.csv', 'c.csv', 'd.csv', 'g.csv']
+
+        # Act
+        actual_s3objects = list(archive_copy.diff_s3objects(iter(source), iter(destination)))
+
+        # Assert
+        self.assertEqual([s3object.key for s3object in actual_s3objects], expected_keys)
+        mock_logging_info.assert_called_with('3 objects are already in the destination bucket and were skipped')
+
+    @patch('logging.info')
+    def test_diff_s3objects_empty_destination(self, mock_logging_info):
+        # Arrange
+        source = [S3Object('a.csv', 10, '"aaaa"'), S3Object('b.csv', 10, '"bbbb"')]
+
+        # Act
+        actual_s3objects = list(archive_copy.diff_s3objects(iter(source), iter([])))
+
+        # Assert
+        self.assertEqual(actual_s3objects, source)
+
+
+class TestStageS3Objects(unittest.TestCase):
+    def test_stage_s3objects(self):
+        # Arrange
+        expected_s3objects = [S3Object('file1.csv'), S3Object('file2.csv')]
+        actual_staged = []
+
+        # Act
+        actual_s3objects = list(archive_copy.stage_s3objects(iter(expected_s3objects), actual_staged))
+
+        # Assert
+        self.assertEqual(actual_s3objects, expected_s3objects)
+        self.assertEqual(actual_staged, expected_s3objects)
+
+
+@patch('scheduler.DEFAULT_RESTORE_TIME', (0, 0))
+@patch('builtins.print')
+@patch('logging.info')
+class TestRestoreS3Objects(unittest.TestCase):
+    def test_restore_s3objects(
             self,
-            mock_boto3_client
+            mock_logging_info,
+            mock_print
     ):
         # Arrange
-        mock_source_client = mock_boto3_client.return_value
-        expected_source_bucket = 'my-old-archives'
-        expected_dest_bucket = 'my-new-archives'
-        expected_key = 'file1.csv'
-        expected_s3object = {
-            'Key': expected_key
+        statuses = {
+            'file1.csv': [archive_copy.READY],
+            'file2.csv': [archive_copy.REQUESTING_RESTORE, archive_copy.RESTORING, archive_copy.RESTORED],
+            'file3.csv': [archive_copy.RESTORING, archive_copy.RESTORED],
+            'file4.csv': [archive_copy.RESTORED],
         }
-        expected_copy_to_glacier = True
+        expected_s3objects = [S3Object(key) for key in statuses]
+        mock_scheduler = RestoreScheduler('Test')
+        checked = []
+
+        def check_s3object(client, bucket, s3object):
+            checked.append(s3object.key)
+            return statuses[s3object.key].pop(0)
+
+        # Act
+        with patch('archive_copy.check_s3object', side_effect=check_s3object):
+            actual_s3objects = list(archive_copy.restore_s3objects(
+                MagicMock(),
+                'my-old-archives',
+                iter(expected_s3objects),
+                mock_scheduler
+            ))
+
+        # Assert
+        self.assertEqual(sorted(s3object.key for s3object in actual_s3objects), sorted(statuses))
+        self.assertEqual(sorted(checked), ['file1.csv', 'file2.csv', 'file2.csv', 'file2.csv', 'file3.csv', 'file3.csv', 'file4.csv'])
+        self.assertEqual(len(mock_scheduler), 0)
+        mock_logging_info.assert_any_call('📼 Restoring:          1')
+
+    def test_restore_s3objects_journal(
+            self,
+            mock_logging_info,
+            mock_print
+    ):
+        # Arrange
+        expected_s3object = S3Object('file1.csv')
+        mock_journal = MagicMock()
 
         # Act
-        archive_copy.copy_s3object(
+        with patch('archive_copy.check_s3object', return_value=archive_copy.READY):
+            list(archive_copy.restore_s3objects(
+                MagicMock(),
+                'my-old-archives',
+                [expected_s3object],
+                RestoreScheduler('Test'),
+                mock_journal
+            ))
+
+        # Assert
+        mock_journal.update.assert_called_with(expected_s3object, STATE_RESTORED)
+
+
+@patch('scheduler.DEFAULT_RESTORE_TIME', (0, 0))
+@patch('builtins.print')
+@patch('logging.info')
+@patch('logging.warning')
+@patch('logging.error')
+class TestCopyPipelined(unittest.TestCase):
+    def test_copy_pipelined(
+            self,
+            mock_logging_error,
+            mock_logging_warning,
+            mock_logging_info,
+            mock_print
+    ):
+        # Arrange
+        mock_source_client = MagicMock()
+        ready = S3Object('ready.csv', storage_class='STANDARD')
+        restored = S3Object('restored.csv', storage_class='GLACIER', restore=RESTORE_DONE, restore_expiry=time.time() + 3600)
+        restoring = S3Object('restoring.csv', storage_class='GLACIER', restore=RESTORE_IN_PROGRESS)
+        mock_source_client.head_object.return_value = {'Restore': 'ongoing-request="false"'}
+        copier = Copier(mock_source_client, 'my-old-archives', 'my-new-archives', True, 256 * MB, 2)
+
+        # Act
+        actual_failures = archive_copy.copy_pipelined(
             mock_source_client,
-            expected_source_bucket,
-            expected_dest_bucket,
-            expected_copy_to_glacier,
-            expected_s3object,
+            'my-old-archives',
+            copier,
+            iter([ready, restored, restoring]),
+            RestoreScheduler('Test')
         )
+        copier.close()
 
         # Assert
-        mock_source_client.copy.assert_called_with(
-            CopySource={'Bucket': expected_source_bucket, 'Key': expected_key},
-            Bucket=expected_dest_bucket,
-            Key=expected_key,
-            ExtraArgs={'StorageClass': 'GLACIER'}
-        )
+        self.assertEqual(actual_failures, [])
+        copied = [c.kwargs['Key'] for c in mock_source_client.copy_object.call_args_list]
+        self.assertEqual(sorted(copied), ['ready.csv', 'restored.csv', 'restoring.csv'])
+        mock_source_client.head_object.assert_called_once_with(Bucket='my-old-archives', Key='restoring.csv')
 
-@patch('boto3.client')
-@patch('archive_copy.ThreadPool')
-@patch('archive_copy.partial')
-@patch('archive_copy.copy_s3object')
-class TestCopyS3Objects(unittest.TestCase):
-    def test_copy_s3objects_fast_access(
+    def test_copy_pipelined_restores_expired(
             self,
-            mock_copy_s3object,
-            mock_partial,
-            mock_thread_pool,
-            mock_boto3_client
+            mock_logging_error,
+            mock_logging_warning,
+            mock_logging_info,
+            mock_print
     ):
         # Arrange
-        mock_source_client = mock_boto3_client.return_value
-        expected_source_bucket = 'my-old-archives'
-        expected_dest_bucket = 'my-new-archives'
-        expected_s3objects = [{'Key': 'file1.csv'}, {'Key': 'file2.csv'}]
-        mock_partial_copy_s3object = mock_partial.return_value
-        mock_pool = mock_thread_pool.return_value
-        expected_copy_to_glacier = False
+        mock_source_client = MagicMock()
+        mock_source_client.restore_object.return_value = {'ResponseMetadata': {'HTTPStatusCode': 202}}
+        mock_source_client.head_object.return_value = {'Restore': 'ongoing-request="false"'}
+        expired = S3Object('expired.csv', storage_class='GLACIER', restore=RESTORE_DONE, restore_expiry=time.time() - 1)
+        copier = Copier(mock_source_client, 'my-old-archives', 'my-new-archives', True, 256 * MB, 2)
+
         # Act
-        archive_copy.copy_s3objects(
+        actual_failures = archive_copy.copy_pipelined(
             mock_source_client,
-            expected_source_bucket,
-            expected_dest_bucket,
-            expected_s3objects,
-            expected_copy_to_glacier
+            'my-old-archives',
+            copier,
+            iter([expired]),
+            RestoreScheduler('Test')
         )
+        copier.close()
+
         # Assert
-        mock_thread_pool.assert_called_with(processes=archive_copy.NUMBER_OF_COPY_THREADS)
-        mock_partial.assert_called_with(
-            mock_copy_s3object,
-            mock_source_client,
-            expected_source_bucket,
-            expected_dest_bucket,
-            expected_copy_to_glacier
+        self.assertEqual(actual_failures, [])
+        mock_source_client.restore_object.assert_called_once()
+        mock_source_client.copy_object.assert_called_once_with(
+            Bucket='my-new-archives',
+            Key='expired.csv',
+            CopySource={'Bucket': 'my-old-archives', 'Key': 'expired.csv'},
+            StorageClass='GLACIER',
+            ChecksumAlgorithm='CRC32'
         )
-        mock_pool.map.assert_called_with(mock_partial_copy_s3object, expected_s3objects)
 
-    def test_copy_s3objects_copy_to_glacier(
+    def test_copy_pipelined_failures(
             self,
-            mock_copy_s3object,
-            mock_partial,
-            mock_thread_pool,
-            mock_boto3_client
+            mock_logging_error,
+            mock_logging_warning,
+            mock_logging_info,
+            mock_print
     ):
         # Arrange
-        mock_source_client = mock_boto3_client.return_value
-        expected_source_bucket = 'my-old-archives'
-        expected_dest_bucket = 'my-new-archives'
-        expected_s3objects = [{'Key': 'file1.csv'}, {'Key': 'file2.csv'}]
-        mock_partial_copy_s3object = mock_partial.return_value
-        mock_pool = mock_thread_pool.return_value
-        expected_copy_to_glacier = True
+        mock_source_client = MagicMock()
+        expected_error = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'CopyObject')
+        mock_source_client.copy_object.side_effect = expected_error
+        copier = Copier(mock_source_client, 'my-old-archives', 'my-new-archives', True, 256 * MB, 2)
+
         # Act
-        archive_copy.copy_s3objects(
+        actual_failures = archive_copy.copy_pipelined(
             mock_source_client,
-            expected_source_bucket,
-            expected_dest_bucket,
-            expected_s3objects,
-            expected_copy_to_glacier
+            'my-old-archives',
+            copier,
+            iter([S3Object('file1.csv')]),
+            RestoreScheduler('Test')
         )
+        copier.close()
+
+        # Assert
+        self.assertEqual(actual_failures, [('file1.csv', expected_error)])
+
+
+@patch('builtins.print')
+@patch('logging.error')
+class TestCopyS3Objects(unittest.TestCase):
+    def test_copy_s3objects(
+            self,
+            mock_logging_error,
+            mock_print
+    ):
+        # Arrange
+        mock_copier = MagicMock()
+        mock_copier.submit.side_effect = lambda s3object, on_done, priority: on_done(s3object, None)
+        mock_journal = MagicMock()
+        expected_s3objects = [S3Object('file1.csv'), S3Object('file2.csv')]
+
+        # Act
+        actual_failures = archive_copy.copy_s3objects(mock_copier, expected_s3objects, mock_journal)
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_copier.submit.assert_has_calls([
+            call(expected_s3objects[0], ANY, math.inf),
+            call(expected_s3objects[1], ANY, math.inf),
+        ])
+        mock_copier.join.assert_called()
+        mock_journal.update.assert_has_calls([
+            call(expected_s3objects[0], STATE_COPIED),
+            call(expected_s3objects[1], STATE_COPIED),
+        ])
+
+    def test_copy_s3objects_failed(
+            self,
+            mock_logging_error,
+            mock_print
+    ):
+        # Arrange
+        expected_error = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'CopyObject')
+        mock_copier = MagicMock()
+        mock_copier.submit.side_effect = lambda s3object, on_done, priority: on_done(s3object, expected_error)
+        mock_journal = MagicMock()
+        expected_s3object = S3Object('file1.csv')
+
+        # Act
+        actual_failures = archive_copy.copy_s3objects(mock_copier, [expected_s3object], mock_journal)
+
         # Assert
-        mock_thread_pool.assert_called_with(processes=archive_copy.NUMBER_OF_COPY_THREADS)
-        mock_partial.assert_called_with(
-            mock_copy_s3object,
+        self.assertEqual(actual_failures, [('file1.csv', expected_error)])
+        mock_journal.update.assert_called_with(expected_s3object, STATE_FAILED, str(expected_error))
+
+
+@patch('logging.info')
+@patch('logging.error')
+class TestVerifyS3Objects(unittest.TestCase):
+    def test_verify_s3objects(
+            self,
+            mock_logging_error,
+            mock_logging_info
+    ):
+        # Arrange
+        heads = {
+            'same.csv': {'ContentLength': 10, 'ETag': '"etag-3"', 'ChecksumCRC32': 'l1ZLHg==', 'ChecksumType': 'FULL_OBJECT'},
+            'changed.csv': {'ContentLength': 10, 'ETag': '"etag1"'},
+            'old.csv': {'ContentLength': 10, 'ETag': '"etag-2"'},
+            'missing.csv': {'ContentLength': 10, 'ETag': '"etag2"'},
+        }
+        destination_heads = {
+            'same.csv': {'ContentLength': 10, 'ETag': '"etag-5"', 'ChecksumCRC32': 'l1ZLHg==', 'ChecksumType': 'FULL_OBJECT'},
+            'changed.csv': {'ContentLength': 10, 'ETag': '"etag2"'},
+            'old.csv': {'ContentLength': 10, 'ETag': '"etag-5"'},
+        }
+        mock_source_client = MagicMock()
+        mock_source_client.head_object.side_effect = lambda Bucket, Key, ChecksumMode: heads[Key]
+        mock_destination_client = MagicMock()
+
+        def destination_head_object(Bucket, Key, ChecksumMode):
+            if Key not in destination_heads:
+                raise botocore.exceptions.ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+            return destination_heads[Key]
+
+        mock_destination_client.head_object.side_effect = destination_head_object
+        s3objects = [S3Object(key, 10) for key in heads]
+
+        # Act
+        actual_failures = archive_copy.verify_s3objects(
             mock_source_client,
-            expected_source_bucket,
-            expected_dest_bucket,
-            expected_copy_to_glacier
+            mock_destination_client,
+            'my-old-archives',
+            'my-new-archives',
+            s3objects
         )
-        mock_pool.map.assert_called_with(mock_partial_copy_s3object, expected_s3objects)
+
+        # Assert
+        self.assertEqual(sorted(actual_failures), [('changed.csv', 'mismatched'), ('missing.csv', 'missing')])
+        mock_source_client.head_object.assert_any_call(Bucket='my-old-archives', Key='same.csv', ChecksumMode='ENABLED')
+        mock_destination_client.head_object.assert_any_call(Bucket='my-new-archives', Key='same.csv', ChecksumMode='ENABLED')
+
+
+class TestCopyPriority(unittest.TestCase):
+    def test_copy_priority(self):
+        # Arrange
+        expiring = S3Object('expiring.csv', restore=RESTORE_DONE, restore_expiry=1356048000.0)
+        standard = S3Object('standard.csv')
+
+        # Act
+        actual_priorities = [archive_copy.copy_priority(expiring), archive_copy.copy_priority(standard)]
+
+        # Assert
+        self.assertEqual(actual_priorities, [1356048000.0, math.inf])
+
 
 if __name__ == '__main__':
     unittest.main()
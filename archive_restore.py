@@ -0,0 +1,178 @@
+import logging
+import sys
+from argparse import ArgumentParser
+from functools import partial
+
+import botocore
+
+from archive_copy import (metrics, bucket_exists, copy_priority, restore_again, restore_s3objects,
+                          NUMBER_OF_RESTORE_THREADS, MAX_RESTORE_THREADS, TIER)
+from clients import ClientFactory, LIMITED_MAX_ATTEMPTS
+from copier import RestoreExpired, MB
+from downloader import Downloader, DOWNLOAD_PART_SIZE_MB, MIN_DOWNLOAD_PART_SIZE_MB
+from journal import Journal, STATE_COPIED, STATE_FAILED
+from limiter import AdaptiveLimiter, LimitedClient
+from listing import list_range, DELIMITER
+from metrics import PROGRESS_INTERVAL
+from scheduler import RestoreScheduler, RestoreEvents
+
+PROGRAM_DESCRIPTION = 'A tool that restores S3 archives to a local folder'
+PROGRAM_EPILOGUE = 'Have a nice day!'
+LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
+LOG_LEVEL = logging.INFO
+NUMBER_OF_DOWNLOAD_THREADS = 16
+MAX_DOWNLOAD_THREADS = 64
+METRIC_DOWNLOADED = 'downloaded'
+METRIC_FAILED = 'failed'
+THREADS_FLAG_HELP_MESSAGE = (f'number of ranged GETs in flight at the start (default: {NUMBER_OF_DOWNLOAD_THREADS}). '
+                             f'The number grows while S3 keeps up and is cut back when S3 answers with SlowDown')
+MAX_THREADS_FLAG_HELP_MESSAGE = (f'maximum number of ranged GETs in flight, and of download threads '
+                                 f'(default: {MAX_DOWNLOAD_THREADS})')
+PART_SIZE_FLAG_HELP_MESSAGE = (f'objects are downloaded in ranges of this size in MB, fetched in parallel '
+                               f'(default: {DOWNLOAD_PART_SIZE_MB}, minimum: {MIN_DOWNLOAD_PART_SIZE_MB})')
+JOURNAL_FLAG_HELP_MESSAGE = ("record the state of every object in the SQLite database JOURNAL. If the job is "
+                             "interrupted, running it again with the same JOURNAL resumes where it stopped: "
+                             "objects are not listed, restored or downloaded again")
+RESTORE_EVENTS_FLAG_HELP_MESSAGE = ("file that S3 restore-completed event notifications are appended to, one message "
+                                    "per line (e.g. by an SQS consumer). Objects are checked as soon as their event "
+                                    "arrives instead of at their next polling time")
+EMOJI_FLAG_HELP_MESSAGE = ('print a symbol for every object that is checked or downloaded, instead of only the '
+                           'periodic progress lines')
+METRICS_FLAG_HELP_MESSAGE = ('write the object counts, bytes, request latencies, retries and throttles to METRICS '
+                             'at every progress line: in the Prometheus text format if METRICS ends with .prom, '
+                             'as JSON otherwise')
+PROGRESS_INTERVAL_FLAG_HELP_MESSAGE = f'seconds between progress lines (default: {PROGRESS_INTERVAL})'
+
+
+def list_prefix(client, bucket, prefix):
+    # The keys under prefix/ are the range from 'prefix/' up to 'prefix0', '0' being the character after '/'
+    if not prefix:
+        pages = list_range(client, bucket)
+    else:
+        pages = list_range(client, bucket, f'{prefix}{DELIMITER}', f'{prefix}{chr(ord(DELIMITER) + 1)}')
+    for page in pages:
+        yield from page
+
+
+def record_download(scheduler, journal, failures, s3object, error):
+    if isinstance(error, RestoreExpired) or (
+            isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] == 'InvalidObjectState'
+    ):
+        restore_again(scheduler, s3object)
+        return
+    if error is None:
+        if journal is not None:
+            journal.update(s3object, STATE_COPIED)
+        metrics.count(METRIC_DOWNLOADED, s3object.size)
+        metrics.show('💾')
+        return
+    logging.error(f'Downloading {s3object.key} failed: {error}')
+    metrics.count(METRIC_FAILED, s3object.size)
+    failures.append((s3object.key, error))
+    if journal is not None:
+        journal.update(s3object, STATE_FAILED, str(error))
+
+
+def download_s3objects(client, bucket, downloader, s3objects, scheduler, journal=None):
+    # Objects are downloaded as soon as they are restored, while the rest are still being restored, with
+    # the restored copies that expire first going first. Objects whose restored copy expired before
+    # they were downloaded come back from the scheduler and are restored again
+    failures = []
+    on_done = partial(record_download, scheduler, journal, failures)
+    while True:
+        for s3object in restore_s3objects(client, bucket, s3objects, scheduler, journal):
+            downloader.submit(s3object, on_done, copy_priority(s3object))
+        downloader.join()
+        s3objects = scheduler.next_due()
+        if not s3objects:
+            break
+    metrics.end_line()
+    return failures
+
+
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    parser = ArgumentParser(
+        description=PROGRAM_DESCRIPTION,
+        epilog=PROGRAM_EPILOGUE
+    )
+
+    parser.add_argument('bucket')
+    parser.add_argument('folder')
+    parser.add_argument('prefix', nargs='?', default='')
+    parser.add_argument('-t', '--threads', type=int, default=NUMBER_OF_DOWNLOAD_THREADS, help=THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--max-threads', type=int, default=MAX_DOWNLOAD_THREADS, help=MAX_THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--part-size', type=int, default=DOWNLOAD_PART_SIZE_MB, help=PART_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument('-j', '--journal', help=JOURNAL_FLAG_HELP_MESSAGE)
+    parser.add_argument('--restore-events', help=RESTORE_EVENTS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-e', '--emoji', action='store_true', help=EMOJI_FLAG_HELP_MESSAGE)
+    parser.add_argument('--metrics', help=METRICS_FLAG_HELP_MESSAGE)
+    parser.add_argument(
+        '--progress-interval',
+        type=float,
+        default=PROGRESS_INTERVAL,
+        help=PROGRESS_INTERVAL_FLAG_HELP_MESSAGE
+    )
+
+    args = parser.parse_args()
+
+    bucket = args.bucket
+    prefix = args.prefix.strip(DELIMITER)
+    # Restore checks and downloads share a client that makes a single attempt: their limiters retry them.
+    # The listing has botocore's retries
+    clients = ClientFactory()
+    client = clients.client()
+    limited_client = clients.client(
+        max_pool_connections=args.max_threads + MAX_RESTORE_THREADS,
+        max_attempts=LIMITED_MAX_ATTEMPTS
+    )
+
+    if not bucket_exists(client, bucket):
+        logging.error(f'''Bucket {bucket} doesn't exist''')
+        return 1
+
+    restore_client = LimitedClient(limited_client, AdaptiveLimiter('restore', NUMBER_OF_RESTORE_THREADS, MAX_RESTORE_THREADS))
+    download_client = LimitedClient(limited_client, AdaptiveLimiter('download', args.threads, args.max_threads))
+    metrics.throughput_state = METRIC_DOWNLOADED
+    metrics.emoji = args.emoji
+    metrics.instrument(client)
+    metrics.instrument(limited_client)
+    metrics.watch(restore_client.limiter)
+    metrics.watch(download_client.limiter)
+
+    events = None
+    if args.restore_events:
+        events = RestoreEvents(args.restore_events)
+    scheduler = RestoreScheduler(TIER, events)
+    downloader = Downloader(download_client, bucket, args.folder, prefix, args.part_size * MB, args.max_threads)
+    journal = None
+    if args.journal:
+        journal = Journal(args.journal)
+    metrics.start(args.progress_interval, args.metrics)
+    try:
+        if journal is not None and journal.listing_complete:
+            logging.info(f'Resuming from journal {args.journal}: {journal.counts()}')
+            listing = journal.pending()
+        else:
+            logging.info('Populating list of objects...')
+            listing = list_prefix(client, bucket, prefix)
+            if journal is not None:
+                listing = journal.add(listing)
+        logging.info(f'Downloading objects from {bucket} to {args.folder} as they are restored')
+        failures = download_s3objects(restore_client, bucket, downloader, listing, scheduler, journal)
+        if failures:
+            logging.error(f'{len(failures)} object(s) failed to download, run the same command again to resume')
+            return 1
+    finally:
+        downloader.close()
+        if journal is not None:
+            journal.close()
+        metrics.stop(args.metrics)
+
+    logging.info(f'Objects restored to {args.folder}.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
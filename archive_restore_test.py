@@ -0,0 +1,97 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from os.path import join
+from unittest.mock import patch, MagicMock
+
+from botocore.response import StreamingBody
+
+import archive_restore
+from copier import MB
+from downloader import Downloader
+from s3object import S3Object, RESTORE_DONE, RESTORE_IN_PROGRESS
+from scheduler import RestoreScheduler
+
+
+class TestListPrefix(unittest.TestCase):
+    def test_list_prefix(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
+                {'Key': 'archive.csv', 'Size': 1},
+                {'Key': 'archive/2024/file1.csv', 'Size': 10},
+                {'Key': 'archive/2024/file2.csv', 'Size': 20},
+                {'Key': 'archive0.csv', 'Size': 1},
+            ]},
+        ]
+
+        # Act
+        actual_keys = [s3object.key for s3object in archive_restore.list_prefix(mock_client, 'my-archive-bucket', 'archive')]
+
+        # Assert
+        self.assertEqual(actual_keys, ['archive/2024/file1.csv', 'archive/2024/file2.csv'])
+        mock_client.get_paginator.return_value.paginate.assert_called_with(
+            Bucket='my-archive-bucket',
+            OptionalObjectAttributes=['RestoreStatus'],
+            StartAfter='archive'
+        )
+
+
+@patch('scheduler.DEFAULT_RESTORE_TIME', (0, 0))
+@patch('builtins.print')
+@patch('logging.info')
+@patch('logging.warning')
+@patch('logging.error')
+class TestDownloadS3Objects(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_download_s3objects(
+            self,
+            mock_logging_error,
+            mock_logging_warning,
+            mock_logging_info,
+            mock_print
+    ):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.restore_object.return_value = {'ResponseMetadata': {'HTTPStatusCode': 202}}
+        mock_client.head_object.return_value = {'Restore': 'ongoing-request="false"'}
+        mock_client.get_object.side_effect = lambda Bucket, Key, Range, **kwargs: {
+            'Body': StreamingBody(io.BytesIO(Key.encode()), len(Key))
+        }
+        s3objects = [
+            S3Object('archive/ready.csv', len('archive/ready.csv')),
+            S3Object('archive/restoring.csv', len('archive/restoring.csv'), storage_class='GLACIER', restore=RESTORE_IN_PROGRESS),
+            S3Object('archive/expired.csv', len('archive/expired.csv'), storage_class='GLACIER', restore=RESTORE_DONE,
+                     restore_expiry=time.time() - 1),
+        ]
+        downloader = Downloader(mock_client, 'my-archive-bucket', self.tmp_dir.name, 'archive', MB, 2)
+
+        # Act
+        actual_failures = archive_restore.download_s3objects(
+            mock_client,
+            'my-archive-bucket',
+            downloader,
+            iter(s3objects),
+            RestoreScheduler('Test')
+        )
+        downloader.close()
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ['expired.csv', 'ready.csv', 'restoring.csv'])
+        with open(join(self.tmp_dir.name, 'restoring.csv'), 'rb') as f:
+            self.assertEqual(f.read(), b'archive/restoring.csv')
+        mock_client.restore_object.assert_called_once()
+        mock_logging_warning.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
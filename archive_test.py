@@ -1,21 +1,26 @@
 import os
+import tempfile
 import unittest
 import sys
+import zlib
 from os.path import join
-from unittest.mock import patch, call, mock_open
+from unittest.mock import patch, call, mock_open, MagicMock
+
+import botocore
 
 import archive
+from checksum import crc32_checksum
 
 
 @patch('logging.info')
 @patch('logging.error')
 @patch('logging.basicConfig')
 @patch('archive.bucket_exists', return_value=True)
-@patch('archive.put_file')
+@patch('archive.put_files', return_value=[])
 class TestArchive(unittest.TestCase):
     def test_main_3_args(
             self,
-            mock_put_file,
+            mock_put_files,
             mock_bucket_exists,
             mock_logging_basic_config,
             mock_logging_error,
@@ -26,7 +31,10 @@ class TestArchive(unittest.TestCase):
         expected_filename_2 = 'file2.csv'
         expected_file_path_1 = '/Documents/Folder/file1.csv'
         expected_file_path_2 = '/Documents/Folder/file2.csv'
-        expected_paths = [(expected_filename_1, expected_file_path_1), (expected_filename_2, expected_file_path_2)]
+        expected_paths = [
+            archive.FileEntry(expected_filename_1, expected_file_path_1, 1024, 1700000000.0),
+            archive.FileEntry(expected_filename_2, expected_file_path_2, 2048, 1700000000.0),
+        ]
         expected_script_name = './archive.py'
         expected_local_path = '/Documents/Folder'
         expected_s3_bucket = 'my-archive-bucket'
@@ -35,25 +43,34 @@ class TestArchive(unittest.TestCase):
         expected_exit_code = 0
         expected_log_format = archive.LOG_FORMAT
 
-        expected_put_file_calls = [
-            call(expected_file_path_1, expected_s3_bucket, expected_filename_1, expected_prefix),
-            call(expected_file_path_2, expected_s3_bucket, expected_filename_2, expected_prefix)
-        ]
+        expected_threads = archive.MAX_UPLOAD_THREADS
+        expected_part_size = archive.PART_SIZE_MB * archive.MB
+        expected_part_threads = archive.NUMBER_OF_PART_THREADS
 
-        with patch.object(sys, 'argv', expected_args), patch('archive.get_paths',
-                                                             return_value=expected_paths) as mock_get_paths:
+        with patch.object(sys, 'argv', expected_args), patch('archive.walk_files',
+                                                             return_value=expected_paths) as mock_walk_files:
             # Act
             actual_exit_code = archive.main()
 
             # Assert
             self.assertEqual(actual_exit_code, expected_exit_code)
             mock_logging_basic_config.assert_called_with(level=archive.LOG_LEVEL, format=expected_log_format)
-            mock_get_paths.assert_called_with(expected_local_path)
-            mock_put_file.assert_has_calls(expected_put_file_calls)
+            mock_walk_files.assert_called_with(expected_local_path)
+            mock_put_files.assert_called_with(
+                expected_paths,
+                expected_s3_bucket,
+                expected_prefix,
+                expected_threads,
+                expected_part_size,
+                expected_part_threads,
+                None,
+                None,
+                compressor=None
+            )
 
     def test_main_2_args(
             self,
-            mock_put_file,
+            mock_put_files,
             mock_bucket_exists,
             mock_logging_basic_config,
             mock_logging_error,
@@ -64,7 +81,10 @@ class TestArchive(unittest.TestCase):
         expected_filename_2 = 'file2.csv'
         expected_file_path_1 = '/Documents/Folder/file1.csv'
         expected_file_path_2 = '/Documents/Folder/file2.csv'
-        expected_paths = [(expected_filename_1, expected_file_path_1), (expected_filename_2, expected_file_path_2)]
+        expected_paths = [
+            archive.FileEntry(expected_filename_1, expected_file_path_1, 1024, 1700000000.0),
+            archive.FileEntry(expected_filename_2, expected_file_path_2, 2048, 1700000000.0),
+        ]
         expected_script_name = './archive.py'
         expected_local_path = '/Documents/Folder'
         expected_s3_bucket = 'my-archive-bucket'
@@ -73,39 +93,197 @@ class TestArchive(unittest.TestCase):
         expected_exit_code = 0
         expected_log_format = archive.LOG_FORMAT
 
-        expected_put_file_calls = [
-            call(expected_file_path_1, expected_s3_bucket, expected_filename_1, expected_prefix),
-            call(expected_file_path_2, expected_s3_bucket, expected_filename_2, expected_prefix)
-        ]
+        expected_threads = archive.MAX_UPLOAD_THREADS
+        expected_part_size = archive.PART_SIZE_MB * archive.MB
+        expected_part_threads = archive.NUMBER_OF_PART_THREADS
 
-        with patch.object(sys, 'argv', expected_args), patch('archive.get_paths',
-                                                             return_value=expected_paths) as mock_get_paths:
+        with patch.object(sys, 'argv', expected_args), patch('archive.walk_files',
+                                                             return_value=expected_paths) as mock_walk_files:
             # Act
             actual_exit_code = archive.main()
 
             # Assert
             self.assertEqual(actual_exit_code, expected_exit_code)
             mock_logging_basic_config.assert_called_with(level=archive.LOG_LEVEL, format=expected_log_format)
-            mock_get_paths.assert_called_with(expected_local_path)
-            mock_put_file.assert_has_calls(expected_put_file_calls)
+            mock_walk_files.assert_called_with(expected_local_path)
+            mock_put_files.assert_called_with(
+                expected_paths,
+                expected_s3_bucket,
+                expected_prefix,
+                expected_threads,
+                expected_part_size,
+                expected_part_threads,
+                None,
+                None,
+                compressor=None
+            )
+
+    def test_main_threads(
+            self,
+            mock_put_files,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_paths = [archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0)]
+        expected_local_path = '/Documents/Folder'
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        expected_threads = 20
+        expected_max_threads = 64
+        expected_part_size = 128 * archive.MB
+        expected_part_threads = 8
+        expected_args = [
+            './archive.py',
+            '-t', str(expected_threads),
+            '--max-threads', str(expected_max_threads),
+            '--part-size', '128',
+            '--part-threads', str(expected_part_threads),
+            expected_local_path,
+            expected_s3_bucket,
+            expected_prefix,
+        ]
+
+        with patch.object(sys, 'argv', expected_args), patch('archive.walk_files', return_value=expected_paths):
+            # Act
+            archive.main()
+
+            # Assert
+            self.assertEqual((archive.limiter.limit, archive.limiter.maximum), (expected_threads, expected_max_threads))
+            mock_put_files.assert_called_with(
+                expected_paths,
+                expected_s3_bucket,
+                expected_prefix,
+                expected_max_threads,
+                expected_part_size,
+                expected_part_threads,
+                None,
+                None,
+                compressor=None
+            )
+
+    def test_main_index(
+            self,
+            mock_put_files,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_paths = [archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0)]
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        expected_index = '/Documents/archive.sqlite'
+        expected_args = ['./archive.py', '-i', expected_index, '/Documents/Folder', expected_s3_bucket, expected_prefix]
+
+        with patch.object(sys, 'argv', expected_args), \
+                patch('archive.walk_files', return_value=expected_paths), \
+                patch('archive.Manifest') as mock_manifest_constructor:
+            mock_manifest = mock_manifest_constructor.return_value
+            mock_manifest.is_new = True
+
+            # Act
+            archive.main()
+
+            # Assert
+            mock_manifest_constructor.assert_called_with(expected_index)
+            mock_manifest.rebuild.assert_called_with(archive.listing_s3, expected_s3_bucket, expected_prefix, False)
+            self.assertIs(mock_put_files.call_args.args[-2], mock_manifest)
+            mock_manifest.close.assert_called()
+
+    def test_main_pack(
+            self,
+            mock_put_files,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_paths = [archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0)]
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        expected_args = [
+            './archive.py',
+            '--pack-threshold', '512',
+            '--bundle-size', '128',
+            '/Documents/Folder',
+            expected_s3_bucket,
+            expected_prefix,
+        ]
+
+        with patch.object(sys, 'argv', expected_args), \
+                patch('archive.walk_files', return_value=expected_paths), \
+                patch('archive.put_bundle_index', return_value=[]) as mock_put_bundle_index, \
+                patch('archive.Packer') as mock_packer_constructor:
+            mock_packer = mock_packer_constructor.return_value
+
+            # Act
+            actual_exit_code = archive.main()
+
+            # Assert
+            self.assertEqual(actual_exit_code, 0)
+            self.assertEqual(mock_packer_constructor.call_args.args[2:], (512 * 1024, 128 * archive.MB, None))
+            mock_packer.pack.assert_called_with(expected_paths)
+            self.assertIs(mock_put_files.call_args.args[0], mock_packer.pack.return_value)
+            self.assertIs(mock_put_files.call_args.args[-1], mock_packer)
+            mock_put_bundle_index.assert_called_with(mock_packer, expected_s3_bucket, expected_prefix)
+
+    def test_main_failures(
+            self,
+            mock_put_files,
+            mock_bucket_exists,
+            mock_logging_basic_config,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_paths = [archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0)]
+        expected_args = ['./archive.py', '/Documents/Folder', 'my-archive-bucket']
+        expected_error = OSError('Permission denied')
+        expected_exit_code = 1
+        mock_put_files.return_value = [('file1.csv', expected_error)]
+
+        with patch.object(sys, 'argv', expected_args), patch('archive.walk_files', return_value=expected_paths):
+            # Act
+            actual_exit_code = archive.main()
 
+            # Assert
+            self.assertEqual(actual_exit_code, expected_exit_code)
+            mock_logging_error.assert_called_with(f'file1.csv: {expected_error}')
 
-class TestGetPaths(unittest.TestCase):
-    def test_get_paths(self):
+
+class TestWalkFiles(unittest.TestCase):
+    def test_walk_files(self):
         # Arrange
         expected_local_path = 'test_fixtures/upload_files'
-        expected_filename_1 = 'file1.txt'
-        expected_filename_2 = 'file2.txt'
-        expected_file_paths = [
-            (expected_filename_2, join(os.getcwd(), expected_local_path, expected_filename_2)),
-            (expected_filename_1, join(os.getcwd(), expected_local_path, expected_filename_1)),
+        expected_keys_and_paths = [
+            ('file1.txt', join(os.getcwd(), expected_local_path, 'file1.txt')),
+            ('file2.txt', join(os.getcwd(), expected_local_path, 'file2.txt')),
+            ('nested/file3.txt', join(os.getcwd(), expected_local_path, 'nested', 'file3.txt')),
         ]
 
         # Act
-        actual_file_paths = archive.get_paths(expected_local_path)
+        actual_files = sorted(archive.walk_files(expected_local_path))
 
         # Assert
-        self.assertEqual(expected_file_paths, actual_file_paths)
+        self.assertEqual([(f.key, f.path) for f in actual_files], expected_keys_and_paths)
+        for actual_file in actual_files:
+            self.assertEqual(actual_file.size, os.path.getsize(actual_file.path))
+            self.assertEqual(actual_file.mtime, os.path.getmtime(actual_file.path))
+
+    def test_walk_files_is_lazy(self):
+        # Arrange
+        expected_local_path = 'test_fixtures/upload_files'
+
+        # Act
+        actual_files = archive.walk_files(expected_local_path)
+
+        # Assert
+        self.assertIsInstance(next(actual_files), archive.FileEntry)
 
 
 @patch('archive.s3')
@@ -125,12 +303,496 @@ class TestPutFile(unittest.TestCase):
         expected_storage_class = 'GLACIER'
         expected_flags = 'rb'
 
+        expected_checksum = 'l1ZLHg=='
+        mock_s3.put_object.return_value = {'ETag': '"etag"', 'ChecksumCRC32': expected_checksum}
+
         # Act
-        archive.put_file(expected_filename, expected_s3_bucket, expected_key, expected_prefix)
+        actual_checksum = archive.put_file(expected_filename, expected_s3_bucket, expected_key, expected_prefix)
 
         # Assert
         mock_file.assert_called_with(expected_filename, expected_flags)
-        mock_s3.put_object.assert_called_with(Body=open(expected_filename, expected_flags), ACL=expected_acl, Key=f'{expected_prefix}/{expected_key}', Bucket=expected_s3_bucket, StorageClass=expected_storage_class)
+        mock_s3.put_object.assert_called_with(Body=open(expected_filename, expected_flags), ACL=expected_acl, Key=f'{expected_prefix}/{expected_key}', Bucket=expected_s3_bucket, StorageClass=expected_storage_class, ChecksumAlgorithm='CRC32')
+        self.assertEqual(actual_checksum, expected_checksum)
+
+
+@patch('logging.info')
+@patch('logging.error')
+@patch('archive.put_file_multipart')
+@patch('archive.put_file')
+class TestPutFiles(unittest.TestCase):
+    def test_put_files(
+            self,
+            mock_put_file,
+            mock_put_file_multipart,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        expected_paths = [
+            archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0),
+            archive.FileEntry('file2.csv', '/Documents/Folder/file2.csv', 1024, 1700000000.0),
+        ]
+        expected_put_file_calls = [
+            call('/Documents/Folder/file1.csv', expected_s3_bucket, 'file1.csv', expected_prefix, 'GLACIER'),
+            call('/Documents/Folder/file2.csv', expected_s3_bucket, 'file2.csv', expected_prefix, 'GLACIER'),
+        ]
+
+        # Act
+        actual_failures = archive.put_files(expected_paths, expected_s3_bucket, expected_prefix, 2)
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_put_file.assert_has_calls(expected_put_file_calls, any_order=True)
+        mock_put_file_multipart.assert_not_called()
+
+    def test_put_files_multipart(
+            self,
+            mock_put_file,
+            mock_put_file_multipart,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        expected_part_size = 8 * archive.MB
+        expected_part_threads = 3
+        expected_file_size = expected_part_size + 1
+        expected_paths = [archive.FileEntry('big.bin', '/Documents/Folder/big.bin', expected_file_size, 1700000000.0)]
+
+        # Act
+        actual_failures = archive.put_files(expected_paths, expected_s3_bucket, expected_prefix, 2, expected_part_size, expected_part_threads)
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_put_file.assert_not_called()
+        mock_put_file_multipart.assert_called_with(
+            '/Documents/Folder/big.bin',
+            expected_s3_bucket,
+            'big.bin',
+            expected_prefix,
+            expected_file_size,
+            expected_part_size,
+            expected_part_threads,
+            'GLACIER'
+        )
+
+    def test_put_files_collects_failures(
+            self,
+            mock_put_file,
+            mock_put_file_multipart,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_error = OSError('Permission denied')
+        expected_paths = [
+            archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0),
+            archive.FileEntry('file2.csv', '/Documents/Folder/file2.csv', 1024, 1700000000.0),
+        ]
+        mock_put_file.side_effect = lambda path, bucket, key, prefix, storage_class: self._raise_for(key, 'file1.csv', expected_error)
+
+        # Act
+        actual_failures = archive.put_files(expected_paths, 'my-archive-bucket', 'archive/2024', 2)
+
+        # Assert
+        self.assertEqual(actual_failures, [('file1.csv', expected_error)])
+        self.assertEqual(mock_put_file.call_count, 2)
+
+    def test_put_files_skips_unchanged(
+            self,
+            mock_put_file,
+            mock_put_file_multipart,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        unchanged_file = archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0)
+        changed_file = archive.FileEntry('file2.csv', '/Documents/Folder/file2.csv', 1024, 1700000000.0)
+        expected_md5 = 'd41d8cd98f00b204e9800998ecf8427e'
+        expected_checksum = 'AAAAAA=='
+        mock_manifest = MagicMock()
+        mock_manifest.needs_upload.side_effect = lambda file: (file is changed_file, expected_md5)
+        mock_put_file.return_value = expected_checksum
+
+        # Act
+        actual_failures = archive.put_files(
+            [unchanged_file, changed_file],
+            expected_s3_bucket,
+            expected_prefix,
+            2,
+            manifest=mock_manifest
+        )
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_put_file.assert_called_once_with(changed_file.path, expected_s3_bucket, changed_file.key, expected_prefix, 'GLACIER')
+        mock_manifest.record.assert_called_once_with(changed_file.key, changed_file.size, changed_file.mtime, expected_md5, expected_checksum)
+
+    def test_put_files_bundle(
+            self,
+            mock_put_file,
+            mock_put_file_multipart,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        member = archive.FileEntry('file1.csv', '/Documents/Folder/file1.csv', 1024, 1700000000.0)
+        bundle = archive.FileEntry('bundles/1.tar', '/tmp/1.tar', 4096, None, ((member, None, 512),))
+        mock_manifest = MagicMock()
+        mock_packer = MagicMock()
+
+        # Act
+        actual_failures = archive.put_files([bundle], expected_s3_bucket, expected_prefix, 2, manifest=mock_manifest, packer=mock_packer)
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_put_file.assert_called_once_with(bundle.path, expected_s3_bucket, bundle.key, expected_prefix, 'GLACIER')
+        mock_manifest.needs_upload.assert_not_called()
+        mock_manifest.record.assert_not_called()
+        mock_packer.finish_bundle.assert_called_with(bundle, None)
+
+    @staticmethod
+    def _raise_for(key, failing_key, error):
+        if key == failing_key:
+            raise error
+
+
+class TestGetPartSize(unittest.TestCase):
+    def test_get_part_size(self):
+        # Arrange
+        expected_part_size = 64 * archive.MB
+
+        # Act
+        actual_part_size = archive.get_part_size(100 * archive.MB, expected_part_size)
+
+        # Assert
+        self.assertEqual(actual_part_size, expected_part_size)
+
+    def test_get_part_size_too_many_parts(self):
+        # Arrange
+        file_size = 2 * 1024 * 1024 * archive.MB
+        part_size = 64 * archive.MB
+
+        # Act
+        actual_part_size = archive.get_part_size(file_size, part_size)
+
+        # Assert
+        self.assertGreater(actual_part_size, part_size)
+        self.assertLessEqual(-(-file_size // actual_part_size), archive.MAX_PARTS)
+
+
+@patch('logging.warning')
+@patch('limiter.MIN_BACKOFF', 0)
+@patch('time.sleep')
+@patch('archive.s3')
+class TestPutFileMultipart(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = join(self.tmp_dir.name, 'big.bin')
+        self.data = os.urandom(2 * archive.MIN_PART_SIZE_MB * archive.MB + 100)
+        with open(self.file_path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_file_multipart(
+            self,
+            mock_s3,
+            mock_sleep,
+            mock_logging_warning,
+    ):
+        # Arrange
+        expected_s3_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        expected_key = 'big.bin'
+        expected_object_key = f'{expected_prefix}/{expected_key}'
+        expected_upload_id = 'upload-id'
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+        mock_s3.create_multipart_upload.return_value = {'UploadId': expected_upload_id}
+        # S3 sends the checksum of every part back
+        mock_s3.upload_part.side_effect = lambda **kwargs: {
+            'ETag': f'etag-{kwargs["PartNumber"]}',
+            'ChecksumCRC32': kwargs['ChecksumCRC32']
+        }
+        mock_s3.complete_multipart_upload.return_value = {}
+        expected_parts = [
+            {'ETag': f'etag-{part_number}', 'PartNumber': part_number, 'ChecksumCRC32': crc32_checksum(data)}
+            for (part_number, data) in ((1, self.data[:expected_part_size]),
+                                        (2, self.data[expected_part_size:2 * expected_part_size]),
+                                        (3, self.data[2 * expected_part_size:]))
+        ]
+        expected_checksum = crc32_checksum(self.data)
+
+        # Act
+        actual_checksum = archive.put_file_multipart(self.file_path, expected_s3_bucket, expected_key, expected_prefix, len(self.data), expected_part_size, 2)
+
+        # Assert
+        mock_s3.create_multipart_upload.assert_called_with(
+            ACL='private',
+            Key=expected_object_key,
+            Bucket=expected_s3_bucket,
+            StorageClass='GLACIER',
+            ChecksumAlgorithm='CRC32',
+            ChecksumType='FULL_OBJECT'
+        )
+        uploaded = sorted(mock_s3.upload_part.call_args_list, key=lambda c: c.kwargs['PartNumber'])
+        self.assertEqual(b''.join(c.kwargs['Body'] for c in uploaded), self.data)
+        mock_s3.complete_multipart_upload.assert_called_with(
+            Bucket=expected_s3_bucket,
+            Key=expected_object_key,
+            UploadId=expected_upload_id,
+            MultipartUpload={'Parts': expected_parts},
+            ChecksumCRC32=expected_checksum,
+            ChecksumType='FULL_OBJECT'
+        )
+        self.assertEqual(actual_checksum, expected_checksum)
+        mock_s3.abort_multipart_upload.assert_not_called()
+
+    def test_put_file_multipart_retries_failed_part(
+            self,
+            mock_s3,
+            mock_sleep,
+            mock_logging_warning,
+    ):
+        # Arrange
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        failures = {2: 1}
+
+        def upload_part(**kwargs):
+            if failures.get(kwargs['PartNumber'], 0) > 0:
+                failures[kwargs['PartNumber']] -= 1
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+            return {'ETag': 'etag'}
+
+        mock_s3.upload_part.side_effect = upload_part
+
+        # Act
+        archive.put_file_multipart(self.file_path, 'my-archive-bucket', 'big.bin', 'archive/2024', len(self.data), expected_part_size, 2)
+
+        # Assert
+        actual_part_numbers = sorted(c.kwargs['PartNumber'] for c in mock_s3.upload_part.call_args_list)
+        self.assertEqual(actual_part_numbers, [1, 2, 2, 3])
+        mock_s3.complete_multipart_upload.assert_called()
+        mock_s3.abort_multipart_upload.assert_not_called()
+
+    def test_put_file_multipart_client_error_not_retried(
+            self,
+            mock_s3,
+            mock_sleep,
+            mock_logging_warning,
+    ):
+        # Arrange
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        mock_s3.upload_part.side_effect = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'NoSuchUpload'}, 'ResponseMetadata': {'HTTPStatusCode': 404}},
+            'UploadPart'
+        )
+
+        # Act
+        with self.assertRaises(botocore.exceptions.ClientError):
+            archive.put_file_multipart(self.file_path, 'my-archive-bucket', 'big.bin', 'archive/2024', len(self.data), expected_part_size, 1)
+
+        # Assert
+        # One request per part, none of them retried
+        self.assertEqual(sorted(c.kwargs['PartNumber'] for c in mock_s3.upload_part.call_args_list), [1, 2, 3])
+        mock_sleep.assert_not_called()
+        mock_s3.abort_multipart_upload.assert_called_with(Bucket='my-archive-bucket', Key='archive/2024/big.bin', UploadId='upload-id')
+
+    def test_put_file_multipart_retries_server_error(
+            self,
+            mock_s3,
+            mock_sleep,
+            mock_logging_warning,
+    ):
+        # Arrange
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        errors = [botocore.exceptions.ClientError(
+            {'Error': {'Code': 'InternalError'}, 'ResponseMetadata': {'HTTPStatusCode': 500}},
+            'UploadPart'
+        )]
+
+        def upload_part(**kwargs):
+            if kwargs['PartNumber'] == 2 and errors:
+                raise errors.pop()
+            return {'ETag': 'etag'}
+
+        mock_s3.upload_part.side_effect = upload_part
+
+        # Act
+        archive.put_file_multipart(self.file_path, 'my-archive-bucket', 'big.bin', 'archive/2024', len(self.data), expected_part_size, 1)
+
+        # Assert
+        self.assertEqual(mock_s3.upload_part.call_count, 4)
+        mock_s3.complete_multipart_upload.assert_called()
+
+    def test_put_file_multipart_aborts(
+            self,
+            mock_s3,
+            mock_sleep,
+            mock_logging_warning,
+    ):
+        # Arrange
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        mock_s3.upload_part.side_effect = botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+
+        # Act
+        with self.assertRaises(botocore.exceptions.EndpointConnectionError):
+            archive.put_file_multipart(self.file_path, 'my-archive-bucket', 'big.bin', 'archive/2024', len(self.data), expected_part_size, 2)
+
+        # Assert
+        mock_s3.complete_multipart_upload.assert_not_called()
+        mock_s3.abort_multipart_upload.assert_called_with(Bucket='my-archive-bucket', Key='archive/2024/big.bin', UploadId='upload-id')
+
+
+@patch('archive.s3')
+class TestPutFileCompressed(unittest.TestCase):
+    def test_put_file_compressed_multipart(self, mock_s3):
+        # Arrange
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+        expected_metadata = {'compression': 'gzip', 'uncompressed-size': str(10 * expected_part_size)}
+        chunks = [b'a' * (expected_part_size - 1), b'b' * 2, b'c' * expected_part_size, b'd']
+        mock_compressor = MagicMock()
+        mock_compressor.compress_file.return_value = iter([(chunk, zlib.crc32(b'x'), 1) for chunk in chunks])
+        mock_compressor.metadata.return_value = expected_metadata
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        # Parts sent back without their checksum, like by moto
+        mock_s3.upload_part.side_effect = lambda **kwargs: {'ETag': f'etag-{kwargs["PartNumber"]}'}
+        mock_s3.complete_multipart_upload.return_value = {}
+        data = b''.join(chunks)
+        expected_parts = [
+            {'ETag': f'etag-{part_number}', 'PartNumber': part_number, 'ChecksumCRC32': crc32_checksum(part)}
+            for (part_number, part) in ((1, data[:expected_part_size]),
+                                        (2, data[expected_part_size:2 * expected_part_size]),
+                                        (3, data[2 * expected_part_size:]))
+        ]
+
+        # Act
+        actual_checksum = archive.put_file_compressed('/Documents/Folder/app.log', 'my-archive-bucket', 'app.log', 'archive/2024', 10 * expected_part_size, expected_part_size, mock_compressor)
+
+        # Assert
+        mock_compressor.compress_file.assert_called_with('/Documents/Folder/app.log', 10 * expected_part_size)
+        mock_s3.create_multipart_upload.assert_called_with(
+            ACL='private',
+            Key='archive/2024/app.log',
+            Bucket='my-archive-bucket',
+            StorageClass='GLACIER',
+            Metadata=expected_metadata,
+            ChecksumAlgorithm='CRC32',
+            ChecksumType='FULL_OBJECT'
+        )
+        actual_bodies = [c.kwargs['Body'] for c in mock_s3.upload_part.call_args_list]
+        self.assertEqual([len(body) for body in actual_bodies], [expected_part_size, expected_part_size, 2])
+        self.assertEqual(b''.join(actual_bodies), b''.join(chunks))
+        mock_s3.complete_multipart_upload.assert_called_with(
+            Bucket='my-archive-bucket',
+            Key='archive/2024/app.log',
+            UploadId='upload-id',
+            MultipartUpload={'Parts': expected_parts},
+            ChecksumCRC32=crc32_checksum(data),
+            ChecksumType='FULL_OBJECT'
+        )
+        self.assertEqual(actual_checksum, crc32_checksum(b'x' * len(chunks)))
+        mock_s3.put_object.assert_not_called()
+
+    def test_put_file_compressed_single_put(self, mock_s3):
+        # Arrange
+        mock_compressor = MagicMock()
+        mock_compressor.compress_file.return_value = iter([(b'compressed', zlib.crc32(b'uncompressed'), 12)])
+        mock_compressor.metadata.return_value = {'compression': 'gzip', 'uncompressed-size': '12'}
+
+        # Act
+        actual_checksum = archive.put_file_compressed('/Documents/Folder/app.log', 'my-archive-bucket', 'app.log', 'archive/2024', 12, 64 * archive.MB, mock_compressor)
+
+        # Assert
+        mock_s3.put_object.assert_called_with(
+            Body=b'compressed',
+            ACL='private',
+            Key='archive/2024/app.log',
+            Bucket='my-archive-bucket',
+            StorageClass='GLACIER',
+            Metadata={'compression': 'gzip', 'uncompressed-size': '12'},
+            ChecksumCRC32=crc32_checksum(b'compressed')
+        )
+        mock_s3.create_multipart_upload.assert_not_called()
+        self.assertEqual(actual_checksum, crc32_checksum(b'uncompressed'))
+
+    def test_put_file_compressed_aborts(self, mock_s3):
+        # Arrange
+        expected_part_size = archive.MIN_PART_SIZE_MB * archive.MB
+
+        def compress_file(path, size):
+            yield b'a' * expected_part_size, 0, expected_part_size
+            raise OSError('Input/output error')
+
+        mock_compressor = MagicMock()
+        mock_compressor.compress_file.side_effect = compress_file
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-id'}
+        mock_s3.upload_part.return_value = {'ETag': 'etag'}
+
+        # Act
+        with self.assertRaises(OSError):
+            archive.put_file_compressed('/Documents/Folder/app.log', 'my-archive-bucket', 'app.log', 'archive/2024', 10 * expected_part_size, expected_part_size, mock_compressor)
+
+        # Assert
+        mock_s3.abort_multipart_upload.assert_called_with(Bucket='my-archive-bucket', Key='archive/2024/app.log', UploadId='upload-id')
+
+
+@patch('logging.info')
+@patch('logging.error')
+@patch('archive.put_file')
+class TestPutBundleIndex(unittest.TestCase):
+    def test_put_bundle_index(
+            self,
+            mock_put_file,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        mock_packer = MagicMock(bundle_count=2, index_key='bundles/1.index.csv.gz')
+        mock_packer.close.return_value = '/tmp/1.index.csv.gz'
+
+        # Act
+        actual_failures = archive.put_bundle_index(mock_packer, 'my-archive-bucket', 'archive/2024')
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_put_file.assert_called_with(
+            '/tmp/1.index.csv.gz',
+            'my-archive-bucket',
+            'bundles/1.index.csv.gz',
+            'archive/2024',
+            storage_class='STANDARD'
+        )
+
+    def test_put_bundle_index_no_bundles(
+            self,
+            mock_put_file,
+            mock_logging_error,
+            mock_logging_info,
+    ):
+        # Arrange
+        mock_packer = MagicMock(bundle_count=0)
+
+        # Act
+        actual_failures = archive.put_bundle_index(mock_packer, 'my-archive-bucket', 'archive/2024')
+
+        # Assert
+        self.assertEqual(actual_failures, [])
+        mock_packer.close.assert_called()
+        mock_put_file.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+
+import botocore.exceptions
+
+from checksum import CHECKSUM_FIELD
+from clients import LIMITED_MAX_ATTEMPTS, client_options
+from copier import (RestoreExpired, COPY_CHECKSUM_ARGS, MULTIPART_CHECKSUM_ARGS, clamp_part_size, get_copy_part,
+                    get_copy_source, get_part_range, get_part_size, is_expired)
+from limiter import AsyncLimitedClient
+
+IN_FLIGHT = 500
+S3_SERVICE_NAME = 's3'
+
+
+def aiobotocore_client_factory(profile_name, max_pool_connections, max_attempts=LIMITED_MAX_ATTEMPTS):
+    # aiobotocore is only needed by this engine, so it's imported when the engine is picked.
+    # Raises ImportError if it isn't installed. The client has the same config as the other engine's,
+    # and makes a single attempt by default: the copier's limiter retries its requests
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import AioSession
+    session = AioSession(profile=profile_name)
+    config = AioConfig(**client_options(max_pool_connections, max_attempts))
+    return lambda: session.create_client(S3_SERVICE_NAME, config=config)
+
+
+class AsyncCopier:
+    # Same interface as copier.Copier, but every request is a coroutine on an event loop running in
+    # a background thread, so thousands of requests can be in flight without a thread each.
+    # submit() blocks while in_flight objects are being copied, so the listing is only read as fast
+    # as objects are copied. Objects start in the order they are submitted, priority isn't used.
+    # With a limiter (limiter.AsyncAdaptiveLimiter), the requests go through it like the Copier's do
+    def __init__(self, create_client, source_bucket, dest_bucket, copy_to_glacier, part_size, in_flight, limiter=None,
+                 clock=time.time):
+        self.source_bucket = source_bucket
+        self.dest_bucket = dest_bucket
+        self.part_size = clamp_part_size(part_size)
+        self.in_flight = in_flight
+        self.limiter = limiter
+        self.clock = clock
+        self.extra_args = {}
+        if copy_to_glacier:
+            self.extra_args = {'StorageClass': 'GLACIER'}
+        self.slots = threading.BoundedSemaphore(in_flight)
+        self.idle = threading.Condition()
+        self.outstanding = 0
+        self.exit_stack = AsyncExitStack()
+        # on_done (e.g. the journal's commit) runs on a thread of its own, one object after the other,
+        # so it never holds up the copies on the loop
+        self.done_executor = ThreadPoolExecutor(max_workers=1)
+        self.part_slots = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = asyncio.run_coroutine_threadsafe(self._open(create_client), self.loop).result()
+
+    async def _open(self, create_client):
+        # Parts of big objects have their own limit, an object waiting for its parts
+        # must not hold the slots its parts need
+        self.part_slots = asyncio.Semaphore(self.in_flight)
+        client = await self.exit_stack.enter_async_context(create_client())
+        if self.limiter is None:
+            return client
+        return AsyncLimitedClient(client, self.limiter)
+
+    def submit(self, s3object, on_done, priority=0):
+        self.slots.acquire()
+        with self.idle:
+            self.outstanding = self.outstanding + 1
+        asyncio.run_coroutine_threadsafe(self._copy(s3object, on_done), self.loop)
+
+    def join(self):
+        with self.idle:
+            self.idle.wait_for(lambda: self.outstanding == 0)
+
+    def close(self):
+        self.join()
+        asyncio.run_coroutine_threadsafe(self.exit_stack.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.done_executor.shutdown()
+
+    async def _copy(self, s3object, on_done):
+        try:
+            error = await self._copy_s3object(s3object)
+            try:
+                await self.loop.run_in_executor(self.done_executor, on_done, s3object, error)
+            except Exception:
+                # An error of on_done (e.g. the journal's) mustn't be lost with the coroutine
+                logging.exception(f'Recording the copy of {s3object.key} failed')
+        finally:
+            self.slots.release()
+            with self.idle:
+                self.outstanding = self.outstanding - 1
+                self.idle.notify_all()
+
+    async def _copy_s3object(self, s3object):
+        # Returns the error, or None once the object is copied
+        if is_expired(s3object, self.clock()):
+            return RestoreExpired(f'Restored copy of {s3object.key} has expired')
+        try:
+            if s3object.size <= self.part_size:
+                response = await self.client.copy_object(
+                    Bucket=self.dest_bucket,
+                    Key=s3object.key,
+                    **get_copy_source(self.source_bucket, s3object),
+                    **self.extra_args,
+                    **COPY_CHECKSUM_ARGS
+                )
+                s3object.checksum = response.get('CopyObjectResult', {}).get(CHECKSUM_FIELD)
+            else:
+                await self._copy_multipart(s3object)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            return e
+        return None
+
+    async def _copy_multipart(self, s3object):
+        part_size = get_part_size(s3object.size, self.part_size)
+        part_count = math.ceil(s3object.size / part_size)
+        # A multipart copy doesn't carry the source's metadata over like CopyObject does
+        head = await self.client.head_object(Bucket=self.source_bucket, Key=s3object.key)
+        upload_args = {'Metadata': head.get('Metadata', {})}
+        if 'ContentType' in head:
+            upload_args['ContentType'] = head['ContentType']
+        response = await self.client.create_multipart_upload(
+            Bucket=self.dest_bucket,
+            Key=s3object.key,
+            **upload_args,
+            **self.extra_args,
+            **MULTIPART_CHECKSUM_ARGS
+        )
+        upload_id = response['UploadId']
+        try:
+            parts = await asyncio.gather(*(
+                self._copy_part(s3object, upload_id, part_size, part_number)
+                for part_number in range(1, part_count + 1)
+            ))
+            response = await self.client.complete_multipart_upload(
+                Bucket=self.dest_bucket,
+                Key=s3object.key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+            s3object.checksum = response.get(CHECKSUM_FIELD)
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError):
+            try:
+                await self.client.abort_multipart_upload(Bucket=self.dest_bucket, Key=s3object.key, UploadId=upload_id)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError):
+                # The upload is left for the bucket's lifecycle rule to clean up
+                pass
+            raise
+
+    async def _copy_part(self, s3object, upload_id, part_size, part_number):
+        async with self.part_slots:
+            response = await self.client.upload_part_copy(
+                Bucket=self.dest_bucket,
+                Key=s3object.key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                CopySourceRange=get_part_range(s3object.size, part_size, part_number),
+                **get_copy_source(self.source_bucket, s3object)
+            )
+        return get_copy_part(response, part_number)
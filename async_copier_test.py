@@ -0,0 +1,146 @@
+import threading
+import unittest
+from contextlib import asynccontextmanager
+from unittest.mock import patch, AsyncMock
+
+import botocore.exceptions
+
+from async_copier import AsyncCopier
+from copier import RestoreExpired, MB
+from limiter import AsyncAdaptiveLimiter
+from s3object import S3Object, RESTORE_DONE
+
+
+def copy_all(client, s3objects, part_size, in_flight=4, limiter=None):
+    @asynccontextmanager
+    async def create_client():
+        yield client
+
+    results = []
+    copier = AsyncCopier(create_client, 'my-old-archives', 'my-new-archives', True, part_size, in_flight, limiter)
+    for s3object in s3objects:
+        copier.submit(s3object, lambda s3object, error: results.append((s3object.key, error)))
+    copier.join()
+    copier.close()
+    return results
+
+
+class TestAsyncCopier(unittest.TestCase):
+    def test_copy_single_objects(self):
+        # Arrange
+        mock_client = AsyncMock()
+        mock_client.copy_object.return_value = {'CopyObjectResult': {'ETag': '"etag"', 'ChecksumCRC32': 'l1ZLHg=='}}
+        expected_s3objects = [S3Object(f'file{i}.csv', 10, f'"etag{i}"') for i in range(10)]
+
+        # Act
+        actual_results = copy_all(mock_client, expected_s3objects, 5 * MB, in_flight=3)
+
+        # Assert
+        self.assertEqual(sorted(actual_results), sorted((s3object.key, None) for s3object in expected_s3objects))
+        self.assertEqual(mock_client.copy_object.await_count, 10)
+        mock_client.copy_object.assert_any_await(
+            Bucket='my-new-archives',
+            Key='file0.csv',
+            CopySource={'Bucket': 'my-old-archives', 'Key': 'file0.csv'},
+            CopySourceIfMatch='"etag0"',
+            StorageClass='GLACIER',
+            ChecksumAlgorithm='CRC32'
+        )
+
+    def test_copy_multipart(self):
+        # Arrange
+        mock_client = AsyncMock()
+        mock_client.head_object.return_value = {'Metadata': {}}
+        mock_client.create_multipart_upload.return_value = {'UploadId': 'upload1'}
+        mock_client.upload_part_copy.side_effect = lambda **kwargs: {'CopyPartResult': {'ETag': f'"part{kwargs["PartNumber"]}"'}}
+        mock_client.complete_multipart_upload.return_value = {'ETag': '"etag-3"'}
+
+        # Act
+        actual_results = copy_all(mock_client, [S3Object('big.csv', 12 * MB)], 5 * MB)
+
+        # Assert
+        self.assertEqual(actual_results, [('big.csv', None)])
+        self.assertEqual(mock_client.upload_part_copy.await_count, 3)
+        mock_client.complete_multipart_upload.assert_awaited_once_with(
+            Bucket='my-new-archives',
+            Key='big.csv',
+            UploadId='upload1',
+            MultipartUpload={'Parts': [{'ETag': f'"part{n}"', 'PartNumber': n} for n in (1, 2, 3)]}
+        )
+
+    def test_copy_multipart_part_failed(self):
+        # Arrange
+        mock_client = AsyncMock()
+        mock_client.head_object.return_value = {'Metadata': {}}
+        mock_client.create_multipart_upload.return_value = {'UploadId': 'upload1'}
+        expected_error = botocore.exceptions.ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'UploadPartCopy')
+        mock_client.upload_part_copy.side_effect = expected_error
+
+        # Act
+        actual_results = copy_all(mock_client, [S3Object('big.csv', 12 * MB)], 5 * MB)
+
+        # Assert
+        self.assertEqual(actual_results, [('big.csv', expected_error)])
+        mock_client.complete_multipart_upload.assert_not_awaited()
+        mock_client.abort_multipart_upload.assert_awaited_once_with(Bucket='my-new-archives', Key='big.csv', UploadId='upload1')
+
+    @patch('logging.warning')
+    @patch('limiter.MIN_BACKOFF', 0.002)
+    def test_copy_limited(self, mock_logging_warning):
+        # Arrange
+        mock_client = AsyncMock()
+        slow_down = botocore.exceptions.ClientError({'Error': {'Code': 'SlowDown'}}, 'CopyObject')
+        mock_client.copy_object.side_effect = [slow_down, {'CopyObjectResult': {}}]
+        limiter = AsyncAdaptiveLimiter('copy', 8, 16)
+
+        # Act
+        actual_results = copy_all(mock_client, [S3Object('file1.csv', 10)], 5 * MB, limiter=limiter)
+
+        # Assert
+        self.assertEqual(actual_results, [('file1.csv', None)])
+        self.assertEqual(mock_client.copy_object.await_count, 2)
+        self.assertEqual((limiter.throttled_count, limiter.in_flight), (1, 0))
+
+    @patch('logging.exception')
+    def test_on_done(self, mock_logging_exception):
+        # Arrange
+        mock_client = AsyncMock()
+        mock_client.copy_object.return_value = {}
+        results = []
+
+        @asynccontextmanager
+        async def create_client():
+            yield mock_client
+
+        def on_done(s3object, error):
+            results.append((s3object.key, threading.current_thread() is copier.thread))
+            if s3object.key == 'file1.csv':
+                raise RuntimeError('database is locked')
+
+        copier = AsyncCopier(create_client, 'my-old-archives', 'my-new-archives', True, 5 * MB, 1)
+
+        # Act
+        copier.submit(S3Object('file1.csv', 10), on_done)
+        copier.submit(S3Object('file2.csv', 10), on_done)
+        copier.join()
+        copier.close()
+
+        # Assert
+        self.assertEqual(results, [('file1.csv', False), ('file2.csv', False)])
+        mock_logging_exception.assert_called_once()
+
+    def test_copy_expired(self):
+        # Arrange
+        mock_client = AsyncMock()
+        expected_s3object = S3Object('expired.csv', 10, storage_class='GLACIER', restore=RESTORE_DONE, restore_expiry=0.0)
+
+        # Act
+        actual_results = copy_all(mock_client, [expected_s3object], 5 * MB)
+
+        # Assert
+        self.assertIsInstance(actual_results[0][1], RestoreExpired)
+        mock_client.copy_object.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import base64
+import zlib
+
+# CRC32 is the one S3 checksum that is both in the standard library and available as a full-object
+# checksum of multipart uploads, so it doesn't depend on the part size and an uploaded file, its copy
+# and its copy's copy all get the same value, however they were split into parts
+CHECKSUM_ALGORITHM = 'CRC32'
+CHECKSUM_FIELD = 'ChecksumCRC32'
+FULL_OBJECT = 'FULL_OBJECT'
+CHECKSUM_FIELDS = ('ChecksumCRC64NVME', 'ChecksumCRC32C', 'ChecksumCRC32', 'ChecksumSHA256', 'ChecksumSHA1')
+# Reflected CRC32 polynomial, as used by zlib
+CRC32_POLYNOMIAL = 0xedb88320
+VERIFIED = 'verified'
+MISMATCHED = 'mismatched'
+MISSING = 'missing'
+SIZE_ONLY = 'size-only'
+
+
+def encode_crc32(crc):
+    # S3 checksums are the big-endian digest in base64
+    return base64.b64encode(crc.to_bytes(4, 'big')).decode()
+
+
+def decode_crc32(checksum):
+    return int.from_bytes(base64.b64decode(checksum), 'big')
+
+
+def crc32_checksum(data):
+    return encode_crc32(zlib.crc32(data))
+
+
+def gf2_matrix_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total = total ^ matrix[row]
+        vector = vector >> 1
+        row = row + 1
+    return total
+
+
+def gf2_matrix_square(matrix):
+    return [gf2_matrix_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1, crc2, length2):
+    # CRC32 of two blocks one after the other, from the CRC32 of each and the length of the second,
+    # like zlib's crc32_combine(). Parts uploaded in parallel are never read in order,
+    # so this is how the checksum of the whole file is had without reading it twice
+    if length2 == 0:
+        return crc1
+    # Operator that appends one zero bit, then two and four zero bits
+    odd = [CRC32_POLYNOMIAL] + [1 << n for n in range(31)]
+    even = gf2_matrix_square(odd)
+    odd = gf2_matrix_square(even)
+    # Appends length2 zero bytes to crc1, squaring the operator for every bit of the length
+    while True:
+        even = gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = gf2_matrix_times(even, crc1)
+        length2 = length2 >> 1
+        if length2 == 0:
+            break
+        odd = gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = gf2_matrix_times(odd, crc1)
+        length2 = length2 >> 1
+        if length2 == 0:
+            break
+    return crc1 ^ crc2
+
+
+def combine_checksums(parts):
+    # Full-object CRC32 of (checksum, size) parts in order, None if a part has no checksum
+    crc = 0
+    for (checksum, size) in parts:
+        if checksum is None:
+            return None
+        crc = crc32_combine(crc, decode_crc32(checksum), size)
+    return encode_crc32(crc)
+
+
+def get_checksum(head):
+    # (field, value) of the full-object checksum of a HEAD response, None for objects without one.
+    # Composite checksums ('-' and a part count) depend on the part size, so they can't be compared
+    for field in CHECKSUM_FIELDS:
+        value = head.get(field)
+        if value is not None and head.get('ChecksumType', FULL_OBJECT) == FULL_OBJECT and '-' not in value:
+            return field, value
+    return None
+
+
+def compare_heads(source, destination):
+    # Checks a copy from the metadata of both objects alone: the sizes, then the checksums when both
+    # objects have one of the same kind, then the ETags when both were uploaded in a single part
+    # (or with the same parts). Returns SIZE_ONLY when the sizes are all there is to go on
+    if source['ContentLength'] != destination['ContentLength']:
+        return MISMATCHED
+    source_checksum = get_checksum(source)
+    destination_checksum = get_checksum(destination)
+    if source_checksum is not None and destination_checksum is not None and source_checksum[0] == destination_checksum[0]:
+        return VERIFIED if source_checksum == destination_checksum else MISMATCHED
+    (source_etag, destination_etag) = (source.get('ETag'), destination.get('ETag'))
+    if source_etag is not None and source_etag == destination_etag:
+        return VERIFIED
+    if source_etag is not None and destination_etag is not None and '-' not in source_etag + destination_etag:
+        return MISMATCHED
+    return SIZE_ONLY
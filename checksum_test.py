@@ -0,0 +1,72 @@
+import os
+import unittest
+import zlib
+
+from checksum import (crc32_checksum, crc32_combine, combine_checksums, compare_heads, get_checksum, VERIFIED,
+                      MISMATCHED, SIZE_ONLY)
+
+
+class TestCombine(unittest.TestCase):
+    def test_crc32_combine(self):
+        # Arrange
+        first = os.urandom(1000)
+        second = os.urandom(5 * 1024 * 1024 + 1)
+
+        # Act
+        actual_crc = crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second))
+
+        # Assert
+        self.assertEqual(actual_crc, zlib.crc32(first + second))
+
+    def test_combine_checksums(self):
+        # Arrange
+        parts = [os.urandom(size) for size in (100, 0, 2000, 7)]
+
+        # Act
+        actual_checksum = combine_checksums((crc32_checksum(part), len(part)) for part in parts)
+
+        # Assert
+        self.assertEqual(actual_checksum, crc32_checksum(b''.join(parts)))
+
+    def test_combine_checksums_missing_part(self):
+        # Act
+        actual_checksum = combine_checksums([(crc32_checksum(b'part1'), 5), (None, 5)])
+
+        # Assert
+        self.assertIsNone(actual_checksum)
+
+
+class TestCompareHeads(unittest.TestCase):
+    def test_get_checksum(self):
+        # Act
+        actual_checksums = [
+            get_checksum({'ChecksumCRC32': 'l1ZLHg==', 'ChecksumType': 'FULL_OBJECT'}),
+            get_checksum({'ChecksumSHA256': 'abc=-3', 'ChecksumType': 'COMPOSITE'}),
+            get_checksum({'ETag': '"etag"'}),
+        ]
+
+        # Assert
+        self.assertEqual(actual_checksums, [('ChecksumCRC32', 'l1ZLHg=='), None, None])
+
+    def test_compare_heads(self):
+        cases = [
+            ({'ContentLength': 10, 'ETag': '"a-2"', 'ChecksumCRC32': 'l1ZLHg=='},
+             {'ContentLength': 10, 'ETag': '"b-3"', 'ChecksumCRC32': 'l1ZLHg=='}, VERIFIED),
+            ({'ContentLength': 10, 'ETag': '"a"', 'ChecksumCRC32': 'l1ZLHg=='},
+             {'ContentLength': 10, 'ETag': '"a"', 'ChecksumCRC32': 'AAAAAA=='}, MISMATCHED),
+            ({'ContentLength': 10, 'ETag': '"a"'}, {'ContentLength': 11, 'ETag': '"a"'}, MISMATCHED),
+            ({'ContentLength': 10, 'ETag': '"a"'}, {'ContentLength': 10, 'ETag': '"a"', 'ChecksumCRC32': 'l1ZLHg=='}, VERIFIED),
+            ({'ContentLength': 10, 'ETag': '"a"'}, {'ContentLength': 10, 'ETag': '"b"'}, MISMATCHED),
+            ({'ContentLength': 10, 'ETag': '"a-2"'}, {'ContentLength': 10, 'ETag': '"b-3"'}, SIZE_ONLY),
+        ]
+        for (source, destination, expected_status) in cases:
+            with self.subTest(source=source, destination=destination):
+                # Act
+                actual_status = compare_heads(source, destination)
+
+                # Assert
+                self.assertEqual(actual_status, expected_status)
+
+
+if __name__ == '__main__':
+    unittest.main()
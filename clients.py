@@ -0,0 +1,89 @@
+import threading
+
+import boto3
+import botocore.config
+
+S3_SERVICE_NAME = 's3'
+# Standard mode, not adaptive: the adaptive mode's rate limiter slows down the whole client, and would fight
+# the per-prefix backoff of the limiters (limiter.py), which are the one thing that reacts to SlowDown.
+# Attempts in all, the first one included, as botocore's standard mode makes by default. A request that is
+# still failing after that is reported
+RETRY_MODE = 'standard'
+MAX_ATTEMPTS = 3
+# Clients used through a limiter make a single attempt and no retry, so the limiter sees every SlowDown and
+# 5xx and retries the requests itself
+LIMITED_MAX_ATTEMPTS = 1
+# botocore's default
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+def client_options(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, max_attempts=MAX_ATTEMPTS):
+    # The pool is sized to the threads that share the client, so none of them waits for a connection or
+    # opens one that is thrown away. Keepalive stops NATs and load balancers from dropping pooled
+    # connections while a job is waiting for restores. aiobotocore's AioConfig takes the same options
+    return {
+        'max_pool_connections': max_pool_connections,
+        'retries': {'mode': RETRY_MODE, 'total_max_attempts': max_attempts},
+        'tcp_keepalive': True
+    }
+
+
+def client_config(max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, max_attempts=MAX_ATTEMPTS):
+    return botocore.config.Config(**client_options(max_pool_connections, max_attempts))
+
+
+class ClientFactory:
+    # Creates S3 clients with the tuned config, from one boto3 session per profile (None is the default
+    # profile). Sessions are created when a client first needs them. A session isn't thread-safe,
+    # so clients are created under a lock
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def session(self, profile_name=None):
+        with self.lock:
+            return self._session(profile_name)
+
+    def client(self, profile_name=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, max_attempts=MAX_ATTEMPTS):
+        config = client_config(max_pool_connections, max_attempts)
+        with self.lock:
+            return self._session(profile_name).client(S3_SERVICE_NAME, config=config)
+
+    def _session(self, profile_name):
+        session = self.sessions.get(profile_name)
+        if session is None:
+            session = boto3.Session(profile_name=profile_name)
+            self.sessions[profile_name] = session
+        return session
+
+
+class LazyClient:
+    # Stands in for an S3 client that is only created at its first use. Loading the S3 service model is most
+    # of the time it takes to create a client, so a module can have one without slowing down its import.
+    # Everything else is passed on to the client
+    def __init__(self, factory, profile_name=None, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 max_attempts=MAX_ATTEMPTS):
+        self.factory = factory
+        self.profile_name = profile_name
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.client = None
+
+    def configure(self, max_pool_connections):
+        # Sizes the pool once the number of threads is known. A client created before is replaced at its next use
+        with self.lock:
+            self.max_pool_connections = max_pool_connections
+            self.client = None
+
+    def get(self):
+        client = self.client
+        if client is not None:
+            return client
+        with self.lock:
+            if self.client is None:
+                self.client = self.factory.client(self.profile_name, self.max_pool_connections, self.max_attempts)
+            return self.client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -0,0 +1,123 @@
+import threading
+import unittest
+from unittest.mock import patch, call, MagicMock
+
+import boto3
+
+import clients
+from clients import ClientFactory, LazyClient, client_config
+
+
+class TestClientConfig(unittest.TestCase):
+    def test_client_config(self):
+        # Act
+        actual_config = client_config(42)
+        actual_client = boto3.Session(region_name='us-east-1').client(clients.S3_SERVICE_NAME, config=actual_config)
+
+        # Assert
+        self.assertEqual(actual_config.max_pool_connections, 42)
+        self.assertTrue(actual_config.tcp_keepalive)
+        self.assertEqual(actual_client.meta.config.retries, {'mode': 'standard', 'total_max_attempts': 3})
+
+    def test_client_config_limited(self):
+        # Act
+        actual_config = client_config(42, clients.LIMITED_MAX_ATTEMPTS)
+        actual_client = boto3.Session(region_name='us-east-1').client(clients.S3_SERVICE_NAME, config=actual_config)
+
+        # Assert
+        self.assertEqual(actual_client.meta.config.retries, {'mode': 'standard', 'total_max_attempts': 1})
+
+
+@patch('boto3.Session')
+class TestClientFactory(unittest.TestCase):
+    def test_client(self, mock_boto3_session):
+        # Arrange
+        factory = ClientFactory()
+
+        # Act
+        actual_client = factory.client('source_archive_profile', max_pool_connections=42)
+
+        # Assert
+        self.assertIs(actual_client, mock_boto3_session.return_value.client.return_value)
+        mock_boto3_session.assert_called_once_with(profile_name='source_archive_profile')
+        (actual_service_name,) = mock_boto3_session.return_value.client.call_args.args
+        actual_config = mock_boto3_session.return_value.client.call_args.kwargs['config']
+        self.assertEqual(actual_service_name, clients.S3_SERVICE_NAME)
+        self.assertEqual(actual_config.max_pool_connections, 42)
+
+    def test_session_per_profile(self, mock_boto3_session):
+        # Arrange
+        factory = ClientFactory()
+
+        # Act
+        factory.client()
+        factory.client('source_archive_profile')
+        factory.client()
+        factory.session('source_archive_profile')
+
+        # Assert
+        self.assertEqual(mock_boto3_session.call_args_list, [call(profile_name=None), call(profile_name='source_archive_profile')])
+
+
+class TestLazyClient(unittest.TestCase):
+    def test_created_at_first_use(self):
+        # Arrange
+        mock_factory = MagicMock()
+        lazy_client = LazyClient(mock_factory, max_pool_connections=32)
+
+        # Act
+        mock_factory.client.assert_not_called()
+        lazy_client.head_bucket(Bucket='my-old-archives')
+        lazy_client.head_bucket(Bucket='my-new-archives')
+
+        # Assert
+        mock_factory.client.assert_called_once_with(None, 32, clients.MAX_ATTEMPTS)
+        self.assertEqual(mock_factory.client.return_value.head_bucket.call_count, 2)
+
+    def test_limited(self):
+        # Arrange
+        mock_factory = MagicMock()
+        lazy_client = LazyClient(mock_factory, max_pool_connections=32, max_attempts=clients.LIMITED_MAX_ATTEMPTS)
+
+        # Act
+        lazy_client.get()
+
+        # Assert
+        mock_factory.client.assert_called_once_with(None, 32, clients.LIMITED_MAX_ATTEMPTS)
+
+    def test_configure(self):
+        # Arrange
+        mock_factory = MagicMock()
+        mock_factory.client.side_effect = lambda profile_name, max_pool_connections, max_attempts: MagicMock()
+        lazy_client = LazyClient(mock_factory)
+        first_client = lazy_client.get()
+
+        # Act
+        lazy_client.configure(64)
+        actual_client = lazy_client.get()
+
+        # Assert
+        self.assertIsNot(actual_client, first_client)
+        mock_factory.client.assert_called_with(None, 64, clients.MAX_ATTEMPTS)
+
+    def test_one_client_for_all_threads(self):
+        # Arrange
+        mock_factory = MagicMock()
+        mock_factory.client.side_effect = lambda profile_name, max_pool_connections, max_attempts: MagicMock()
+        lazy_client = LazyClient(mock_factory)
+        actual_clients = []
+
+        # Act
+        threads = [threading.Thread(target=lambda: actual_clients.append(lazy_client.get())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        self.assertEqual(mock_factory.client.call_count, 1)
+        self.assertTrue(all(client is actual_clients[0] for client in actual_clients))
+
+
+if __name__ == '__main__':
+    unittest.main()
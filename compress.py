@@ -0,0 +1,134 @@
+import gzip
+import importlib
+import logging
+import multiprocessing
+import shutil
+import sys
+import zlib
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import pread
+
+from clients import ClientFactory
+
+PROGRAM_DESCRIPTION = 'Downloads an object uploaded by archive.py --compress and decompresses it'
+LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
+LOG_LEVEL = logging.INFO
+MB = 1024 * 1024
+GZIP = 'gzip'
+ZSTD = 'zstd'
+CODECS = (GZIP, ZSTD)
+LEVELS = {GZIP: 6, ZSTD: 3}
+# Input compressed by one worker at a time. Every chunk is a complete gzip member or zstd frame,
+# and a file's chunks one after the other are a valid stream for gunzip or zstd -d
+CHUNK_SIZE = 16 * MB
+# Chunks of a file compressed ahead of its upload, per file
+MAX_CHUNKS_AHEAD = 4
+# The workers are started by the first upload thread that needs one, while botocore's and the metrics'
+# threads are running. A forked child could inherit a lock one of them holds, spawned ones start afresh
+START_METHOD = 'spawn'
+METADATA_CODEC = 'compression'
+METADATA_SIZE = 'uncompressed-size'
+# Files that won't get any smaller
+COMPRESSED_SUFFIXES = ('.gz', '.tgz', '.zst', '.bz2', '.xz', '.zip', '.7z', '.jpg', '.jpeg', '.png', '.mp4', '.mov')
+
+
+def compress_chunk(codec, level, path, offset, size):
+    # Runs in a worker process: it reads its own chunk, so only the compressed bytes and the CRC32
+    # of the uncompressed ones are sent back
+    with open(path, 'rb') as f:
+        data = pread(f.fileno(), size, offset)
+    crc = zlib.crc32(data)
+    if codec == GZIP:
+        return gzip.compress(data, compresslevel=level, mtime=0), crc, len(data)
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data), crc, len(data)
+
+
+def is_compressed(key):
+    return key.lower().endswith(COMPRESSED_SUFFIXES)
+
+
+def open_decompressed(codec, fileobj):
+    # Reads across all the members or frames a compressed upload is made of
+    if codec == GZIP:
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if codec == ZSTD:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+    raise ValueError(f'Unknown compression {codec}')
+
+
+def decompress_file(codec, source_path, path):
+    with open(source_path, 'rb') as source, open(path, 'wb') as f:
+        shutil.copyfileobj(open_decompressed(codec, source), f, CHUNK_SIZE)
+
+
+def get_object_decompressed(client, bucket, key, path):
+    # Objects without the compression metadata are written as they are. Returns the codec
+    response = client.get_object(Bucket=bucket, Key=key)
+    codec = response.get('Metadata', {}).get(METADATA_CODEC)
+    body = response['Body']
+    if codec is not None:
+        body = open_decompressed(codec, body)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(body, f, CHUNK_SIZE)
+    return codec
+
+
+class Compressor:
+    # Compresses files in a pool of processes shared by all upload threads, so compression isn't held
+    # up by the GIL. Each file's chunks come back in order, at most MAX_CHUNKS_AHEAD at a time
+    def __init__(self, codec, level=None, processes=None, chunk_size=CHUNK_SIZE):
+        if codec == ZSTD:
+            # Only checks that zstandard is there, so a missing module fails here rather than in every worker
+            importlib.import_module('zstandard')
+        self.codec = codec
+        self.level = level if level is not None else LEVELS[codec]
+        self.chunk_size = chunk_size
+        self.pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context(START_METHOD))
+
+    def metadata(self, size):
+        return {METADATA_CODEC: self.codec, METADATA_SIZE: str(size)}
+
+    def compress_file(self, path, size):
+        # Yields (compressed chunk, CRC32 of the chunk's input, input size).
+        # An empty file still gets one chunk, so it decompresses to an empty file
+        offsets = iter(range(0, max(size, 1), self.chunk_size))
+        pending = deque()
+        for offset in offsets:
+            pending.append(self._submit(path, offset, size))
+            if len(pending) == MAX_CHUNKS_AHEAD:
+                break
+        while pending:
+            chunk = pending.popleft().result()
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(self._submit(path, offset, size))
+            yield chunk
+
+    def _submit(self, path, offset, size):
+        return self.pool.submit(compress_chunk, self.codec, self.level, path, offset, min(self.chunk_size, size - offset))
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    parser = ArgumentParser(description=PROGRAM_DESCRIPTION)
+    parser.add_argument('bucket')
+    parser.add_argument('key')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    client = ClientFactory().client()
+    codec = get_object_decompressed(client, args.bucket, args.key, args.path)
+    logging.info(f'{args.key} written to {args.path}' + (f', decompressed from {codec}' if codec else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+import zlib
+from os.path import join
+from unittest.mock import MagicMock
+
+from compress import Compressor, get_object_decompressed, is_compressed, open_decompressed, GZIP
+
+
+class TestCompressor(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.compressor = Compressor(GZIP, processes=2, chunk_size=1000)
+
+    def tearDown(self):
+        self.compressor.close()
+        self.tmp_dir.cleanup()
+
+    def test_compress_file(self):
+        # Arrange
+        expected_data = b''.join(f'{i},line of a log file\\n'.encode() for i in range(2000))
+        path = join(self.tmp_dir.name, 'app.log')
+        with open(path, 'wb') as f:
+            f.write(expected_data)
+
+        # Act
+        actual_results = list(self.compressor.compress_file(path, len(expected_data)))
+
+        # Assert
+        actual_chunks = [chunk for (chunk, crc, size) in actual_results]
+        self.assertEqual([size for (chunk, crc, size) in actual_results][:2], [1000, 1000])
+        self.assertEqual(actual_results[0][1], zlib.crc32(expected_data[:1000]))
+        self.assertEqual(len(actual_chunks), -(-len(expected_data) // 1000))
+        self.assertLess(sum(len(chunk) for chunk in actual_chunks), len(expected_data))
+        self.assertEqual(gzip.decompress(b''.join(actual_chunks)), expected_data)
+        self.assertEqual(open_decompressed(GZIP, io.BytesIO(b''.join(actual_chunks))).read(), expected_data)
+
+    def test_compress_empty_file(self):
+        # Arrange
+        path = join(self.tmp_dir.name, 'empty.log')
+        open(path, 'wb').close()
+
+        # Act
+        actual_results = list(self.compressor.compress_file(path, 0))
+
+        # Assert
+        self.assertEqual(gzip.decompress(b''.join(chunk for (chunk, crc, size) in actual_results)), b'')
+        self.assertEqual([(crc, size) for (chunk, crc, size) in actual_results], [(0, 0)])
+
+    def test_metadata(self):
+        # Act
+        actual_metadata = self.compressor.metadata(1234)
+
+        # Assert
+        self.assertEqual(actual_metadata, {'compression': 'gzip', 'uncompressed-size': '1234'})
+
+
+class TestDecompress(unittest.TestCase):
+    def test_get_object_decompressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            expected_data = os.urandom(100) * 50
+            mock_client = MagicMock()
+            mock_client.get_object.return_value = {
+                'Metadata': {'compression': 'gzip'},
+                'Body': io.BytesIO(gzip.compress(expected_data[:1000]) + gzip.compress(expected_data[1000:])),
+            }
+            path = join(directory, 'app.log')
+
+            # Act
+            actual_codec = get_object_decompressed(mock_client, 'my-archive-bucket', 'archive/2024/app.log', path)
+
+            # Assert
+            self.assertEqual(actual_codec, 'gzip')
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), expected_data)
+            mock_client.get_object.assert_called_with(Bucket='my-archive-bucket', Key='archive/2024/app.log')
+
+    def test_get_object_not_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            mock_client = MagicMock()
+            mock_client.get_object.return_value = {'Metadata': {}, 'Body': io.BytesIO(b'plain')}
+            path = join(directory, 'app.log')
+
+            # Act
+            actual_codec = get_object_decompressed(mock_client, 'my-archive-bucket', 'archive/2024/app.log', path)
+
+            # Assert
+            self.assertIsNone(actual_codec)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'plain')
+
+    def test_is_compressed(self):
+        # Act
+        actual = [is_compressed('logs/app.log'), is_compressed('logs/app.log.gz'), is_compressed('photos/IMG.JPG')]
+
+        # Assert
+        self.assertEqual(actual, [False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
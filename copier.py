@@ -0,0 +1,240 @@
+import logging
+import math
+import threading
+import time
+from itertools import count
+from queue import PriorityQueue
+
+import botocore.exceptions
+
+from checksum import CHECKSUM_ALGORITHM, CHECKSUM_FIELD, FULL_OBJECT
+
+MB = 1024 * 1024
+COPY_PART_SIZE_MB = 256
+MIN_COPY_PART_SIZE_MB = 5
+# Both CopyObject and UploadPartCopy take at most 5 GB at once
+MAX_COPY_PART_SIZE_MB = 5 * 1024
+MAX_PARTS = 10000
+# Parts of started uploads go ahead of new objects with the same priority, so only a few
+# multipart uploads are open at a time and every object is finished as early as possible
+PART_TASK = 0
+OBJECT_TASK = 1
+# Objects waiting or being worked on, per worker. submit blocks when they are all taken, so a listing or a
+# journal of millions of objects is only read as fast as its objects are done
+QUEUED_OBJECTS_PER_THREAD = 10
+# S3 computes the checksum of the copy while it copies, as a full-object checksum for multipart copies
+# too, so a copy can be checked against its source whatever its part size
+COPY_CHECKSUM_ARGS = {'ChecksumAlgorithm': CHECKSUM_ALGORITHM}
+MULTIPART_CHECKSUM_ARGS = {'ChecksumAlgorithm': CHECKSUM_ALGORITHM, 'ChecksumType': FULL_OBJECT}
+
+
+class RestoreExpired(Exception):
+    pass
+
+
+def get_part_size(object_size, part_size):
+    # S3 allows at most MAX_PARTS parts per upload, so huge objects get bigger parts
+    return max(part_size, math.ceil(object_size / MAX_PARTS / MB) * MB)
+
+
+def get_copy_source(source_bucket, s3object):
+    copy_source = {'CopySource': {'Bucket': source_bucket, 'Key': s3object.key}}
+    if s3object.etag is not None:
+        # Fails the copy instead of mixing parts of two versions if the object changes meanwhile
+        copy_source['CopySourceIfMatch'] = s3object.etag
+    return copy_source
+
+
+def get_part_range(object_size, part_size, part_number):
+    first_byte = (part_number - 1) * part_size
+    last_byte = min(first_byte + part_size, object_size) - 1
+    return f'bytes={first_byte}-{last_byte}'
+
+
+def get_copy_part(response, part_number):
+    result = response['CopyPartResult']
+    part = {'ETag': result['ETag'], 'PartNumber': part_number}
+    if CHECKSUM_FIELD in result:
+        part[CHECKSUM_FIELD] = result[CHECKSUM_FIELD]
+    return part
+
+
+def clamp_part_size(part_size):
+    return min(max(part_size, MIN_COPY_PART_SIZE_MB * MB), MAX_COPY_PART_SIZE_MB * MB)
+
+
+def is_expired(s3object, now):
+    return s3object.restore_expiry is not None and s3object.restore_expiry <= now
+
+
+class MultipartCopy:
+    # One multipart copy, shared by the workers copying its parts. The worker that copies the
+    # last part completes (or aborts) the upload
+    def __init__(self, s3object, upload_id, part_size, part_count, on_done):
+        self.s3object = s3object
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.parts = [None] * part_count
+        self.remaining = part_count
+        self.error = None
+
+    def part_done(self, part_number, part, error):
+        # Returns True for the last part
+        with self.lock:
+            if error is None:
+                self.parts[part_number - 1] = part
+            elif self.error is None:
+                self.error = error
+            self.remaining = self.remaining - 1
+            return self.remaining == 0
+
+
+class WorkerPool:
+    # Worker threads serving one priority queue of object and part tasks, for the Copier and the Downloader.
+    # Tasks with the same priority run parts first, then in the order they were put
+    def __init__(self, threads):
+        self.queue = PriorityQueue()
+        self.sequence = count()
+        self.slots = threading.BoundedSemaphore(max(threads, 1) * QUEUED_OBJECTS_PER_THREAD)
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def join(self):
+        # Waits until every submitted object is done, parts included
+        self.queue.join()
+
+    def close(self):
+        for _ in self.workers:
+            self._put(math.inf, OBJECT_TASK, None)
+        for worker in self.workers:
+            worker.join()
+
+    def _put(self, priority, kind, function, *args):
+        self.queue.put((priority, kind, next(self.sequence), function, args))
+
+    def _put_object(self, priority, function, *args):
+        # Parts are put by the workers and never wait, only new objects do
+        self.slots.acquire()
+        self._put(priority, OBJECT_TASK, function, *args)
+
+    def _work(self):
+        while True:
+            (_, kind, _, function, args) = self.queue.get()
+            try:
+                if function is None:
+                    return
+                function(*args)
+            except Exception:
+                # An error of on_done (e.g. the journal's) mustn't take the worker down with it
+                logging.exception(f'{function.__name__} failed')
+            finally:
+                if kind == OBJECT_TASK and function is not None:
+                    self.slots.release()
+                self.queue.task_done()
+
+
+class Copier(WorkerPool):
+    # Server-side copies from one bucket to another. Objects up to part_size are copied with a single
+    # CopyObject, bigger ones are split into UploadPartCopy ranges. Objects and parts go through one
+    # priority queue served by all the workers, so a few huge objects can't hold up the small ones
+    # and their parts are copied in parallel. on_done(s3object, error) is called once per object
+    def __init__(self, client, source_bucket, dest_bucket, copy_to_glacier, part_size, threads, clock=time.time):
+        self.client = client
+        self.source_bucket = source_bucket
+        self.dest_bucket = dest_bucket
+        self.part_size = clamp_part_size(part_size)
+        self.clock = clock
+        self.extra_args = {}
+        if copy_to_glacier:
+            self.extra_args = {'StorageClass': 'GLACIER'}
+        super().__init__(threads)
+
+    def submit(self, s3object, on_done, priority=0):
+        self._put_object(priority, self._copy, s3object, on_done, priority)
+
+    def _copy(self, s3object, on_done, priority):
+        if is_expired(s3object, self.clock()):
+            on_done(s3object, RestoreExpired(f'Restored copy of {s3object.key} has expired'))
+            return
+        if s3object.size <= self.part_size:
+            try:
+                response = self.client.copy_object(
+                    Bucket=self.dest_bucket,
+                    Key=s3object.key,
+                    **get_copy_source(self.source_bucket, s3object),
+                    **self.extra_args,
+                    **COPY_CHECKSUM_ARGS
+                )
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                on_done(s3object, e)
+                return
+            s3object.checksum = response.get('CopyObjectResult', {}).get(CHECKSUM_FIELD)
+            on_done(s3object, None)
+            return
+        self._start_multipart(s3object, on_done, priority)
+
+    def _start_multipart(self, s3object, on_done, priority):
+        part_size = get_part_size(s3object.size, self.part_size)
+        part_count = math.ceil(s3object.size / part_size)
+        try:
+            # A multipart copy doesn't carry the source's metadata over like CopyObject does
+            head = self.client.head_object(Bucket=self.source_bucket, Key=s3object.key)
+            upload_args = {'Metadata': head.get('Metadata', {})}
+            if 'ContentType' in head:
+                upload_args['ContentType'] = head['ContentType']
+            response = self.client.create_multipart_upload(
+                Bucket=self.dest_bucket,
+                Key=s3object.key,
+                **upload_args,
+                **self.extra_args,
+                **MULTIPART_CHECKSUM_ARGS
+            )
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            on_done(s3object, e)
+            return
+        upload = MultipartCopy(s3object, response['UploadId'], part_size, part_count, on_done)
+        for part_number in range(1, part_count + 1):
+            self._put(priority, PART_TASK, self._copy_part, upload, part_number)
+
+    def _copy_part(self, upload, part_number):
+        part = None
+        error = upload.error
+        if error is None:
+            try:
+                response = self.client.upload_part_copy(
+                    Bucket=self.dest_bucket,
+                    Key=upload.s3object.key,
+                    UploadId=upload.upload_id,
+                    PartNumber=part_number,
+                    CopySourceRange=get_part_range(upload.s3object.size, upload.part_size, part_number),
+                    **get_copy_source(self.source_bucket, upload.s3object)
+                )
+                part = get_copy_part(response, part_number)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                error = e
+        if upload.part_done(part_number, part, error):
+            self._finish_multipart(upload)
+
+    def _finish_multipart(self, upload):
+        error = upload.error
+        if error is None:
+            try:
+                response = self.client.complete_multipart_upload(
+                    Bucket=self.dest_bucket,
+                    Key=upload.s3object.key,
+                    UploadId=upload.upload_id,
+                    MultipartUpload={'Parts': upload.parts}
+                )
+                upload.s3object.checksum = response.get(CHECKSUM_FIELD)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                error = e
+        if error is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.dest_bucket, Key=upload.s3object.key, UploadId=upload.upload_id)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError):
+                # The upload is left for the bucket's lifecycle rule to clean up
+                pass
+        upload.on_done(upload.s3object, error)
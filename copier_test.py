@@ -0,0 +1,195 @@
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+import botocore.exceptions
+
+from copier import Copier, RestoreExpired, MB, MIN_COPY_PART_SIZE_MB, MAX_COPY_PART_SIZE_MB
+from s3object import S3Object, RESTORE_DONE
+
+
+def copy_all(client, s3objects, part_size, copy_to_glacier=True):
+    results = []
+    copier = Copier(client, 'my-old-archives', 'my-new-archives', copy_to_glacier, part_size, 4)
+    for s3object in s3objects:
+        copier.submit(s3object, lambda s3object, error: results.append((s3object.key, error)))
+    copier.join()
+    copier.close()
+    return results
+
+
+class TestCopier(unittest.TestCase):
+    def test_copy_single_object(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.copy_object.return_value = {'CopyObjectResult': {'ETag': '"etag1"', 'ChecksumCRC32': 'l1ZLHg=='}}
+        expected_s3object = S3Object('file1.csv', 10, '"etag1"')
+
+        # Act
+        actual_results = copy_all(mock_client, [expected_s3object], 5 * MB)
+
+        # Assert
+        self.assertEqual(actual_results, [('file1.csv', None)])
+        mock_client.copy_object.assert_called_once_with(
+            Bucket='my-new-archives',
+            Key='file1.csv',
+            CopySource={'Bucket': 'my-old-archives', 'Key': 'file1.csv'},
+            CopySourceIfMatch='"etag1"',
+            StorageClass='GLACIER',
+            ChecksumAlgorithm='CRC32'
+        )
+        mock_client.create_multipart_upload.assert_not_called()
+        self.assertEqual(expected_s3object.checksum, 'l1ZLHg==')
+
+    def test_copy_single_object_fast_access(self):
+        # Arrange
+        mock_client = MagicMock()
+
+        # Act
+        copy_all(mock_client, [S3Object('file1.csv', 10)], 5 * MB, copy_to_glacier=False)
+
+        # Assert
+        mock_client.copy_object.assert_called_once_with(
+            Bucket='my-new-archives',
+            Key='file1.csv',
+            CopySource={'Bucket': 'my-old-archives', 'Key': 'file1.csv'},
+            ChecksumAlgorithm='CRC32'
+        )
+
+    def test_copy_multipart(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.head_object.return_value = {'ContentType': 'text/csv', 'Metadata': {'owner': 'me'}}
+        mock_client.create_multipart_upload.return_value = {'UploadId': 'upload1'}
+        mock_client.upload_part_copy.side_effect = lambda **kwargs: {
+            'CopyPartResult': {'ETag': f'"part{kwargs["PartNumber"]}"', 'ChecksumCRC32': f'crc{kwargs["PartNumber"]}'}
+        }
+        mock_client.complete_multipart_upload.return_value = {'ChecksumCRC32': 'crc-big', 'ChecksumType': 'FULL_OBJECT'}
+        expected_s3object = S3Object('big.csv', 12 * MB, '"etag-big-3"')
+        expected_ranges = {1: f'bytes=0-{5 * MB - 1}', 2: f'bytes={5 * MB}-{10 * MB - 1}', 3: f'bytes={10 * MB}-{12 * MB - 1}'}
+
+        # Act
+        actual_results = copy_all(mock_client, [expected_s3object, S3Object('small.csv', 10)], 5 * MB)
+
+        # Assert
+        self.assertEqual(sorted(actual_results), [('big.csv', None), ('small.csv', None)])
+        mock_client.create_multipart_upload.assert_called_once_with(
+            Bucket='my-new-archives',
+            Key='big.csv',
+            Metadata={'owner': 'me'},
+            ContentType='text/csv',
+            StorageClass='GLACIER',
+            ChecksumAlgorithm='CRC32',
+            ChecksumType='FULL_OBJECT'
+        )
+        actual_ranges = {c.kwargs['PartNumber']: c.kwargs['CopySourceRange'] for c in mock_client.upload_part_copy.call_args_list}
+        self.assertEqual(actual_ranges, expected_ranges)
+        mock_client.complete_multipart_upload.assert_called_once_with(
+            Bucket='my-new-archives',
+            Key='big.csv',
+            UploadId='upload1',
+            MultipartUpload={'Parts': [{'ETag': f'"part{n}"', 'PartNumber': n, 'ChecksumCRC32': f'crc{n}'} for n in (1, 2, 3)]}
+        )
+        mock_client.copy_object.assert_called_once()
+        self.assertEqual(expected_s3object.checksum, 'crc-big')
+
+    def test_copy_multipart_part_failed(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.head_object.return_value = {'Metadata': {}}
+        mock_client.create_multipart_upload.return_value = {'UploadId': 'upload1'}
+        expected_error = botocore.exceptions.ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'UploadPartCopy')
+        mock_client.upload_part_copy.side_effect = expected_error
+
+        # Act
+        actual_results = copy_all(mock_client, [S3Object('big.csv', 12 * MB)], 5 * MB)
+
+        # Assert
+        self.assertEqual(actual_results, [('big.csv', expected_error)])
+        mock_client.complete_multipart_upload.assert_not_called()
+        mock_client.abort_multipart_upload.assert_called_once_with(Bucket='my-new-archives', Key='big.csv', UploadId='upload1')
+
+    def test_copy_expired(self):
+        # Arrange
+        mock_client = MagicMock()
+        expected_s3object = S3Object('expired.csv', 10, storage_class='GLACIER', restore=RESTORE_DONE, restore_expiry=0.0)
+
+        # Act
+        actual_results = copy_all(mock_client, [expected_s3object], 5 * MB)
+
+        # Assert
+        self.assertIsInstance(actual_results[0][1], RestoreExpired)
+        mock_client.copy_object.assert_not_called()
+
+    @patch('logging.exception')
+    def test_on_done_error(self, mock_logging_exception):
+        # Arrange
+        mock_client = MagicMock()
+        results = []
+        copier = Copier(mock_client, 'my-old-archives', 'my-new-archives', True, 5 * MB, 1)
+
+        def on_done(s3object, error):
+            results.append(s3object.key)
+            if s3object.key == 'file1.csv':
+                raise RuntimeError('database is locked')
+
+        # Act
+        copier.submit(S3Object('file1.csv', 10), on_done)
+        copier.submit(S3Object('file2.csv', 10), on_done)
+        copier.join()
+        copier.close()
+
+        # Assert
+        self.assertEqual(results, ['file1.csv', 'file2.csv'])
+        mock_logging_exception.assert_called_once()
+
+    @patch('copier.QUEUED_OBJECTS_PER_THREAD', 1)
+    def test_submit_blocks(self):
+        # Arrange
+        mock_client = MagicMock()
+        copying = threading.Event()
+        copied = threading.Event()
+
+        def copy_object(**kwargs):
+            copying.set()
+            copied.wait()
+            return {}
+
+        mock_client.copy_object.side_effect = copy_object
+        copier = Copier(mock_client, 'my-old-archives', 'my-new-archives', True, 5 * MB, 1)
+        submitted = []
+
+        def submit_all():
+            for key in ('file1.csv', 'file2.csv'):
+                copier.submit(S3Object(key, 10), lambda s3object, error: None)
+                submitted.append(key)
+
+        # Act
+        submitter = threading.Thread(target=submit_all)
+        submitter.start()
+        copying.wait()
+        submitter.join(0.1)
+        actual_submitted_while_copying = list(submitted)
+        copied.set()
+        submitter.join()
+        copier.join()
+        copier.close()
+
+        # Assert
+        self.assertEqual(actual_submitted_while_copying, ['file1.csv'])
+        self.assertEqual(submitted, ['file1.csv', 'file2.csv'])
+        self.assertEqual(mock_client.copy_object.call_count, 2)
+
+    def test_part_size_limits(self):
+        # Act
+        actual_part_sizes = [
+            Copier(MagicMock(), 'a', 'b', True, 1 * MB, 0).part_size,
+            Copier(MagicMock(), 'a', 'b', True, 10 * 1024 * MB, 0).part_size,
+        ]
+
+        # Assert
+        self.assertEqual(actual_part_sizes, [MIN_COPY_PART_SIZE_MB * MB, MAX_COPY_PART_SIZE_MB * MB])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from contextlib import asynccontextmanager
+
+from async_copier import AsyncCopier, IN_FLIGHT
+from copier import Copier, MB, COPY_PART_SIZE_MB
+from s3object import S3Object
+
+PROGRAM_DESCRIPTION = ('Compares the thread pool and asyncio copy engines on simulated CopyObject requests. '
+                       'Every request takes LATENCY ms and nothing else, so the results show how many requests '
+                       'each engine keeps in flight, not how fast S3 is')
+NUMBER_OF_OBJECTS = 5000
+LATENCY_MS = 50
+THREAD_COUNTS = (10, 100)
+# What the copiers read from a CopyObject response
+SIMULATED_RESPONSE = {'CopyObjectResult': {}}
+OBJECTS_FLAG_HELP_MESSAGE = f'number of simulated objects (default: {NUMBER_OF_OBJECTS})'
+LATENCY_FLAG_HELP_MESSAGE = f'time every simulated request takes in ms (default: {LATENCY_MS})'
+THREADS_FLAG_HELP_MESSAGE = f'thread counts to run the thread pool engine with (default: {" ".join(map(str, THREAD_COUNTS))})'
+IN_FLIGHT_FLAG_HELP_MESSAGE = f'in-flight limits to run the asyncio engine with (default: {IN_FLIGHT})'
+
+
+class InFlightCounter:
+    # Shared by the simulated clients, which can't share a base class: one's copy_object is a coroutine
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def start(self):
+        with self.lock:
+            self.in_flight = self.in_flight + 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self):
+        with self.lock:
+            self.in_flight = self.in_flight - 1
+
+
+class SimulatedClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.counter = InFlightCounter()
+
+    def copy_object(self, **kwargs):
+        self.counter.start()
+        time.sleep(self.latency)
+        self.counter.end()
+        return SIMULATED_RESPONSE
+
+
+class SimulatedAsyncClient:
+    def __init__(self, latency):
+        self.latency = latency
+        self.counter = InFlightCounter()
+
+    async def copy_object(self, **kwargs):
+        self.counter.start()
+        await asyncio.sleep(self.latency)
+        self.counter.end()
+        return SIMULATED_RESPONSE
+
+
+def listing(number_of_objects):
+    for i in range(number_of_objects):
+        yield S3Object(f'benchmark/{i:08d}', 1024, f'"{i:032x}"')
+
+
+def run(name, copier, client, number_of_objects):
+    copied = []
+    start = time.perf_counter()
+    for s3object in listing(number_of_objects):
+        copier.submit(s3object, lambda s3object, error: copied.append(error))
+    copier.join()
+    elapsed = time.perf_counter() - start
+    copier.close()
+    print(f'{name:<24} {len(copied):>8} objects {elapsed:>8.2f} s {len(copied) / elapsed:>10.0f} objects/s '
+          f'{client.counter.max_in_flight:>6} max in flight')
+
+
+def main():
+    parser = ArgumentParser(description=PROGRAM_DESCRIPTION)
+    parser.add_argument('-n', '--objects', type=int, default=NUMBER_OF_OBJECTS, help=OBJECTS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-l', '--latency', type=int, default=LATENCY_MS, help=LATENCY_FLAG_HELP_MESSAGE)
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=list(THREAD_COUNTS), help=THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--in-flight', type=int, nargs='+', default=[IN_FLIGHT], help=IN_FLIGHT_FLAG_HELP_MESSAGE)
+    args = parser.parse_args()
+    latency = args.latency / 1000
+
+    for threads in args.threads:
+        client = SimulatedClient(latency)
+        copier = Copier(client, 'source', 'destination', False, COPY_PART_SIZE_MB * MB, threads)
+        run(f'threads={threads}', copier, client, args.objects)
+
+    for in_flight in args.in_flight:
+        client = SimulatedAsyncClient(latency)
+
+        @asynccontextmanager
+        async def create_client(client=client):
+            yield client
+
+        copier = AsyncCopier(create_client, 'source', 'destination', False, COPY_PART_SIZE_MB * MB, in_flight)
+        run(f'asyncio in-flight={in_flight}', copier, client, args.objects)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import errno
+import logging
+import math
+import os
+import threading
+import time
+
+import botocore.exceptions
+
+from compress import METADATA_CODEC, METADATA_SIZE, decompress_file
+from copier import RestoreExpired, MB, PART_TASK, WorkerPool, get_part_range, get_part_size, is_expired
+
+DOWNLOAD_PART_SIZE_MB = 64
+MIN_DOWNLOAD_PART_SIZE_MB = 1
+# A part's body is written as it arrives, this much at a time, so no part is ever held in memory
+WRITE_CHUNK_SIZE = 1 * MB
+MAX_PART_ATTEMPTS = 5
+PARTIAL_SUFFIX = '.partial'
+PARTS_SUFFIX = '.parts'
+DECOMPRESSING_SUFFIX = '.decompressing'
+
+
+def local_path(folder, prefix, key):
+    # Keys are stored relative to the prefix. archive.py uploads to prefix/key, so a backup without a prefix has
+    # keys starting with '/'. A key that would end up outside the folder ('../', '//etc') is refused
+    relative_key = key[len(prefix) + 1:] if prefix else key.removeprefix('/')
+    folder = os.path.abspath(folder)
+    path = os.path.normpath(os.path.join(folder, relative_key))
+    if os.path.commonpath([folder, path]) != folder:
+        raise ValueError(f'{key} would be written outside of {folder}')
+    return path
+
+
+def parts_header(s3object, part_size):
+    return f'{s3object.etag} {part_size}'
+
+
+def read_done_parts(parts_path, header):
+    # The parts file starts with the ETag of the object the parts came from and the part size, then has one
+    # part number per line. Returns None when there's nothing to resume from: no file, or a file for another
+    # version of the object or another part size
+    try:
+        with open(parts_path) as f:
+            lines = f.read().split('\n')
+    except FileNotFoundError:
+        return None
+    # The last line is cut short if the process died while writing it
+    lines = lines[:-1]
+    if not lines or lines[0] != header:
+        return None
+    return {int(line) for line in lines[1:]}
+
+
+def allocate(fd, size):
+    # Reserves the blocks up front, so a full disk fails the download now rather than halfway through.
+    # Filesystems that can't do it just get a sparse file
+    if size == 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+            raise
+
+
+class PartialDownload:
+    # A file being downloaded. It's allocated at its full size under a .partial name and every part is
+    # written at its own offset. A part is recorded in the .parts file once its data is on disk, so an
+    # interrupted download only fetches the parts that are missing. The last part moves the file into place,
+    # or decompresses it there when the object was uploaded with archive.py --compress
+    def __init__(self, s3object, path, part_size):
+        self.s3object = s3object
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.parts_path = path + PARTS_SUFFIX
+        self.part_size = part_size
+        self.lock = threading.Lock()
+        self.error = None
+        # The compression metadata comes with every part's GET
+        self.codec = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = parts_header(s3object, part_size)
+        done_parts = read_done_parts(self.parts_path, header)
+        self.fd = os.open(self.partial_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(self.fd, s3object.size)
+            allocate(self.fd, s3object.size)
+            if done_parts is None:
+                done_parts = set()
+                self.parts_file = open(self.parts_path, 'w')
+                self.parts_file.write(f'{header}\n')
+                self.parts_file.flush()
+            else:
+                self.parts_file = open(self.parts_path, 'a')
+        except OSError:
+            os.close(self.fd)
+            raise
+        part_count = math.ceil(s3object.size / part_size)
+        self.missing_parts = [part_number for part_number in range(1, part_count + 1) if part_number not in done_parts]
+        self.remaining = len(self.missing_parts)
+
+    def write(self, data, offset):
+        while data:
+            written = os.pwrite(self.fd, data, offset)
+            data = data[written:]
+            offset = offset + written
+
+    def part_done(self, part_number, error):
+        # Returns True for the last part
+        if error is None:
+            try:
+                os.fsync(self.fd)
+            except OSError as e:
+                error = e
+        with self.lock:
+            if error is None:
+                self.parts_file.write(f'{part_number}\n')
+                self.parts_file.flush()
+            elif self.error is None:
+                self.error = error
+            self.remaining = self.remaining - 1
+            return self.remaining == 0
+
+    def finish(self):
+        # Returns the error of the first failed part, or of the decompression. The partial file is kept
+        # for the next run then
+        os.close(self.fd)
+        self.parts_file.close()
+        if self.error is not None:
+            return self.error
+        if self.codec is None:
+            os.replace(self.partial_path, self.path)
+        else:
+            decompressing_path = self.path + DECOMPRESSING_SUFFIX
+            try:
+                decompress_file(self.codec, self.partial_path, decompressing_path)
+            except Exception as e:
+                # A truncated or corrupt stream, or zstd without zstandard installed
+                logging.error(f'{self.s3object.key} could not be decompressed from {self.codec}: {e}')
+                if os.path.exists(decompressing_path):
+                    os.remove(decompressing_path)
+                return e
+            os.replace(decompressing_path, self.path)
+            os.remove(self.partial_path)
+        os.remove(self.parts_path)
+        return None
+
+
+class Downloader(WorkerPool):
+    # Downloads restored objects to a local folder, with the same interface as copier.Copier. Every object is
+    # split into ranges of part_size that are fetched by parallel GETs. Objects and parts go through one
+    # priority queue served by all the workers, and parts of started files go first, so only a few files
+    # are open at a time. Compressed objects are written decompressed. on_done(s3object, error) is called
+    # once per object
+    def __init__(self, client, bucket, folder, prefix, part_size, threads, clock=time.time):
+        self.client = client
+        self.bucket = bucket
+        self.folder = folder
+        self.prefix = prefix
+        self.part_size = max(part_size, MIN_DOWNLOAD_PART_SIZE_MB * MB)
+        self.clock = clock
+        super().__init__(threads)
+
+    def submit(self, s3object, on_done, priority=0):
+        self._put_object(priority, self._download, s3object, on_done, priority)
+
+    def _metadata(self, s3object):
+        return self.client.head_object(Bucket=self.bucket, Key=s3object.key).get('Metadata', {})
+
+    def _is_downloaded(self, s3object, path):
+        # A compressed object was written decompressed, its metadata has the size it was written at
+        size = os.path.getsize(path)
+        if size == s3object.size:
+            return True
+        metadata = self._metadata(s3object)
+        return METADATA_CODEC in metadata and metadata.get(METADATA_SIZE) == str(size)
+
+    def _download(self, s3object, on_done, priority):
+        if is_expired(s3object, self.clock()):
+            on_done(s3object, RestoreExpired(f'Restored copy of {s3object.key} has expired'))
+            return
+        try:
+            path = local_path(self.folder, self.prefix, s3object.key)
+            if s3object.key.endswith('/'):
+                # A "folder" created in the S3 console
+                os.makedirs(path, exist_ok=True)
+                on_done(s3object, None)
+                return
+            if os.path.isfile(path) and self._is_downloaded(s3object, path):
+                logging.debug(f'{path} was downloaded by an earlier run, skipped')
+                on_done(s3object, None)
+                return
+            download = PartialDownload(s3object, path, get_part_size(s3object.size, self.part_size))
+            if download.remaining == 0 and s3object.size > 0:
+                # Every part was fetched by an earlier run, which stopped before it finished the file
+                download.codec = self._metadata(s3object).get(METADATA_CODEC)
+        except (ValueError, OSError, botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            on_done(s3object, e)
+            return
+        if download.remaining == 0:
+            on_done(s3object, download.finish())
+            return
+        for part_number in download.missing_parts:
+            self._put(priority, PART_TASK, self._download_part, download, part_number, on_done)
+
+    def _download_part(self, download, part_number, on_done):
+        error = download.error
+        if error is None:
+            error = self._fetch_part(download, part_number)
+        if download.part_done(part_number, error):
+            on_done(download.s3object, download.finish())
+
+    def _fetch_part(self, download, part_number):
+        # Returns None once the part is written, or the error. A connection that drops in the middle of
+        # the body is retried here, the limiter only sees requests that failed before the body
+        s3object = download.s3object
+        arguments = {
+            'Bucket': self.bucket,
+            'Key': s3object.key,
+            'Range': get_part_range(s3object.size, download.part_size, part_number),
+        }
+        if s3object.etag is not None:
+            # Fails the download instead of mixing parts of two versions if the object changes meanwhile
+            arguments['IfMatch'] = s3object.etag
+        attempt = 1
+        while True:
+            try:
+                response = self.client.get_object(**arguments)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError, OSError) as e:
+                # The limiter has already retried the request
+                return e
+            download.codec = response.get('Metadata', {}).get(METADATA_CODEC)
+            offset = (part_number - 1) * download.part_size
+            try:
+                for chunk in response['Body'].iter_chunks(WRITE_CHUNK_SIZE):
+                    download.write(chunk, offset)
+                    offset = offset + len(chunk)
+                return None
+            except botocore.exceptions.BotoCoreError as e:
+                if attempt == MAX_PART_ATTEMPTS:
+                    return e
+                logging.warning(f'Part {part_number} of {s3object.key} failed (attempt {attempt}/{MAX_PART_ATTEMPTS}): {e}')
+                time.sleep(2 ** attempt)
+                attempt = attempt + 1
+            except OSError as e:
+                return e
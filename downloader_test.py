@@ -0,0 +1,244 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from os.path import join
+from unittest.mock import MagicMock, patch
+
+import botocore.exceptions
+from botocore.response import StreamingBody
+
+from copier import MB, RestoreExpired
+from downloader import Downloader, local_path, PARTIAL_SUFFIX, PARTS_SUFFIX
+from s3object import S3Object, RESTORE_DONE
+
+
+def ranged_get_object(data, metadata=None):
+    # Answers ranged GETs of data like S3 does
+    def get_object(Bucket, Key, Range, **kwargs):
+        (first_byte, last_byte) = (int(byte) for byte in Range[len('bytes='):].split('-'))
+        body = data[first_byte:last_byte + 1]
+        return {'Body': StreamingBody(io.BytesIO(body), len(body)), 'Metadata': metadata or {}}
+    return get_object
+
+
+def download_all(client, s3objects, folder, prefix='', part_size=MB, threads=4):
+    results = []
+    downloader = Downloader(client, 'my-old-archives', folder, prefix, part_size, threads)
+    try:
+        for s3object in s3objects:
+            downloader.submit(s3object, lambda s3object, error: results.append((s3object.key, error)))
+        downloader.join()
+    finally:
+        downloader.close()
+    return results
+
+
+class TestLocalPath(unittest.TestCase):
+    def test_local_path(self):
+        # Act
+        actual_path = local_path('/restore', 'archive/2024', 'archive/2024/photos/img.jpg')
+
+        # Assert
+        self.assertEqual(actual_path, '/restore/photos/img.jpg')
+
+    def test_local_path_empty_prefix(self):
+        for key in ('/photos/img.jpg', 'photos/img.jpg'):
+            with self.subTest(key=key):
+                # Act
+                actual_path = local_path('/restore', '', key)
+
+                # Assert
+                self.assertEqual(actual_path, '/restore/photos/img.jpg')
+
+    def test_local_path_outside(self):
+        for key in ('../etc/passwd', '//etc/passwd', '/../etc/passwd', 'photos/../../etc/passwd'):
+            with self.subTest(key=key):
+                # Act
+                with self.assertRaises(ValueError):
+                    local_path('/restore', '', key)
+
+
+class TestDownloader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = self.tmp_dir.name
+        self.data = os.urandom(3 * MB + 100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_download(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = ranged_get_object(self.data)
+        expected_path = join(self.folder, 'photos', 'big.bin')
+
+        # Act
+        actual_results = download_all(
+            mock_client,
+            [S3Object('archive/photos/big.bin', len(self.data), '"etag-1"'), S3Object('archive/empty.txt', 0, '"etag-2"')],
+            self.folder,
+            'archive'
+        )
+
+        # Assert
+        self.assertEqual(sorted(actual_results), [('archive/empty.txt', None), ('archive/photos/big.bin', None)])
+        with open(expected_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.path.getsize(join(self.folder, 'empty.txt')), 0)
+        self.assertEqual(sorted(os.listdir(join(self.folder, 'photos'))), ['big.bin'])
+        actual_ranges = sorted(c.kwargs['Range'] for c in mock_client.get_object.call_args_list)
+        self.assertEqual(actual_ranges, [f'bytes=0-{MB - 1}', f'bytes={MB}-{2 * MB - 1}',
+                                         f'bytes={2 * MB}-{3 * MB - 1}', f'bytes={3 * MB}-{3 * MB + 99}'])
+        mock_client.get_object.assert_any_call(Bucket='my-old-archives', Key='archive/photos/big.bin',
+                                               Range=f'bytes=0-{MB - 1}', IfMatch='"etag-1"')
+
+    def test_download_resumes(self):
+        # Arrange
+        path = join(self.folder, 'big.bin')
+        with open(path + PARTIAL_SUFFIX, 'wb') as f:
+            f.write(self.data[:MB] + b'\0' * MB + self.data[2 * MB:3 * MB])
+        with open(path + PARTS_SUFFIX, 'w') as f:
+            f.write(f'"etag-1" {MB}\n1\n3\n4')
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = ranged_get_object(self.data)
+
+        # Act
+        actual_results = download_all(mock_client, [S3Object('big.bin', len(self.data), '"etag-1"')], self.folder)
+
+        # Assert
+        self.assertEqual(actual_results, [('big.bin', None)])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        actual_ranges = sorted(c.kwargs['Range'] for c in mock_client.get_object.call_args_list)
+        self.assertEqual(actual_ranges, [f'bytes={MB}-{2 * MB - 1}', f'bytes={3 * MB}-{3 * MB + 99}'])
+        self.assertEqual(os.listdir(self.folder), ['big.bin'])
+
+    def test_download_restarts_changed_object(self):
+        # Arrange
+        path = join(self.folder, 'big.bin')
+        with open(path + PARTIAL_SUFFIX, 'wb') as f:
+            f.write(b'\0' * MB)
+        with open(path + PARTS_SUFFIX, 'w') as f:
+            f.write(f'"etag-old" {MB}\n1\n')
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = ranged_get_object(self.data)
+
+        # Act
+        download_all(mock_client, [S3Object('big.bin', len(self.data), '"etag-1"')], self.folder)
+
+        # Assert
+        self.assertEqual(mock_client.get_object.call_count, 4)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_download_skips_downloaded(self):
+        # Arrange
+        with open(join(self.folder, 'file1.csv'), 'wb') as f:
+            f.write(b'0123456789')
+        mock_client = MagicMock()
+
+        # Act
+        actual_results = download_all(mock_client, [S3Object('file1.csv', 10, '"etag1"')], self.folder)
+
+        # Assert
+        self.assertEqual(actual_results, [('file1.csv', None)])
+        mock_client.get_object.assert_not_called()
+
+    def test_download_compressed(self):
+        # Arrange
+        compressed_data = gzip.compress(self.data[:MB], mtime=0) + gzip.compress(self.data[MB:], mtime=0)
+        metadata = {'compression': 'gzip', 'uncompressed-size': str(len(self.data))}
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = ranged_get_object(compressed_data, metadata)
+        path = join(self.folder, 'app.log')
+
+        # Act
+        actual_results = download_all(mock_client, [S3Object('app.log', len(compressed_data), '"etag-1"')], self.folder)
+
+        # Assert
+        self.assertEqual(actual_results, [('app.log', None)])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(self.folder), ['app.log'])
+
+    def test_download_skips_decompressed(self):
+        # Arrange
+        with open(join(self.folder, 'app.log'), 'wb') as f:
+            f.write(b'0123456789')
+        mock_client = MagicMock()
+        mock_client.head_object.return_value = {'Metadata': {'compression': 'gzip', 'uncompressed-size': '10'}}
+
+        # Act
+        actual_results = download_all(mock_client, [S3Object('app.log', 4, '"etag1"')], self.folder)
+
+        # Assert
+        self.assertEqual(actual_results, [('app.log', None)])
+        mock_client.head_object.assert_called_with(Bucket='my-old-archives', Key='app.log')
+        mock_client.get_object.assert_not_called()
+
+    @patch('logging.error')
+    def test_download_corrupt_compressed(self, mock_logging_error):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = ranged_get_object(b'not gzip', {'compression': 'gzip'})
+
+        # Act
+        actual_results = download_all(mock_client, [S3Object('app.log', 8, '"etag-1"')], self.folder)
+
+        # Assert
+        self.assertIsNotNone(actual_results[0][1])
+        self.assertEqual(sorted(os.listdir(self.folder)), ['app.log' + PARTIAL_SUFFIX, 'app.log' + PARTS_SUFFIX])
+        mock_logging_error.assert_called_once()
+
+    @patch('time.sleep')
+    @patch('logging.warning')
+    def test_download_part_failed(self, mock_logging_warning, mock_sleep):
+        # Arrange
+        expected_error = botocore.exceptions.ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        get_object = ranged_get_object(self.data)
+        attempts = []
+
+        def failing_get_object(**kwargs):
+            if kwargs['Range'].startswith(f'bytes={MB}-'):
+                raise expected_error
+            if kwargs['Range'].startswith('bytes=0-') and not attempts:
+                attempts.append(kwargs['Range'])
+                # The connection drops in the middle of the body
+                mock_body = MagicMock()
+                mock_body.iter_chunks.side_effect = botocore.exceptions.ResponseStreamingError(error='Connection broken')
+                return {'Body': mock_body, 'Metadata': {}}
+            return get_object(**kwargs)
+
+        mock_client = MagicMock()
+        mock_client.get_object.side_effect = failing_get_object
+        path = join(self.folder, 'big.bin')
+
+        # Act
+        actual_results = download_all(mock_client, [S3Object('big.bin', len(self.data), '"etag-1"')], self.folder, threads=1)
+
+        # Assert
+        self.assertEqual(actual_results, [('big.bin', expected_error)])
+        self.assertFalse(os.path.exists(path))
+        with open(path + PARTS_SUFFIX) as f:
+            self.assertEqual(f.read(), f'"etag-1" {MB}\n1\n')
+        self.assertEqual(mock_client.get_object.call_count, 3)
+        mock_logging_warning.assert_called_once()
+
+    def test_download_expired(self):
+        # Arrange
+        mock_client = MagicMock()
+        s3object = S3Object('expired.csv', 10, storage_class='GLACIER', restore=RESTORE_DONE, restore_expiry=0.0)
+
+        # Act
+        actual_results = download_all(mock_client, [s3object], self.folder)
+
+        # Assert
+        self.assertIsInstance(actual_results[0][1], RestoreExpired)
+        mock_client.get_object.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
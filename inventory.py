@@ -0,0 +1,180 @@
+import csv
+import gzip
+import heapq
+import io
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from datetime import datetime, timezone
+from operator import attrgetter
+from urllib.parse import unquote_plus
+
+from s3object import S3Object
+
+S3_URL_PREFIX = 's3://'
+CSV_FORMAT = 'CSV'
+PARQUET_FORMAT = 'Parquet'
+ORC_FORMAT = 'ORC'
+# Column names of the CSV schema, Parquet and ORC inventories use the lowercase snake_case ones
+CSV_COLUMNS = {'Key': 'key', 'Size': 'size', 'ETag': 'e_tag', 'StorageClass': 'storage_class',
+               'IsLatest': 'is_latest', 'IsDeleteMarker': 'is_delete_marker', 'LastModifiedDate': 'last_modified_date'}
+COLUMNS = list(CSV_COLUMNS.values())
+BATCH_SIZE = 10000
+# Objects sorted in memory at once when an inventory has to be sorted, about 200 MB of S3Object
+SORT_CHUNK_SIZE = 1000000
+
+
+def split_s3_url(url):
+    (bucket, _, key) = url[len(S3_URL_PREFIX):].partition('/')
+    return bucket, key
+
+
+def open_manifest(client, path):
+    if path.startswith(S3_URL_PREFIX):
+        (bucket, key) = split_s3_url(path)
+        return json.load(client.get_object(Bucket=bucket, Key=key)['Body'])
+    with open(path) as f:
+        return json.load(f)
+
+
+def data_file_location(manifest_path, manifest, key):
+    # The data files of an inventory are in <prefix>/<source bucket>/<configuration>/data/, next to the
+    # dated folder of its manifest.json. A local copy of an inventory has to keep that layout
+    if manifest_path.startswith(S3_URL_PREFIX):
+        return manifest['destinationBucket'].rpartition(':')[2], key
+    configuration_directory = os.path.dirname(os.path.dirname(os.path.abspath(manifest_path)))
+    return None, os.path.join(configuration_directory, *key.split('/')[-2:])
+
+
+def is_current(row):
+    # Versioned buckets list every version, only the latest one that isn't a delete marker is copied
+    return row.get('is_latest', 'true') in ('true', True) and row.get('is_delete_marker', 'false') in ('false', False)
+
+
+def parse_last_modified(value):
+    # CSV inventories have ISO 8601 strings ('2024-01-31T12:00:00.000Z'), pyarrow gives datetimes
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def to_s3object(row):
+    # Inventories leave out the quotes around the ETag that listings have, and the restore status:
+    # archived objects get a restore request, which says so if they are already restored
+    etag = row.get('e_tag')
+    return S3Object(
+        row['key'],
+        int(row.get('size') or 0),
+        f'"{etag}"' if etag else None,
+        sys.intern(row.get('storage_class') or 'STANDARD'),
+        last_modified=parse_last_modified(row.get('last_modified_date'))
+    )
+
+
+def read_csv_rows(f, schema):
+    columns = [CSV_COLUMNS.get(name.strip()) for name in schema.split(',')]
+    for values in csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=f), encoding='utf-8', newline='')):
+        row = {column: value for (column, value) in zip(columns, values) if column is not None}
+        # Keys are URL-encoded in CSV inventories only
+        row['key'] = unquote_plus(row['key'])
+        yield row
+
+
+def read_columnar_rows(path, file_format):
+    # pyarrow is only needed for Parquet and ORC inventories
+    if file_format == PARQUET_FORMAT:
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        columns = [column for column in COLUMNS if column in parquet_file.schema_arrow.names]
+        batches = parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=columns)
+    else:
+        import pyarrow.orc
+        orc_file = pyarrow.orc.ORCFile(path)
+        columns = [column for column in COLUMNS if column in orc_file.schema.names]
+        batches = (orc_file.read_stripe(i, columns=columns) for i in range(orc_file.nstripes))
+    for batch in batches:
+        yield from batch.to_pylist()
+
+
+def read_data_file(client, bucket, key, file_format, schema):
+    if file_format == CSV_FORMAT:
+        if bucket is None:
+            with open(key, 'rb') as f:
+                yield from read_csv_rows(f, schema)
+        else:
+            yield from read_csv_rows(client.get_object(Bucket=bucket, Key=key)['Body'], schema)
+    elif bucket is None:
+        yield from read_columnar_rows(key, file_format)
+    else:
+        # Parquet and ORC are read from the end of the file, so they are downloaded first
+        with tempfile.NamedTemporaryFile() as f:
+            client.download_fileobj(bucket, key, f)
+            f.flush()
+            yield from read_columnar_rows(f.name, file_format)
+
+
+def read_inventory(client, manifest_path, bucket=None):
+    # Returns the current objects of an S3 Inventory report, read one data file at a time. The client
+    # reads the manifest and the data files when manifest_path is an s3:// URL. The manifest is read
+    # right away, so a wrong one is reported before any work starts
+    manifest = open_manifest(client, manifest_path)
+    file_format = manifest['fileFormat']
+    if file_format not in (CSV_FORMAT, PARQUET_FORMAT, ORC_FORMAT):
+        raise ValueError(f'Inventory format {file_format} is not supported')
+    if bucket is not None and manifest['sourceBucket'] != bucket:
+        raise ValueError(f'{manifest_path} is the inventory of {manifest["sourceBucket"]}, not of {bucket}')
+    logging.info(f'Reading the {file_format} inventory of {manifest["sourceBucket"]} from {len(manifest["files"])} '
+                 f'files, created at {manifest.get("creationTimestamp")}')
+    return read_data_files(client, manifest_path, manifest)
+
+
+def read_data_files(client, manifest_path, manifest):
+    file_format = manifest['fileFormat']
+    for data_file in manifest['files']:
+        (data_bucket, data_key) = data_file_location(manifest_path, manifest, data_file['key'])
+        for row in read_data_file(client, data_bucket, data_key, file_format, manifest.get('fileSchema', '')):
+            if is_current(row):
+                yield to_s3object(row)
+
+
+def write_chunk(s3objects):
+    f = tempfile.TemporaryFile()
+    for s3object in sorted(s3objects, key=attrgetter('key')):
+        pickle.dump(s3object, f)
+    f.seek(0)
+    return f
+
+
+def read_chunk(f):
+    with f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def sort_s3objects(s3objects, chunk_size=SORT_CHUNK_SIZE):
+    # Inventories are not sorted by key, the sync diff needs them to be. Sorted chunks are spilled to
+    # temporary files and merged, so at most chunk_size objects are held in memory
+    chunks = []
+    chunk = []
+    for s3object in s3objects:
+        chunk.append(s3object)
+        if len(chunk) == chunk_size:
+            chunks.append(write_chunk(chunk))
+            chunk = []
+    if not chunks:
+        yield from sorted(chunk, key=attrgetter('key'))
+        return
+    if chunk:
+        chunks.append(write_chunk(chunk))
+    logging.info(f'Merging {len(chunks)} sorted chunks of the inventory')
+    yield from heapq.merge(*(read_chunk(f) for f in chunks), key=attrgetter('key'))
@@ -0,0 +1,134 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from inventory import read_inventory, sort_s3objects, data_file_location
+from s3object import S3Object
+
+SCHEMA = 'Bucket, Key, VersionId, IsLatest, IsDeleteMarker, Size, ETag, StorageClass'
+ROWS = [
+    '"my-old-archives","logs/2024/b%20c.log","v2","true","false","20","bbb","DEEP_ARCHIVE"',
+    '"my-old-archives","logs/2024/b%20c.log","v1","false","false","10","aaa","DEEP_ARCHIVE"',
+    '"my-old-archives","deleted.txt","v3","true","true","","",""',
+    '"my-old-archives","a.csv","v4","true","false","5","ccc-2","GLACIER"',
+]
+EXPECTED_S3OBJECTS = [
+    S3Object('logs/2024/b c.log', 20, '"bbb"', 'DEEP_ARCHIVE'),
+    S3Object('a.csv', 5, '"ccc-2"', 'GLACIER'),
+]
+
+
+def manifest(file_keys, file_format='CSV', source_bucket='my-old-archives'):
+    return {
+        'sourceBucket': source_bucket,
+        'destinationBucket': 'arn:aws:s3:::my-inventories',
+        'fileFormat': file_format,
+        'fileSchema': SCHEMA,
+        'creationTimestamp': '1704067200000',
+        'files': [{'key': key} for key in file_keys],
+    }
+
+
+def gzipped_csv(rows):
+    return gzip.compress(('\n'.join(rows) + '\n').encode())
+
+
+@patch('logging.info')
+class TestReadInventory(unittest.TestCase):
+    def test_read_inventory_local(self, mock_logging_info):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            os.makedirs(os.path.join(directory, 'data'))
+            os.makedirs(os.path.join(directory, '2024-01-01T01-00Z'))
+            file_keys = ['inventories/my-old-archives/daily/data/1.csv.gz', 'inventories/my-old-archives/daily/data/2.csv.gz']
+            for (key, rows) in zip(file_keys, [ROWS[:2], ROWS[2:]]):
+                with open(os.path.join(directory, 'data', key.rpartition('/')[2]), 'wb') as f:
+                    f.write(gzipped_csv(rows))
+            manifest_path = os.path.join(directory, '2024-01-01T01-00Z', 'manifest.json')
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest(file_keys), f)
+
+            # Act
+            actual_s3objects = list(read_inventory(None, manifest_path, 'my-old-archives'))
+
+            # Assert
+            self.assertEqual(actual_s3objects, EXPECTED_S3OBJECTS)
+
+    def test_read_inventory_s3(self, mock_logging_info):
+        # Arrange
+        mock_client = MagicMock()
+        bodies = {
+            'inventories/my-old-archives/daily/2024-01-01T01-00Z/manifest.json': json.dumps(manifest(['inventories/my-old-archives/daily/data/1.csv.gz'])).encode(),
+            'inventories/my-old-archives/daily/data/1.csv.gz': gzipped_csv(ROWS),
+        }
+        mock_client.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(bodies[Key])}
+
+        # Act
+        actual_s3objects = list(read_inventory(mock_client, 's3://my-inventories/inventories/my-old-archives/daily/2024-01-01T01-00Z/manifest.json'))
+
+        # Assert
+        self.assertEqual(actual_s3objects, EXPECTED_S3OBJECTS)
+        mock_client.get_object.assert_called_with(Bucket='my-inventories', Key='inventories/my-old-archives/daily/data/1.csv.gz')
+
+    def test_read_inventory_other_bucket(self, mock_logging_info):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_object.return_value = {'Body': io.BytesIO(json.dumps(manifest([], source_bucket='other')).encode())}
+
+        # Act
+        with self.assertRaises(ValueError):
+            read_inventory(mock_client, 's3://my-inventories/manifest.json', 'my-old-archives')
+
+    def test_read_inventory_last_modified(self, mock_logging_info):
+        # Arrange
+        mock_client = MagicMock()
+        inventory_manifest = manifest(['data/1.csv.gz'])
+        inventory_manifest['fileSchema'] = 'Bucket, Key, Size, LastModifiedDate'
+        bodies = {
+            'manifest.json': json.dumps(inventory_manifest).encode(),
+            'data/1.csv.gz': gzipped_csv(['"my-old-archives","a.csv","5","2024-01-31T12:00:00.000Z"']),
+        }
+        mock_client.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(bodies[Key])}
+
+        # Act
+        actual_s3objects = list(read_inventory(mock_client, 's3://my-inventories/manifest.json'))
+
+        # Assert
+        self.assertEqual(actual_s3objects, [S3Object('a.csv', 5, last_modified=1706702400.0)])
+
+    def test_data_file_location(self, mock_logging_info):
+        # Act
+        actual_location = data_file_location('/inventories/daily/2024-01-01T01-00Z/manifest.json', manifest([]), 'prefix/my-old-archives/daily/data/1.csv.gz')
+
+        # Assert
+        self.assertEqual(actual_location, (None, '/inventories/daily/data/1.csv.gz'))
+
+
+@patch('logging.info')
+class TestSortS3Objects(unittest.TestCase):
+    def test_sort_s3objects(self, mock_logging_info):
+        # Arrange
+        keys = [f'file{i * 7919 % 100}.csv' for i in range(100)]
+
+        # Act
+        actual_s3objects = list(sort_s3objects((S3Object(key, 10) for key in keys), chunk_size=16))
+
+        # Assert
+        self.assertEqual([s3object.key for s3object in actual_s3objects], sorted(keys))
+        self.assertEqual(actual_s3objects[0], S3Object('file0.csv', 10))
+
+    def test_sort_s3objects_in_memory(self, mock_logging_info):
+        # Act
+        actual_keys = [s3object.key for s3object in sort_s3objects([S3Object('b'), S3Object('a')])]
+
+        # Assert
+        self.assertEqual(actual_keys, ['a', 'b'])
+        mock_logging_info.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+
+from s3object import S3Object
+
+STATE_LISTED = 'listed'
+STATE_RESTORE_REQUESTED = 'restore-requested'
+STATE_RESTORED = 'restored'
+STATE_COPIED = 'copied'
+STATE_FAILED = 'failed'
+# Stays below SQLite's default limit of 999 parameters per statement
+BATCH_SIZE = 500
+
+
+class Journal:
+    # Durable state of a copy job, one row per key. WAL mode lets the copy workers write
+    # while the restore pass reads, every write goes through one connection behind a lock
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS objects ('
+            'key TEXT PRIMARY KEY, size INTEGER, etag TEXT, storage_class TEXT, restore TEXT, restore_expiry REAL, '
+            'state TEXT NOT NULL, error TEXT, checksum TEXT)'
+        )
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(objects)')]
+        if 'checksum' not in columns:
+            # Journals written before checksums were recorded
+            self.connection.execute('ALTER TABLE objects ADD COLUMN checksum TEXT')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    @property
+    def listing_complete(self):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE name = 'listing_complete'").fetchone()
+        return row is not None
+
+    def add(self, s3objects):
+        # Records listed objects and passes them on, except the ones a previous run already copied
+        batch = []
+        for s3object in s3objects:
+            batch.append(s3object)
+            if len(batch) == BATCH_SIZE:
+                yield from self._add_batch(batch)
+                batch = []
+        yield from self._add_batch(batch)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('listing_complete', '1')")
+            self.connection.commit()
+
+    def _add_batch(self, batch):
+        if not batch:
+            return []
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO objects (key, size, etag, storage_class, restore, restore_expiry, state) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(o.key, o.size, o.etag, o.storage_class, o.restore, o.restore_expiry, STATE_LISTED) for o in batch]
+            )
+            self.connection.commit()
+            keys = [s3object.key for s3object in batch]
+            rows = self.connection.execute(
+                'SELECT key, size, etag, storage_class, restore, restore_expiry, state FROM objects '
+                f'WHERE key IN ({", ".join("?" * len(keys))})',
+                keys
+            ).fetchall()
+        # A resumed run gets the restore state recorded by the previous one
+        return [S3Object(*row[:6]) for row in sorted(rows) if row[6] != STATE_COPIED]
+
+    def pending(self):
+        # Everything not copied yet, read back in batches so the job never has to be held in memory
+        last_key = ''
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    'SELECT key, size, etag, storage_class, restore, restore_expiry FROM objects '
+                    'WHERE key > ? AND state != ? ORDER BY key LIMIT ?',
+                    (last_key, STATE_COPIED, BATCH_SIZE)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield S3Object(*row)
+            last_key = rows[-1][0]
+
+    def update(self, s3object, state, error=None):
+        with self.lock:
+            self.connection.execute(
+                'UPDATE objects SET restore = ?, restore_expiry = ?, state = ?, error = ?, checksum = ? WHERE key = ?',
+                (s3object.restore, s3object.restore_expiry, state, error, s3object.checksum, s3object.key)
+            )
+            self.connection.commit()
+
+    def counts(self):
+        with self.lock:
+            return dict(self.connection.execute('SELECT state, COUNT(*) FROM objects GROUP BY state').fetchall())
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
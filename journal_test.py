@@ -0,0 +1,136 @@
+import sqlite3
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+from os.path import join
+from unittest.mock import patch
+
+import journal
+from s3object import S3Object, RESTORE_UNKNOWN
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.journal_path = join(self.tmp_dir.name, 'job.sqlite')
+        self.journal = journal.Journal(self.journal_path)
+        self.s3objects = [
+            S3Object('file1.csv', 10, '"etag1"', 'STANDARD'),
+            S3Object('file2.csv', 20, '"etag2"', 'GLACIER'),
+            S3Object('file3.csv', 30, '"etag3"', 'DEEP_ARCHIVE'),
+        ]
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmp_dir.cleanup()
+
+    def test_add(self):
+        # Arrange
+        expected_counts = {journal.STATE_LISTED: 3}
+
+        # Act
+        actual_s3objects = list(self.journal.add(iter(self.s3objects)))
+
+        # Assert
+        self.assertEqual(actual_s3objects, self.s3objects)
+        self.assertTrue(self.journal.listing_complete)
+        self.assertEqual(self.journal.counts(), expected_counts)
+
+    def test_add_incomplete(self):
+        # Arrange
+        listing = self.journal.add(iter(self.s3objects))
+
+        # Act
+        next(listing)
+
+        # Assert
+        self.assertFalse(self.journal.listing_complete)
+
+    @patch('journal.BATCH_SIZE', 2)
+    def test_add_resumes(self):
+        # Arrange
+        list(self.journal.add(iter(self.s3objects[:2])))
+        self.s3objects[1].restore = RESTORE_UNKNOWN
+        self.journal.update(self.s3objects[0], journal.STATE_COPIED)
+        self.journal.update(self.s3objects[1], journal.STATE_RESTORE_REQUESTED)
+        relisted = [S3Object(s3object.key, s3object.size, s3object.etag, s3object.storage_class) for s3object in self.s3objects]
+
+        # Act
+        actual_s3objects = list(self.journal.add(iter(relisted)))
+
+        # Assert
+        self.assertEqual(actual_s3objects, self.s3objects[1:])
+
+    @patch('journal.BATCH_SIZE', 2)
+    def test_pending(self):
+        # Arrange
+        list(self.journal.add(iter(self.s3objects)))
+        self.journal.update(self.s3objects[1], journal.STATE_COPIED)
+        self.journal.update(self.s3objects[2], journal.STATE_FAILED, 'AccessDenied')
+
+        # Act
+        actual_s3objects = list(self.journal.pending())
+
+        # Assert
+        self.assertEqual(actual_s3objects, [self.s3objects[0], self.s3objects[2]])
+
+    def test_reopen(self):
+        # Arrange
+        list(self.journal.add(iter(self.s3objects)))
+        self.journal.update(self.s3objects[0], journal.STATE_COPIED)
+        self.journal.close()
+
+        # Act
+        self.journal = journal.Journal(self.journal_path)
+
+        # Assert
+        self.assertTrue(self.journal.listing_complete)
+        self.assertEqual(list(self.journal.pending()), self.s3objects[1:])
+
+    def test_update_checksum(self):
+        # Arrange
+        list(self.journal.add(iter(self.s3objects)))
+        self.s3objects[0].checksum = 'l1ZLHg=='
+
+        # Act
+        self.journal.update(self.s3objects[0], journal.STATE_COPIED)
+
+        # Assert
+        actual_rows = self.journal.connection.execute('SELECT key, checksum FROM objects ORDER BY key').fetchall()
+        self.assertEqual(actual_rows, [('file1.csv', 'l1ZLHg=='), ('file2.csv', None), ('file3.csv', None)])
+
+    def test_open_without_checksums(self):
+        # Arrange
+        self.journal.close()
+        old_journal_path = join(self.tmp_dir.name, 'old.sqlite')
+        connection = sqlite3.connect(old_journal_path)
+        connection.execute(
+            'CREATE TABLE objects (key TEXT PRIMARY KEY, size INTEGER, etag TEXT, storage_class TEXT, restore TEXT, '
+            'restore_expiry REAL, state TEXT NOT NULL, error TEXT)'
+        )
+        connection.execute("INSERT INTO objects (key, size, state) VALUES ('file1.csv', 10, 'listed')")
+        connection.commit()
+        connection.close()
+
+        # Act
+        self.journal = journal.Journal(old_journal_path)
+        self.journal.update(S3Object('file1.csv', 10, checksum='l1ZLHg=='), journal.STATE_COPIED)
+
+        # Assert
+        self.assertEqual(self.journal.connection.execute('SELECT checksum FROM objects').fetchall(), [('l1ZLHg==',)])
+
+    def test_update_from_threads(self):
+        # Arrange
+        s3objects = [S3Object(f'file{i}.csv') for i in range(200)]
+        list(self.journal.add(iter(s3objects)))
+
+        # Act
+        with ThreadPool(processes=10) as pool:
+            pool.map(lambda s3object: self.journal.update(s3object, journal.STATE_COPIED), s3objects)
+
+        # Assert
+        self.assertEqual(self.journal.counts(), {journal.STATE_COPIED: 200})
+
+
+if __name__ == '__main__':
+    unittest.main()
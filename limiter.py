@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from functools import partial
+
+import botocore.exceptions
+
+THROTTLE_ERROR_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests')
+DECREASE_FACTOR = 0.5
+# The limit stops growing while the average latency is more than this multiple of the best average seen,
+# S3 is queueing requests by then. The best average drifts up a little with every request, so it follows
+# a lasting change (e.g. bigger objects) instead of holding the limit down forever
+LATENCY_TOLERANCE = 3
+LATENCY_SMOOTHING = 0.1
+BEST_LATENCY_DRIFT = 1.001
+MIN_BACKOFF = 0.1
+MAX_BACKOFF = 20
+MAX_THROTTLED_ATTEMPTS = 8
+# Attempts of requests that fail with a dropped connection, a timeout or a server error, like botocore's
+# standard mode. They back off on their own, the limit isn't cut for them
+MAX_FAILED_ATTEMPTS = 3
+LOG_INTERVAL = 60
+SUCCEEDED = 'succeeded'
+THROTTLED = 'throttled'
+FAILED = 'failed'
+# Client methods that don't send a request
+LOCAL_METHODS = ('get_paginator', 'get_waiter', 'can_paginate', 'generate_presigned_url', 'generate_presigned_post', 'close')
+
+
+def is_throttled(error):
+    if not isinstance(error, botocore.exceptions.ClientError):
+        return False
+    return (error.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+            or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 503)
+
+
+def is_transient(error):
+    # The errors botocore retries, other than throttles
+    if isinstance(error, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)):
+        return True
+    return (isinstance(error, botocore.exceptions.ClientError)
+            and error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+
+
+def failed_backoff(failed_attempts):
+    return random.uniform(0, min(MIN_BACKOFF * 2 ** failed_attempts, MAX_BACKOFF))
+
+
+def key_prefix(key):
+    # S3 scales request rates per prefix, a throttled folder shouldn't slow down the others
+    return key.rpartition('/')[0]
+
+
+class AdaptiveLimiter:
+    # AIMD limit on the number of requests in flight. Every request that succeeds with a healthy latency
+    # adds 1/limit, so the limit grows by one per round of requests, up to maximum. A throttled request
+    # halves the limit (once per round: requests started before the last decrease don't count) and backs off
+    # its key prefix exponentially, other prefixes keep going. The caller needs at least maximum workers.
+    # The limiter does the retries: clients used through it make a single attempt (clients.LIMITED_MAX_ATTEMPTS),
+    # or botocore would retry a SlowDown before the limiter sees it
+    def __init__(self, name, initial, maximum, minimum=1, clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.clock = clock
+        self.sleep = sleep
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.latency = None
+        self.best_latency = None
+        self.last_decrease = -math.inf
+        self.backoffs = {}
+        self.throttled_count = 0
+        self.last_log = clock()
+
+    def set_limits(self, initial, maximum):
+        with self.condition:
+            self.maximum = maximum
+            self.limit = float(min(max(initial, self.minimum), maximum))
+            self.condition.notify_all()
+
+    def __str__(self):
+        return (f'{self.name}: limit {int(self.limit)}/{self.maximum}, {self.in_flight} in flight, '
+                f'{self.throttled_count} throttled, {len(self.backoffs)} prefixes backing off')
+
+    def call(self, key, function, *args, on_retry=None, **kwargs):
+        # Throttled requests are sent again after their prefix's backoff, transient errors after a backoff
+        # of their own, other errors are raised right away
+        prefix = key_prefix(key)
+        attempts = {THROTTLED: 0, FAILED: 0}
+        while True:
+            started = self._acquire(prefix)
+            outcome = FAILED
+            try:
+                result = function(*args, **kwargs)
+                outcome = SUCCEEDED
+                return result
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                (outcome, retried) = self._failed(e, attempts)
+                if not retried:
+                    raise
+            finally:
+                self._release(prefix, started, outcome)
+            if outcome == FAILED:
+                self.sleep(failed_backoff(attempts[FAILED]))
+            if on_retry is not None:
+                on_retry()
+
+    def _failed(self, error, attempts):
+        # Returns the outcome of an attempt that raised error, and whether the request is sent again.
+        # attempts counts the throttled and the failed attempts of the request
+        outcome = THROTTLED if is_throttled(error) else FAILED
+        attempts[outcome] = attempts[outcome] + 1
+        if outcome == THROTTLED:
+            return outcome, attempts[outcome] < MAX_THROTTLED_ATTEMPTS
+        return outcome, is_transient(error) and attempts[outcome] < MAX_FAILED_ATTEMPTS
+
+    def _acquire(self, prefix):
+        with self.condition:
+            while True:
+                now = self.clock()
+                (until, _) = self.backoffs.get(prefix, (0, 0))
+                if until > now:
+                    self.condition.wait(until - now)
+                elif self.in_flight < int(self.limit):
+                    self.in_flight = self.in_flight + 1
+                    return now
+                else:
+                    self.condition.wait()
+
+    def _release(self, prefix, started, outcome):
+        with self.condition:
+            self.in_flight = self.in_flight - 1
+            now = self.clock()
+            if outcome == SUCCEEDED:
+                self._succeeded(prefix, now - started)
+            elif outcome == THROTTLED:
+                self._throttled(prefix, started, now)
+            if now - self.last_log >= LOG_INTERVAL:
+                logging.info(str(self))
+                self.last_log = now
+            self.condition.notify_all()
+
+    def _succeeded(self, prefix, latency):
+        self.backoffs.pop(prefix, None)
+        if self.latency is None:
+            self.latency = latency
+            self.best_latency = latency
+        else:
+            self.latency = self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+            self.best_latency = min(self.latency, self.best_latency * BEST_LATENCY_DRIFT)
+        if self.latency <= LATENCY_TOLERANCE * self.best_latency:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _throttled(self, prefix, started, now):
+        self.throttled_count = self.throttled_count + 1
+        (_, delay) = self.backoffs.get(prefix, (0, MIN_BACKOFF / 2))
+        delay = min(delay * 2, MAX_BACKOFF)
+        # Jitter keeps the requests of a prefix from all coming back at the same moment
+        self.backoffs[prefix] = (now + random.uniform(delay / 2, delay), delay)
+        if started > self.last_decrease:
+            previous_limit = int(self.limit)
+            self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+            self.last_decrease = now
+            logging.warning(f'{self.name}: throttled on prefix {prefix!r}, limit {previous_limit} -> {int(self.limit)}, '
+                            f'backing off the prefix for {delay:.1f} s. {self}')
+
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    # The same limit for the coroutines of one event loop, which wait for their turn and their backoffs
+    # without blocking the loop. It must only be used from the loop's thread
+    def __init__(self, name, initial, maximum, minimum=1, clock=time.monotonic):
+        super().__init__(name, initial, maximum, minimum, clock)
+        self.released = None
+
+    async def call_async(self, key, function, *args, **kwargs):
+        prefix = key_prefix(key)
+        attempts = {THROTTLED: 0, FAILED: 0}
+        while True:
+            started = await self._acquire_async(prefix)
+            outcome = FAILED
+            try:
+                result = await function(*args, **kwargs)
+                outcome = SUCCEEDED
+                return result
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                (outcome, retried) = self._failed(e, attempts)
+                if not retried:
+                    raise
+            finally:
+                self._release(prefix, started, outcome)
+                async with self.released:
+                    self.released.notify_all()
+            if outcome == FAILED:
+                await asyncio.sleep(failed_backoff(attempts[FAILED]))
+
+    async def _acquire_async(self, prefix):
+        if self.released is None:
+            # Created on the loop it's used from
+            self.released = asyncio.Condition()
+        async with self.released:
+            while True:
+                now = self.clock()
+                (until, _) = self.backoffs.get(prefix, (0, 0))
+                if until > now:
+                    try:
+                        await asyncio.wait_for(self.released.wait(), until - now)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.in_flight < int(self.limit):
+                    self.in_flight = self.in_flight + 1
+                    return now
+                else:
+                    await self.released.wait()
+
+
+class LimitedClient:
+    # Wraps a boto3 client so every request goes through a limiter, keyed by the request's Key.
+    # Seekable bodies are rewound before a request is sent again
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name in LOCAL_METHODS or not callable(attribute):
+            return attribute
+        return partial(self._call, attribute)
+
+    def _call(self, method, **kwargs):
+        on_retry = None
+        body = kwargs.get('Body')
+        if hasattr(body, 'seek'):
+            on_retry = partial(body.seek, body.tell())
+        return self.limiter.call(kwargs.get('Key', ''), method, on_retry=on_retry, **kwargs)
+
+
+class AsyncLimitedClient(LimitedClient):
+    # Same for an aiobotocore client, whose methods are coroutines. Its bodies are never rewound,
+    # the copies it's used for have none
+    def _call(self, method, **kwargs):
+        return self.limiter.call_async(kwargs.get('Key', ''), method, **kwargs)
@@ -0,0 +1,276 @@
+import asyncio
+import threading
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import botocore.exceptions
+
+import limiter as limiter_module
+from limiter import AdaptiveLimiter, AsyncAdaptiveLimiter, AsyncLimitedClient, LimitedClient, is_throttled, \
+    is_transient, key_prefix
+
+SLOW_DOWN = botocore.exceptions.ClientError({'Error': {'Code': 'SlowDown'}}, 'PutObject')
+ACCESS_DENIED = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'PutObject')
+INTERNAL_ERROR = botocore.exceptions.ClientError(
+    {'Error': {'Code': 'InternalError'}, 'ResponseMetadata': {'HTTPStatusCode': 500}},
+    'PutObject'
+)
+CONNECTION_ERROR = botocore.exceptions.EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+
+
+class TestIsThrottled(unittest.TestCase):
+    def test_is_throttled(self):
+        # Arrange
+        service_unavailable = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'ServiceUnavailable'}, 'ResponseMetadata': {'HTTPStatusCode': 503}},
+            'CopyObject'
+        )
+
+        # Act
+        actual = [is_throttled(SLOW_DOWN), is_throttled(service_unavailable), is_throttled(ACCESS_DENIED), is_throttled(OSError())]
+
+        # Assert
+        self.assertEqual(actual, [True, True, False, False])
+
+    def test_is_transient(self):
+        # Act
+        actual = [is_transient(INTERNAL_ERROR), is_transient(CONNECTION_ERROR), is_transient(ACCESS_DENIED), is_transient(OSError())]
+
+        # Assert
+        self.assertEqual(actual, [True, True, False, False])
+
+    def test_key_prefix(self):
+        # Act
+        actual = [key_prefix('archive/2024/file1.csv'), key_prefix('file1.csv')]
+
+        # Assert
+        self.assertEqual(actual, ['archive/2024', ''])
+
+
+@patch('logging.warning')
+@patch('limiter.MIN_BACKOFF', 0.002)
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_call_grows_limit(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 2, 4)
+
+        # Act
+        actual_results = [limiter.call('a/file.csv', lambda i: i * 2, i) for i in range(20)]
+
+        # Assert
+        self.assertEqual(actual_results, [i * 2 for i in range(20)])
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_call_throttled(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 8, 16)
+        mock_function = MagicMock(side_effect=[SLOW_DOWN, 'done'])
+        mock_on_retry = MagicMock()
+
+        # Act
+        actual_result = limiter.call('a/file.csv', mock_function, Key='a/file.csv', on_retry=mock_on_retry)
+
+        # Assert
+        self.assertEqual(actual_result, 'done')
+        self.assertEqual(mock_function.call_count, 2)
+        mock_function.assert_called_with(Key='a/file.csv')
+        mock_on_retry.assert_called_once()
+        self.assertEqual(int(limiter.limit), 4)
+        self.assertEqual(limiter.throttled_count, 1)
+        self.assertEqual(limiter.backoffs, {})
+        mock_logging_warning.assert_called_once()
+
+    def test_call_other_error(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 8, 16)
+        mock_function = MagicMock(side_effect=ACCESS_DENIED)
+
+        # Act
+        with self.assertRaises(botocore.exceptions.ClientError):
+            limiter.call('a/file.csv', mock_function)
+
+        # Assert
+        mock_function.assert_called_once()
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_call_transient_error(self, mock_logging_warning):
+        # Arrange
+        mock_sleep = MagicMock()
+        limiter = AdaptiveLimiter('test', 8, 16, sleep=mock_sleep)
+        mock_function = MagicMock(side_effect=[INTERNAL_ERROR, CONNECTION_ERROR, 'done'])
+        mock_on_retry = MagicMock()
+
+        # Act
+        actual_result = limiter.call('a/file.csv', mock_function, on_retry=mock_on_retry)
+
+        # Assert
+        self.assertEqual(actual_result, 'done')
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(mock_on_retry.call_count, 2)
+        self.assertEqual((int(limiter.limit), limiter.throttled_count, limiter.backoffs), (8, 0, {}))
+        mock_logging_warning.assert_not_called()
+
+    def test_call_transient_error_gives_up(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 8, 16, sleep=MagicMock())
+        mock_function = MagicMock(side_effect=INTERNAL_ERROR)
+
+        # Act
+        with self.assertRaises(botocore.exceptions.ClientError):
+            limiter.call('a/file.csv', mock_function)
+
+        # Assert
+        self.assertEqual(mock_function.call_count, limiter_module.MAX_FAILED_ATTEMPTS)
+        self.assertEqual(limiter.in_flight, 0)
+
+    @patch('limiter.MAX_THROTTLED_ATTEMPTS', 3)
+    def test_call_gives_up(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 8, 16)
+        mock_function = MagicMock(side_effect=SLOW_DOWN)
+
+        # Act
+        with self.assertRaises(botocore.exceptions.ClientError):
+            limiter.call('a/file.csv', mock_function)
+
+        # Assert
+        self.assertEqual(mock_function.call_count, 3)
+        self.assertEqual(limiter.throttled_count, 3)
+        self.assertIn('a', limiter.backoffs)
+
+    def test_one_decrease_per_round(self, mock_logging_warning):
+        # Arrange
+        now = [100.0]
+        limiter = AdaptiveLimiter('test', 16, 16, clock=lambda: now[0])
+        started = [limiter._acquire('a'), limiter._acquire('b')]
+        now[0] = 101.0
+
+        # Act
+        limiter._release('a', started[0], 'throttled')
+        limiter._release('b', started[1], 'throttled')
+
+        # Assert
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(sorted(limiter.backoffs), ['a', 'b'])
+
+    def test_limits_requests_in_flight(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 2, 2)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def request(i):
+            with lock:
+                in_flight[0] = in_flight[0] + 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] = in_flight[0] - 1
+
+        # Act
+        with ThreadPool(processes=8) as pool:
+            pool.map(lambda i: limiter.call(f'{i}/file.csv', request, i), range(16))
+
+        # Assert
+        self.assertEqual(in_flight[1], 2)
+
+    def test_set_limits(self, mock_logging_warning):
+        # Arrange
+        limiter = AdaptiveLimiter('test', 10, 32)
+
+        # Act
+        limiter.set_limits(20, 64)
+
+        # Assert
+        self.assertEqual((limiter.limit, limiter.maximum), (20, 64))
+
+
+@patch('logging.warning')
+@patch('limiter.MIN_BACKOFF', 0.002)
+class TestAsyncAdaptiveLimiter(unittest.TestCase):
+    def test_call_async_throttled(self, mock_logging_warning):
+        # Arrange
+        limiter = AsyncAdaptiveLimiter('test', 8, 16)
+        mock_function = AsyncMock(side_effect=[SLOW_DOWN, INTERNAL_ERROR, 'done'])
+
+        # Act
+        actual_result = asyncio.run(limiter.call_async('a/file.csv', mock_function, Key='a/file.csv'))
+
+        # Assert
+        self.assertEqual(actual_result, 'done')
+        self.assertEqual(mock_function.await_count, 3)
+        self.assertEqual((int(limiter.limit), limiter.throttled_count, limiter.in_flight), (4, 1, 0))
+        mock_logging_warning.assert_called_once()
+
+    def test_limits_coroutines_in_flight(self, mock_logging_warning):
+        # Arrange
+        limiter = AsyncAdaptiveLimiter('test', 2, 2)
+        in_flight = []
+
+        async def request(i):
+            in_flight.append(limiter.in_flight)
+            await asyncio.sleep(0.001)
+            return i
+
+        async def run_all():
+            return await asyncio.gather(*(limiter.call_async('a/file.csv', request, i) for i in range(10)))
+
+        # Act
+        actual_results = asyncio.run(run_all())
+
+        # Assert
+        self.assertEqual(actual_results, list(range(10)))
+        self.assertLessEqual(max(in_flight), 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_async_limited_client(self, mock_logging_warning):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.copy_object = AsyncMock(side_effect=[SLOW_DOWN, {'CopyObjectResult': {}}])
+        limited_client = AsyncLimitedClient(mock_client, AsyncAdaptiveLimiter('test', 8, 16))
+
+        # Act
+        actual_response = asyncio.run(limited_client.copy_object(Bucket='my-bucket', Key='a/file.csv'))
+
+        # Assert
+        self.assertEqual(actual_response, {'CopyObjectResult': {}})
+        self.assertEqual(mock_client.copy_object.await_count, 2)
+        self.assertIs(limited_client.get_paginator, mock_client.get_paginator)
+
+
+class TestLimitedClient(unittest.TestCase):
+    @patch('logging.warning')
+    @patch('limiter.MIN_BACKOFF', 0.002)
+    def test_limited_client(self, mock_logging_warning):
+        # Arrange
+        mock_client = MagicMock()
+        positions = []
+        mock_client.put_object.side_effect = self._read_then_throttle_once(positions)
+        limited_client = LimitedClient(mock_client, AdaptiveLimiter('test', 8, 16))
+
+        with open('test_fixtures/upload_files/file2.txt', 'rb') as body:
+            # Act
+            limited_client.put_object(Bucket='my-bucket', Key='a/file2.txt', Body=body)
+
+        # Assert
+        self.assertEqual(mock_client.put_object.call_count, 2)
+        self.assertEqual(positions, [0, 0])
+        self.assertIs(limited_client.get_paginator, mock_client.get_paginator)
+        self.assertEqual(limited_client.limiter.throttled_count, 1)
+
+    @staticmethod
+    def _read_then_throttle_once(positions):
+        def put_object(**kwargs):
+            positions.append(kwargs['Body'].tell())
+            kwargs['Body'].read()
+            if len(positions) == 1:
+                raise SLOW_DOWN
+        return put_object
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import logging
+import threading
+from queue import Queue
+
+import botocore.exceptions
+
+from s3object import from_listing
+
+DELIMITER = '/'
+MAX_SPLIT_DEPTH = 3
+# Pages of 1000 keys read ahead by all shards together, while earlier shards are being consumed
+MAX_PREFETCHED_PAGES = 1000
+LISTING_DONE = None
+
+
+def list_range(client, bucket, start=None, end=None, prefix=None):
+    # Yields the pages of keys in [start, end), an end left open when it's None
+    paginator = client.get_paginator('list_objects_v2')
+    # RestoreStatus lets objects be classified straight from the listing, without a HEAD each
+    arguments = {'Bucket': bucket, 'OptionalObjectAttributes': ['RestoreStatus']}
+    if prefix:
+        # S3 only returns the keys under the prefix, the rest of the bucket isn't even paged through
+        arguments['Prefix'] = prefix
+    if start is not None:
+        # StartAfter is exclusive. A boundary always ends with the delimiter, so starting after the rest of it
+        # can only return a few extra keys before it (e.g. 'photos.txt' before 'photos/'), which are dropped
+        arguments['StartAfter'] = start[:-1]
+    for page in paginator.paginate(**arguments):
+        s3objects = []
+        for content in page.get('Contents', []):
+            key = content['Key']
+            if end is not None and key >= end:
+                yield s3objects
+                return
+            if start is None or key >= start:
+                s3objects.append(from_listing(content))
+        yield s3objects
+
+
+def list_prefixes(client, bucket, prefix):
+    # The first page is enough to find split points, the ranges cover whatever it didn't return
+    response = client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter=DELIMITER)
+    return [common_prefix['Prefix'] for common_prefix in response.get('CommonPrefixes', [])]
+
+
+def find_boundaries(client, bucket, shards, prefix=''):
+    # Splits the key space under prefix at its "folders", going deeper until there are enough of them.
+    # Returns up to shards - 1 sorted boundaries
+    prefixes = [prefix]
+    for _ in range(MAX_SPLIT_DEPTH):
+        expanded = []
+        for folder in prefixes:
+            children = list_prefixes(client, bucket, folder)
+            if children:
+                expanded.extend(children)
+            elif folder != prefix:
+                expanded.append(folder)
+        if expanded == prefixes:
+            break
+        prefixes = expanded
+        if len(prefixes) >= shards:
+            break
+    boundaries = sorted(set(prefixes))
+    if len(boundaries) >= shards:
+        step = len(boundaries) / shards
+        boundaries = [boundaries[int(i * step)] for i in range(1, shards)]
+    return boundaries
+
+
+def prefetch(pages, source):
+    try:
+        for page in source:
+            pages.put(page)
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+        pages.put(e)
+        return
+    pages.put(LISTING_DONE)
+
+
+def list_sharded(client, bucket, shards, prefix=None, start=None, end=None):
+    # Every shard is listed by its own thread from the start. The shards are disjoint key ranges in order,
+    # so reading them one after the other gives a single stream sorted by key, like a plain listing.
+    # With start or end, only the keys in [start, end) are listed, split at the boundaries inside it
+    boundaries = [
+        boundary for boundary in find_boundaries(client, bucket, shards, prefix or '')
+        if (start is None or boundary > start) and (end is None or boundary < end)
+    ]
+    ranges = list(zip([start] + boundaries, boundaries + [end]))
+    logging.info(f'Listing {bucket} in {len(ranges)} shards')
+    queues = []
+    for (range_start, range_end) in ranges:
+        pages = Queue(maxsize=max(1, MAX_PREFETCHED_PAGES // len(ranges)))
+        threading.Thread(target=prefetch, args=(pages, list_range(client, bucket, range_start, range_end, prefix)), daemon=True).start()
+        queues.append(pages)
+    for pages in queues:
+        while (page := pages.get()) is not LISTING_DONE:
+            if isinstance(page, Exception):
+                raise page
+            yield from page
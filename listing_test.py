@@ -0,0 +1,142 @@
+import unittest
+from unittest.mock import patch
+
+import botocore.exceptions
+
+import listing
+
+KEYS = sorted([
+    'a.txt',
+    'logs/2023/01.log',
+    'logs/2023/02.log',
+    'logs/2024/01.log',
+    'logs/readme.txt',
+    'photos',
+    'photos.txt',
+    'photos/',
+    'photos/2023/img1.jpg',
+    'photos/2024/img2.jpg',
+    'photos/2024/img3.jpg',
+    'videos/clip.mp4',
+    'z.txt',
+])
+
+
+class FakeS3:
+    # Enough of list_objects_v2 for the listing: Prefix, Delimiter, StartAfter, pages of page_size keys
+    def __init__(self, keys, page_size=2, fail_after=None):
+        self.keys = keys
+        self.page_size = page_size
+        self.fail_after = fail_after
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None):
+        contents = []
+        common_prefixes = []
+        for key in self.keys:
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter is not None and Delimiter in rest:
+                common_prefix = Prefix + rest[:rest.index(Delimiter) + 1]
+                if common_prefix not in common_prefixes:
+                    common_prefixes.append(common_prefix)
+            else:
+                contents.append({'Key': key})
+        return {'Contents': contents, 'CommonPrefixes': [{'Prefix': p} for p in common_prefixes]}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, OptionalObjectAttributes, StartAfter='', Prefix=''):
+        keys = [key for key in self.keys if key > StartAfter and key.startswith(Prefix)]
+        for i in range(0, len(keys), self.page_size):
+            if self.fail_after is not None and keys[i] >= self.fail_after:
+                raise botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'ListObjectsV2')
+            yield {'Contents': [{'Key': key, 'Size': len(key)} for key in keys[i:i + self.page_size]]}
+
+
+@patch('logging.info')
+class TestListSharded(unittest.TestCase):
+    def test_find_boundaries(self, mock_logging_info):
+        # Act
+        actual_boundaries = listing.find_boundaries(FakeS3(KEYS), 'my-old-archives', 4)
+
+        # Assert
+        self.assertEqual(actual_boundaries, ['logs/2024/', 'photos/2023/', 'photos/2024/'])
+
+    def test_find_boundaries_flat(self, mock_logging_info):
+        # Act
+        actual_boundaries = listing.find_boundaries(FakeS3(['a', 'b', 'c']), 'my-old-archives', 4)
+
+        # Assert
+        self.assertEqual(actual_boundaries, [])
+
+    def test_list_sharded(self, mock_logging_info):
+        # Act
+        actual_keys = [s3object.key for s3object in listing.list_sharded(FakeS3(KEYS), 'my-old-archives', 4)]
+
+        # Assert
+        self.assertEqual(actual_keys, KEYS)
+
+    def test_list_sharded_many_shards(self, mock_logging_info):
+        # Act
+        actual_keys = [s3object.key for s3object in listing.list_sharded(FakeS3(KEYS, page_size=1), 'my-old-archives', 64)]
+
+        # Assert
+        self.assertEqual(actual_keys, KEYS)
+
+    def test_list_sharded_error(self, mock_logging_info):
+        # Act
+        with self.assertRaises(botocore.exceptions.ClientError):
+            list(listing.list_sharded(FakeS3(KEYS, fail_after='photos/2024/'), 'my-old-archives', 4))
+
+    def test_list_range(self, mock_logging_info):
+        # Act
+        actual_pages = list(listing.list_range(FakeS3(KEYS), 'my-old-archives', 'photos/', 'photos/2024/'))
+
+        # Assert
+        self.assertEqual([[s3object.key for s3object in page] for page in actual_pages], [['photos/'], ['photos/2023/img1.jpg']])
+
+
+    def test_list_range_prefix(self, mock_logging_info):
+        # Act
+        actual_pages = list(listing.list_range(FakeS3(KEYS), 'my-old-archives', prefix='logs/'))
+
+        # Assert
+        self.assertEqual(
+            [[s3object.key for s3object in page] for page in actual_pages],
+            [['logs/2023/01.log', 'logs/2023/02.log'], ['logs/2024/01.log', 'logs/readme.txt']]
+        )
+
+    def test_find_boundaries_prefix(self, mock_logging_info):
+        # Act
+        actual_boundaries = listing.find_boundaries(FakeS3(KEYS), 'my-old-archives', 4, 'photos/')
+
+        # Assert
+        self.assertEqual(actual_boundaries, ['photos/2023/', 'photos/2024/'])
+
+    def test_find_boundaries_prefix_without_folders(self, mock_logging_info):
+        # Act
+        actual_boundaries = listing.find_boundaries(FakeS3(KEYS), 'my-old-archives', 4, 'videos/')
+
+        # Assert
+        self.assertEqual(actual_boundaries, [])
+
+    def test_list_sharded_key_range(self, mock_logging_info):
+        # Act
+        actual_keys = [s3object.key for s3object in listing.list_sharded(FakeS3(KEYS), 'my-old-archives', 4, None, 'logs/2024/', 'photos/2024/')]
+
+        # Assert
+        self.assertEqual(actual_keys, [key for key in KEYS if 'logs/2024/' <= key < 'photos/2024/'])
+        mock_logging_info.assert_called_with('Listing my-old-archives in 2 shards')
+
+    def test_list_sharded_prefix(self, mock_logging_info):
+        # Act
+        actual_keys = [s3object.key for s3object in listing.list_sharded(FakeS3(KEYS), 'my-old-archives', 4, 'photos')]
+
+        # Assert
+        self.assertEqual(actual_keys, [key for key in KEYS if key.startswith('photos')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import zlib
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from os.path import exists
+
+from checksum import CHECKSUM_FIELD, encode_crc32, get_checksum
+from compress import METADATA_SIZE, is_compressed
+from pack import BUNDLE_KEY_PREFIX, INDEX_SUFFIX, read_index
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+# HEADs in flight while an index of compressed uploads is rebuilt
+REBUILD_HEAD_THREADS = 32
+
+
+def file_checksum(path):
+    # Full-object CRC32 in S3's encoding, to compare with the checksum recorded at upload
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return encode_crc32(crc)
+
+
+def file_hash(path):
+    # MD5 so the hash can be compared with the ETag of objects uploaded with a single PUT
+    md5 = hashlib.md5(usedforsecurity=False)
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def rebuilt_row(client, bucket, key_prefix, compressed, s3object):
+    # (key, size, mtime, md5, checksum) of an object. Single part uploads have the MD5 of their content as ETag.
+    # Multipart uploads get a HEAD for the full-object CRC32 stored with them, and so do objects that may have
+    # been compressed, for their metadata
+    key = s3object['Key'][len(key_prefix):]
+    etag = s3object['ETag'].strip('"')
+    md5 = None if '-' in etag else etag
+    size = s3object['Size']
+    if md5 is not None and not (compressed and not is_compressed(key)):
+        return key, size, None, md5, None
+    head = client.head_object(Bucket=bucket, Key=s3object['Key'], ChecksumMode='ENABLED')
+    if METADATA_SIZE in head.get('Metadata', {}):
+        # The ETag and the checksum are of the compressed bytes, there's nothing to compare the file with
+        return key, int(head['Metadata'][METADATA_SIZE]), None, None, None
+    checksum = get_checksum(head)
+    if checksum is None or checksum[0] != CHECKSUM_FIELD:
+        return key, size, None, md5, None
+    return key, size, None, md5, checksum[1]
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.is_new = not exists(path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL, hash TEXT, '
+            'checksum TEXT)'
+        )
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(files)')]
+        if 'checksum' not in columns:
+            # Indexes written before checksums were recorded
+            self.connection.execute('ALTER TABLE files ADD COLUMN checksum TEXT')
+        self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT size, mtime, hash, checksum FROM files WHERE key = ?',
+                (key,)
+            ).fetchone()
+
+    def record(self, key, size, mtime, md5, checksum=None):
+        # checksum is the full-object CRC32 of the file's content, worked out while it was read for the upload.
+        # It's also the checksum S3 stored with the object, unless the file was uploaded compressed
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files (key, size, mtime, hash, checksum) VALUES (?, ?, ?, ?, ?)',
+                (key, size, mtime, md5, checksum)
+            )
+            self.connection.commit()
+
+    def touch(self, key, mtime, md5):
+        # Same content, new mtime: the checksum of the object stays
+        with self.lock:
+            self.connection.execute('UPDATE files SET mtime = ?, hash = ? WHERE key = ?', (mtime, md5, key))
+            self.connection.commit()
+
+    def rebuild(self, client, bucket, prefix, compressed=False):
+        # Objects from a listing have no local mtime. The ETag is only an MD5 of the content
+        # for single part uploads, multipart uploads are compared with their full-object checksum instead.
+        # The listing has the compressed size of compressed uploads: with compressed, every object that may
+        # have been compressed gets a HEAD for its uncompressed size. Packed files are read from the bundle indexes
+        key_prefix = f'{prefix}/'
+        paginator = client.get_paginator('list_objects_v2')
+        count = 0
+        index_keys = []
+        with self.lock, ThreadPool(processes=REBUILD_HEAD_THREADS) as pool:
+            for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix):
+                s3objects = []
+                for s3object in page.get('Contents', []):
+                    key = s3object['Key'][len(key_prefix):]
+                    if not key.startswith(BUNDLE_KEY_PREFIX + '/'):
+                        s3objects.append(s3object)
+                    elif key.endswith(INDEX_SUFFIX):
+                        index_keys.append(s3object['Key'])
+                rows = pool.map(partial(rebuilt_row, client, bucket, key_prefix, compressed), s3objects)
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO files (key, size, mtime, hash, checksum) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+                count = count + len(rows)
+            # Index names start with their run's time, so a file packed again by a later run ends up with its
+            # latest size and checksum
+            for index_key in sorted(index_keys):
+                body = client.get_object(Bucket=bucket, Key=index_key)['Body']
+                rows = [(key, size, None, None, checksum) for (key, _, _, size, checksum) in read_index(body)]
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO files (key, size, mtime, hash, checksum) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+                count = count + len(rows)
+            self.connection.commit()
+        logging.info(f'Index {self.path} rebuilt from {count} objects and packed files in {bucket}/{key_prefix}')
+
+    def needs_upload(self, file):
+        # Returns (needed, md5). The file is only hashed when its size is unchanged but its mtime isn't.
+        # Files that were touched without changing their content get their new mtime recorded
+        row = self.get(file.key)
+        if row is None:
+            return True, None
+        (size, mtime, md5, checksum) = row
+        if size != file.size:
+            return True, None
+        if mtime == file.mtime:
+            return False, md5
+        if checksum is not None:
+            # Uploaded by this tool: compared with a CRC32 of the file, no MD5 is needed
+            if file_checksum(file.path) != checksum:
+                return True, None
+            self.touch(file.key, file.mtime, md5)
+            return False, md5
+        if md5 is None:
+            # Nothing to compare the content with, a file of the same size may still have changed
+            return True, None
+        current_md5 = file_hash(file.path)
+        if current_md5 != md5:
+            return True, current_md5
+        self.touch(file.key, file.mtime, current_md5)
+        return False, current_md5
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,267 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from os.path import join
+from unittest.mock import MagicMock, patch
+
+import manifest
+
+FileEntry = namedtuple('FileEntry', ['key', 'path', 'size', 'mtime'])
+
+
+class TestFileHash(unittest.TestCase):
+    def test_file_hash(self):
+        # Arrange
+        expected_path = 'test_fixtures/upload_files/file1.txt'
+        expected_md5 = 'd41d8cd98f00b204e9800998ecf8427e'
+
+        # Act
+        actual_md5 = manifest.file_hash(expected_path)
+
+        # Assert
+        self.assertEqual(actual_md5, expected_md5)
+
+
+class TestFileChecksum(unittest.TestCase):
+    def test_file_checksum(self):
+        # Arrange
+        expected_path = 'test_fixtures/upload_files/file1.txt'
+        expected_checksum = 'AAAAAA=='
+
+        # Act
+        actual_checksum = manifest.file_checksum(expected_path)
+
+        # Assert
+        self.assertEqual(actual_checksum, expected_checksum)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_path = join(self.tmp_dir.name, 'index.sqlite')
+        self.file_path = join(self.tmp_dir.name, 'file.txt')
+        with open(self.file_path, 'wb') as f:
+            f.write(b'file1\n')
+        self.manifest = manifest.Manifest(self.index_path)
+        self.md5 = manifest.file_hash(self.file_path)
+        self.checksum = manifest.file_checksum(self.file_path)
+
+    def tearDown(self):
+        self.manifest.close()
+        self.tmp_dir.cleanup()
+
+    def test_is_new(self):
+        # Arrange
+        self.manifest.close()
+
+        # Act
+        self.manifest = manifest.Manifest(self.index_path)
+
+        # Assert
+        self.assertFalse(self.manifest.is_new)
+
+    def test_needs_upload_new_file(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000000.0)
+
+        # Act
+        (actual_needed, actual_md5) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertTrue(actual_needed)
+        self.assertIsNone(actual_md5)
+
+    def test_needs_upload_unchanged(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000000.0)
+        self.manifest.record(file.key, file.size, file.mtime, None)
+
+        # Act
+        with patch('manifest.file_hash') as mock_file_hash:
+            (actual_needed, _) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertFalse(actual_needed)
+        mock_file_hash.assert_not_called()
+
+    def test_needs_upload_size_changed(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000000.0)
+        self.manifest.record(file.key, 5, file.mtime, self.md5)
+
+        # Act
+        (actual_needed, _) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertTrue(actual_needed)
+
+    def test_needs_upload_touched(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000100.0)
+        self.manifest.record(file.key, file.size, 1700000000.0, self.md5)
+
+        # Act
+        (actual_needed, _) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertFalse(actual_needed)
+        self.assertEqual(self.manifest.get(file.key), (file.size, file.mtime, self.md5, None))
+
+    def test_record_checksum(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000100.0)
+        self.manifest.record(file.key, file.size, 1700000000.0, self.md5, self.checksum)
+
+        # Act
+        self.manifest.needs_upload(file)
+
+        # Assert
+        actual_rows = self.manifest.connection.execute('SELECT mtime, checksum FROM files').fetchall()
+        self.assertEqual(actual_rows, [(file.mtime, self.checksum)])
+
+    def test_needs_upload_touched_after_upload(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000000.0)
+        self.manifest.record(file.key, file.size, file.mtime, None, self.checksum)
+        os.utime(self.file_path, (1700000100.0, 1700000100.0))
+        touched_file = FileEntry('file.txt', self.file_path, 6, os.stat(self.file_path).st_mtime)
+
+        # Act
+        with patch('manifest.file_hash') as mock_file_hash:
+            (actual_needed, actual_md5) = self.manifest.needs_upload(touched_file)
+
+        # Assert
+        self.assertFalse(actual_needed)
+        self.assertIsNone(actual_md5)
+        mock_file_hash.assert_not_called()
+        self.assertEqual(self.manifest.get(file.key), (6, 1700000100.0, None, self.checksum))
+
+    def test_needs_upload_content_changed_after_upload(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000100.0)
+        self.manifest.record(file.key, file.size, 1700000000.0, None, 'AAAAAA==')
+
+        # Act
+        (actual_needed, _) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertTrue(actual_needed)
+        self.assertEqual(self.manifest.get(file.key), (6, 1700000000.0, None, 'AAAAAA=='))
+
+    def test_needs_upload_content_changed(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000100.0)
+        self.manifest.record(file.key, file.size, 1700000000.0, '0' * 32)
+
+        # Act
+        (actual_needed, actual_md5) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertTrue(actual_needed)
+        self.assertEqual(actual_md5, self.md5)
+
+    def test_rebuild(self):
+        # Arrange
+        expected_bucket = 'my-archive-bucket'
+        expected_prefix = 'archive/2024'
+        mock_client = MagicMock()
+        mock_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
+                {'Key': 'archive/2024/file.txt', 'Size': 6, 'ETag': f'"{self.md5}"'},
+                {'Key': 'archive/2024/big.bin', 'Size': 6, 'ETag': '"abc-2"'},
+                {'Key': 'archive/2024/old.bin', 'Size': 6, 'ETag': '"def-2"'},
+            ]},
+            {},
+        ]
+        heads = {
+            'archive/2024/big.bin': {'ChecksumCRC32': self.checksum, 'ChecksumType': 'FULL_OBJECT'},
+            'archive/2024/old.bin': {'ChecksumCRC32': 'AAAAAA==-2', 'ChecksumType': 'COMPOSITE'},
+        }
+        mock_client.head_object.side_effect = lambda Bucket, Key, ChecksumMode: heads[Key]
+        single_part_file = FileEntry('file.txt', self.file_path, 6, 1700000000.0)
+        multipart_file = FileEntry('big.bin', self.file_path, 6, 1700000000.0)
+        composite_file = FileEntry('old.bin', self.file_path, 6, 1700000000.0)
+
+        # Act
+        self.manifest.rebuild(mock_client, expected_bucket, expected_prefix)
+
+        # Assert
+        mock_client.get_paginator.return_value.paginate.assert_called_with(Bucket=expected_bucket, Prefix=f'{expected_prefix}/')
+        mock_client.head_object.assert_any_call(Bucket=expected_bucket, Key='archive/2024/big.bin', ChecksumMode='ENABLED')
+        self.assertEqual(mock_client.head_object.call_count, 2)
+        self.assertEqual(self.manifest.get('file.txt'), (6, None, self.md5, None))
+        self.assertEqual(self.manifest.get('big.bin'), (6, None, None, self.checksum))
+        self.assertEqual(self.manifest.get('old.bin'), (6, None, None, None))
+        self.assertEqual(self.manifest.needs_upload(single_part_file), (False, self.md5))
+        self.assertEqual(self.manifest.needs_upload(multipart_file), (False, None))
+        self.assertEqual(self.manifest.needs_upload(composite_file), (True, None))
+
+    def test_needs_upload_size_only(self):
+        # Arrange
+        file = FileEntry('file.txt', self.file_path, 6, 1700000000.0)
+        self.manifest.record(file.key, file.size, None, None)
+
+        # Act
+        (actual_needed, _) = self.manifest.needs_upload(file)
+
+        # Assert
+        self.assertTrue(actual_needed)
+        self.assertEqual(self.manifest.get(file.key), (6, None, None, None))
+
+    def test_rebuild_bundles(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
+                {'Key': 'archive/2024/file.txt', 'Size': 6, 'ETag': f'"{self.md5}"'},
+                {'Key': 'archive/2024/bundles/20240102T000000Z-000001.tar', 'Size': 10240, 'ETag': '"abc"'},
+                {'Key': 'archive/2024/bundles/20240102T000000Z.index.csv.gz', 'Size': 100, 'ETag': '"def"'},
+                {'Key': 'archive/2024/bundles/20240101T000000Z.index.csv.gz', 'Size': 100, 'ETag': '"ghi"'},
+            ]},
+        ]
+        indexes = {
+            'archive/2024/bundles/20240101T000000Z.index.csv.gz': 'key,bundle,offset,size\nsmall.txt,b1.tar,512,3\nold.txt,b1.tar,1536,4\n',
+            'archive/2024/bundles/20240102T000000Z.index.csv.gz': 'key,bundle,offset,size,checksum\nsmall.txt,b2.tar,512,5,AAAAAA==\n',
+        }
+        mock_client.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(gzip.compress(indexes[Key].encode()))}
+
+        # Act
+        self.manifest.rebuild(mock_client, 'my-archive-bucket', 'archive/2024')
+
+        # Assert
+        actual_keys = [row[0] for row in self.manifest.connection.execute('SELECT key FROM files ORDER BY key')]
+        self.assertEqual(actual_keys, ['file.txt', 'old.txt', 'small.txt'])
+        self.assertEqual(self.manifest.get('small.txt'), (5, None, None, 'AAAAAA=='))
+        self.assertEqual(self.manifest.get('old.txt'), (4, None, None, None))
+
+    def test_rebuild_compressed(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
+                {'Key': 'archive/2024/app.log', 'Size': 100, 'ETag': '"abc"'},
+                {'Key': 'archive/2024/plain.txt', 'Size': 6, 'ETag': f'"{self.md5}"'},
+                {'Key': 'archive/2024/photo.jpg', 'Size': 50, 'ETag': '"def"'},
+            ]},
+        ]
+        metadata = {
+            'archive/2024/app.log': {'compression': 'gzip', 'uncompressed-size': '1000'},
+            'archive/2024/plain.txt': {},
+        }
+        mock_client.head_object.side_effect = lambda Bucket, Key, ChecksumMode: {'Metadata': metadata[Key]}
+
+        # Act
+        self.manifest.rebuild(mock_client, 'my-archive-bucket', 'archive/2024', compressed=True)
+
+        # Assert
+        self.assertEqual(self.manifest.get('app.log'), (1000, None, None, None))
+        self.assertEqual(self.manifest.get('plain.txt'), (6, None, self.md5, None))
+        self.assertEqual(self.manifest.get('photo.jpg'), (50, None, 'def', None))
+        self.assertEqual(mock_client.head_object.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
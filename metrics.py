@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from limiter import THROTTLE_ERROR_CODES
+
+# Upper bounds of the latency buckets in seconds, from a small HEAD to a multi-GB UploadPartCopy
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+PROGRESS_INTERVAL = 30
+METRIC_PREFIX = 's3archiver'
+PROMETHEUS_SUFFIX = '.prom'
+GB = 1024 * 1024 * 1024
+MB = 1024 * 1024
+
+
+class Histogram:
+    # Counts per bucket instead of every sample, so a run of a billion requests takes the same memory as one
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        bucket = bisect_left(self.buckets, value)
+        self.counts[bucket] = self.counts[bucket] + 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+
+    def quantile(self, q):
+        # Upper bound of the bucket the quantile falls in
+        rank = q * self.count
+        seen = 0
+        for (bound, count) in zip(self.buckets, self.counts):
+            seen = seen + count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': {str(bound): count for (bound, count) in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+
+class Metrics:
+    # Objects and bytes by state, and per S3 operation: latencies, retries (by botocore) and throttled
+    # responses. Requests are measured through botocore's events, so every client they're registered on
+    # is covered, paginators included
+    def __init__(self, throughput_state, emoji=False, clock=time.monotonic):
+        # Bytes per second are given for throughput_state, e.g. copied
+        self.throughput_state = throughput_state
+        self.emoji = emoji
+        self.clock = clock
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.objects = Counter()
+        self.bytes = Counter()
+        self.latencies = {}
+        self.retries = Counter()
+        self.throttles = Counter()
+        self.errors = Counter()
+        self.limiters = []
+        self.stopped = threading.Event()
+        self.reporter = None
+
+    def count(self, state, size=0):
+        with self.lock:
+            self.objects[state] = self.objects[state] + 1
+            self.bytes[state] = self.bytes[state] + size
+
+    def counted(self, state, s3objects):
+        for s3object in s3objects:
+            self.count(state, s3object.size)
+            yield s3object
+
+    def show(self, symbol):
+        # The per-object symbols are a write to the terminal each, so they are only shown when asked for
+        if self.emoji:
+            print(symbol, end='')
+            sys.stdout.flush()
+
+    def end_line(self):
+        if self.emoji:
+            print('')
+
+    def observe(self, operation, seconds, retries=0):
+        with self.lock:
+            histogram = self.latencies.get(operation)
+            if histogram is None:
+                histogram = self.latencies[operation] = Histogram()
+            histogram.observe(seconds)
+            self.retries[operation] = self.retries[operation] + retries
+
+    def instrument(self, client):
+        # The unique ids keep a client from being measured twice when it's instrumented again
+        events = client.meta.events
+        events.register('before-parameter-build.s3', self._before_call, unique_id=f'metrics-before-call-{id(self)}')
+        events.register('after-call.s3', self._after_call, unique_id=f'metrics-after-call-{id(self)}')
+        events.register('needs-retry.s3', self._needs_retry, unique_id=f'metrics-needs-retry-{id(self)}')
+
+    def watch(self, limiter):
+        self.limiters.append(limiter)
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_started'] = self.clock()
+
+    def _after_call(self, parsed, model, context, **kwargs):
+        started = context.get('metrics_started')
+        if started is None:
+            return
+        self.observe(model.name, self.clock() - started, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+        code = parsed.get('Error', {}).get('Code')
+        if code:
+            with self.lock:
+                self.errors[code] = self.errors[code] + 1
+
+    def _needs_retry(self, response, operation, **kwargs):
+        # Called after every attempt, before botocore decides whether to retry it
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            with self.lock:
+                self.throttles[operation.name] = self.throttles[operation.name] + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'elapsed': self.clock() - self.started,
+                'objects': dict(self.objects),
+                'bytes': dict(self.bytes),
+                'latencies': {operation: histogram.to_dict() for (operation, histogram) in self.latencies.items()},
+                'retries': dict(self.retries),
+                'throttles': dict(self.throttles),
+                'errors': dict(self.errors),
+                'limiters': {
+                    limiter.name: {'limit': int(limiter.limit), 'in_flight': limiter.in_flight,
+                                   'throttled': limiter.throttled_count}
+                    for limiter in self.limiters
+                },
+            }
+
+    def progress(self):
+        throughput_state = self.throughput_state
+        with self.lock:
+            elapsed = max(self.clock() - self.started, 1e-9)
+            states = ', '.join(f'{count} {state}' for (state, count) in sorted(self.objects.items()))
+            rate = self.bytes[throughput_state] / elapsed / MB
+            operations = ', '.join(
+                f'{operation} {histogram.count} (p50 {histogram.quantile(0.5)} s, p99 {histogram.quantile(0.99)} s)'
+                for (operation, histogram) in sorted(self.latencies.items())
+            )
+            return (f'Progress after {elapsed:.0f} s: {states or "no objects yet"}. '
+                    f'{self.bytes[throughput_state] / GB:.2f} GB {throughput_state} ({rate:.1f} MB/s). '
+                    f'Requests: {operations or "none"}. {sum(self.retries.values())} retried, '
+                    f'{sum(self.throttles.values())} throttled. Limiters: '
+                    f'{sum(limiter.throttled_count for limiter in self.limiters)} throttled')
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [f'# TYPE {METRIC_PREFIX}_objects_total counter']
+        lines.extend(f'{METRIC_PREFIX}_objects_total{{state="{state}"}} {count}'
+                     for (state, count) in sorted(snapshot['objects'].items()))
+        lines.append(f'# TYPE {METRIC_PREFIX}_bytes_total counter')
+        lines.extend(f'{METRIC_PREFIX}_bytes_total{{state="{state}"}} {count}'
+                     for (state, count) in sorted(snapshot['bytes'].items()))
+        lines.append(f'# TYPE {METRIC_PREFIX}_request_duration_seconds histogram')
+        for (operation, histogram) in sorted(snapshot['latencies'].items()):
+            cumulative = 0
+            for (bound, count) in histogram['buckets'].items():
+                cumulative = cumulative + count
+                lines.append(f'{METRIC_PREFIX}_request_duration_seconds_bucket{{operation="{operation}",le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{METRIC_PREFIX}_request_duration_seconds_sum{{operation="{operation}"}} {histogram["sum"]}')
+            lines.append(f'{METRIC_PREFIX}_request_duration_seconds_count{{operation="{operation}"}} {histogram["count"]}')
+        for name in ('retries', 'throttles'):
+            lines.append(f'# TYPE {METRIC_PREFIX}_request_{name}_total counter')
+            lines.extend(f'{METRIC_PREFIX}_request_{name}_total{{operation="{operation}"}} {count}'
+                         for (operation, count) in sorted(snapshot[name].items()))
+        lines.append(f'# TYPE {METRIC_PREFIX}_request_errors_total counter')
+        lines.extend(f'{METRIC_PREFIX}_request_errors_total{{code="{code}"}} {count}'
+                     for (code, count) in sorted(snapshot['errors'].items()))
+        for name in ('limit', 'in_flight', 'throttled'):
+            lines.append(f'# TYPE {METRIC_PREFIX}_limiter_{name} gauge')
+            lines.extend(f'{METRIC_PREFIX}_limiter_{name}{{limiter="{limiter}"}} {values[name]}'
+                         for (limiter, values) in sorted(snapshot['limiters'].items()))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        # A Prometheus textfile collector may read the file at any time, so it is replaced in one step
+        if path.endswith(PROMETHEUS_SUFFIX):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2)
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as f:
+            f.write(content)
+        os.replace(temporary_path, path)
+
+    def start(self, interval=PROGRESS_INTERVAL, path=None):
+        # Logs a progress line, and writes the metrics to path, every interval seconds until stop()
+        self.stopped.clear()
+        self.reporter = threading.Thread(
+            target=self._report,
+            args=(interval, path),
+            daemon=True
+        )
+        self.reporter.start()
+
+    def stop(self, path=None):
+        self.stopped.set()
+        if self.reporter is not None:
+            self.reporter.join()
+        logging.info(self.progress())
+        if path is not None:
+            self.write(path)
+
+    def _report(self, interval, path):
+        while not self.stopped.wait(interval):
+            logging.info(self.progress())
+            if path is not None:
+                self.write(path)
@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import boto3
+from botocore.stub import Stubber
+
+from metrics import Histogram, Metrics
+from limiter import AdaptiveLimiter
+from s3object import S3Object
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantile(self):
+        # Arrange
+        histogram = Histogram((0.1, 1, 10))
+        for latency in [0.05] * 90 + [0.5] * 9 + [20]:
+            histogram.observe(latency)
+
+        # Act
+        actual_quantiles = [histogram.quantile(0.5), histogram.quantile(0.99), histogram.quantile(1)]
+
+        # Assert
+        self.assertEqual(actual_quantiles, [0.1, 1, float('inf')])
+        self.assertEqual((histogram.count, histogram.counts), (100, [90, 9, 0, 1]))
+
+
+class TestMetrics(unittest.TestCase):
+    def test_instrument(self):
+        # Arrange
+        clock = FakeClock()
+        metrics = Metrics('copied', clock=clock)
+        client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='key', aws_secret_access_key='secret')
+        metrics.instrument(client)
+        metrics.instrument(client)
+        stubber = Stubber(client)
+        stubber.add_response('head_object', {'ContentLength': 10, 'ResponseMetadata': {'RetryAttempts': 2}})
+        stubber.add_client_error('copy_object', 'AccessDenied')
+        client.meta.events.register('before-parameter-build.s3', lambda **kwargs: setattr(clock, 'now', clock.now + 0.2))
+
+        with stubber:
+            # Act
+            client.head_object(Bucket='my-old-archives', Key='file1.csv')
+            with self.assertRaises(client.exceptions.ClientError):
+                client.copy_object(Bucket='my-new-archives', Key='file1.csv', CopySource='my-old-archives/file1.csv')
+
+        # Assert
+        actual_snapshot = metrics.snapshot()
+        self.assertEqual(actual_snapshot['latencies']['HeadObject']['count'], 1)
+        self.assertAlmostEqual(actual_snapshot['latencies']['HeadObject']['sum'], 0.2)
+        self.assertEqual(actual_snapshot['latencies']['CopyObject']['count'], 1)
+        self.assertEqual(actual_snapshot['retries'], {'HeadObject': 2, 'CopyObject': 0})
+        self.assertEqual(actual_snapshot['errors'], {'AccessDenied': 1})
+
+    def test_needs_retry(self):
+        # Arrange
+        metrics = Metrics('copied')
+        operation = MagicMock()
+        operation.name = 'CopyObject'
+
+        # Act
+        metrics._needs_retry(response=(None, {'Error': {'Code': 'SlowDown'}}), operation=operation, attempts=1)
+        metrics._needs_retry(response=(None, {'Error': {'Code': 'AccessDenied'}}), operation=operation, attempts=1)
+        metrics._needs_retry(response=None, operation=operation, attempts=1)
+
+        # Assert
+        self.assertEqual(metrics.throttles, {'CopyObject': 1})
+
+    def test_progress(self):
+        # Arrange
+        clock = FakeClock()
+        metrics = Metrics('copied', clock=clock)
+        limiter = AdaptiveLimiter('copy', 10, 100)
+        limiter.throttled_count = 3
+        metrics.watch(limiter)
+        list(metrics.counted('copied', [S3Object('file1.csv', 512 * 1024 * 1024), S3Object('file2.csv', 512 * 1024 * 1024)]))
+        metrics.count('failed', 10)
+        metrics.observe('CopyObject', 0.3, 1)
+        # The limiter's throttles were seen by botocore too, they aren't added up
+        operation = MagicMock()
+        operation.name = 'CopyObject'
+        for _ in range(3):
+            metrics._needs_retry(response=(None, {'Error': {'Code': 'SlowDown'}}), operation=operation, attempts=1)
+        clock.now = 110.0
+
+        # Act
+        actual_progress = metrics.progress()
+
+        # Assert
+        self.assertEqual(actual_progress, 'Progress after 10 s: 2 copied, 1 failed. 1.00 GB copied (102.4 MB/s). '
+                                          'Requests: CopyObject 1 (p50 0.5 s, p99 0.5 s). 1 retried, 3 throttled. '
+                                          'Limiters: 3 throttled')
+
+    def test_to_prometheus(self):
+        # Arrange
+        metrics = Metrics('copied')
+        metrics.count('copied', 100)
+        metrics.observe('CopyObject', 0.3)
+        metrics.observe('CopyObject', 3)
+
+        # Act
+        actual_lines = metrics.to_prometheus().splitlines()
+
+        # Assert
+        self.assertIn('s3archiver_objects_total{state="copied"} 1', actual_lines)
+        self.assertIn('s3archiver_bytes_total{state="copied"} 100', actual_lines)
+        self.assertIn('s3archiver_request_duration_seconds_bucket{operation="CopyObject",le="0.5"} 1', actual_lines)
+        self.assertIn('s3archiver_request_duration_seconds_bucket{operation="CopyObject",le="+Inf"} 2', actual_lines)
+        self.assertIn('s3archiver_request_duration_seconds_count{operation="CopyObject"} 2', actual_lines)
+
+    @patch('logging.info')
+    def test_start_stop(self, mock_logging_info):
+        # Arrange
+        metrics = Metrics('copied')
+        metrics.count('copied', 100)
+
+        with tempfile.TemporaryDirectory() as directory:
+            expected_path = os.path.join(directory, 'metrics.json')
+
+            # Act
+            metrics.start(0.01, expected_path)
+            metrics.stop(expected_path)
+
+            # Assert
+            with open(expected_path) as f:
+                actual_metrics = json.load(f)
+            self.assertEqual(actual_metrics['objects'], {'copied': 1})
+            self.assertEqual(os.listdir(directory), ['metrics.json'])
+            mock_logging_info.assert_called()
+
+    @patch('builtins.print')
+    def test_show(self, mock_print):
+        # Arrange
+        metrics = Metrics('copied')
+
+        # Act
+        metrics.show('💾')
+        metrics.emoji = True
+        metrics.show('💾')
+
+        # Assert
+        mock_print.assert_called_once_with('💾', end='')
+
+
+if __name__ == '__main__':
+    unittest.main()
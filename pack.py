@@ -0,0 +1,186 @@
+import csv
+import gzip
+import io
+import logging
+import sys
+import tarfile
+import threading
+import zlib
+from argparse import ArgumentParser
+from math import ceil
+from os import remove
+from os.path import join, getsize
+
+import botocore.exceptions
+
+from checksum import encode_crc32
+from clients import ClientFactory
+
+PROGRAM_DESCRIPTION = 'Fetches a file packed by archive.py --pack-threshold from its restored bundle'
+LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
+LOG_LEVEL = logging.INFO
+BUNDLE_KEY_PREFIX = 'bundles'
+INDEX_SUFFIX = '.index.csv.gz'
+INDEX_HEADER = ['key', 'bundle', 'offset', 'size', 'checksum']
+MAX_PENDING_BUNDLES = 16
+
+
+def read_index(path):
+    with gzip.open(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        if next(reader, None) is None:
+            return
+        for row in reader:
+            # Indexes written before checksums were recorded have no checksum column
+            (key, bundle, offset, size) = row[:4]
+            checksum = row[4] if len(row) > 4 else None
+            yield key, bundle, int(offset), int(size), checksum
+
+
+def fetch_packed_file(client, bucket, prefix, bundle, offset, size):
+    # Bundles are plain tar files, so a member's bytes can be read with a ranged GET.
+    # Bundles in GLACIER have to be restored first
+    if size == 0:
+        return b''
+    response = client.get_object(Bucket=bucket, Key=f'{prefix}/{bundle}', Range=f'bytes={offset}-{offset + size - 1}')
+    return response['Body'].read()
+
+
+def find_packed_file(client, bucket, prefix, key):
+    # (bundle, offset, size) of a packed file from the bundle indexes under prefix, None if it was never packed.
+    # Index names start with their run's time, so the latest run that packed the file wins
+    paginator = client.get_paginator('list_objects_v2')
+    index_keys = [
+        s3object['Key']
+        for page in paginator.paginate(Bucket=bucket, Prefix=f'{prefix}/{BUNDLE_KEY_PREFIX}/')
+        for s3object in page.get('Contents', [])
+        if s3object['Key'].endswith(INDEX_SUFFIX)
+    ]
+    found = None
+    for index_key in sorted(index_keys):
+        body = client.get_object(Bucket=bucket, Key=index_key)['Body']
+        for (packed_key, bundle, offset, size, _) in read_index(body):
+            if packed_key == key:
+                found = (bundle, offset, size)
+    return found
+
+
+class Packer:
+    def __init__(self, bundle_dir, run_id, threshold, bundle_size, manifest=None):
+        self.bundle_dir = bundle_dir
+        self.run_id = run_id
+        self.threshold = threshold
+        self.bundle_size = bundle_size
+        self.manifest = manifest
+        self.bundle_count = 0
+        self.lock = threading.Lock()
+        # Bundles are written ahead of the uploads, this keeps their number on disk bounded
+        self.pending_bundles = threading.BoundedSemaphore(MAX_PENDING_BUNDLES)
+        self.index_key = f'{BUNDLE_KEY_PREFIX}/{run_id}{INDEX_SUFFIX}'
+        self.index_path = join(bundle_dir, f'{run_id}{INDEX_SUFFIX}')
+        self.index_file = gzip.open(self.index_path, 'wt', newline='')
+        self.index_writer = csv.writer(self.index_file)
+        self.index_writer.writerow(INDEX_HEADER)
+
+    def pack(self, files):
+        # Passes big files through and yields bundles of small files in their place.
+        # A bundle entry lists its members as (file, md5, offset, checksum) tuples
+        tar = None
+        bundle_key = None
+        members = []
+        for file in files:
+            if file.size > self.threshold:
+                yield file
+                continue
+            md5 = None
+            if self.manifest is not None:
+                (needed, md5) = self.manifest.needs_upload(file)
+                if not needed:
+                    logging.debug(f'File {file.key} unchanged, skipped')
+                    continue
+            try:
+                with open(file.path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                # The upload worker will try again and report the error
+                yield file
+                continue
+            if tar is None:
+                self.pending_bundles.acquire()
+                self.bundle_count = self.bundle_count + 1
+                bundle_key = f'{BUNDLE_KEY_PREFIX}/{self.run_id}-{self.bundle_count:06d}.tar'
+                bundle_path = join(self.bundle_dir, f'{self.run_id}-{self.bundle_count:06d}.tar')
+                tar = tarfile.open(bundle_path, 'w', format=tarfile.PAX_FORMAT)
+                members = []
+            tarinfo = tarfile.TarInfo(file.key)
+            tarinfo.size = len(data)
+            tarinfo.mtime = file.mtime
+            tar.addfile(tarinfo, io.BytesIO(data))
+            # tar pads member data to whole blocks, the data ends right before the padding
+            offset = tar.offset - ceil(len(data) / tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            # Recorded in the manifest like the checksum of a file uploaded on its own, so a touched file isn't packed again
+            checksum = encode_crc32(zlib.crc32(data))
+            members.append((file._replace(size=len(data)), md5, offset, checksum))
+            if tar.offset >= self.bundle_size:
+                yield self._close_bundle(tar, bundle_key, members)
+                tar = None
+        if tar is not None:
+            yield self._close_bundle(tar, bundle_key, members)
+
+    def _close_bundle(self, tar, bundle_key, members):
+        tar.close()
+        logging.info(f'Bundle {bundle_key} packed with {len(members)} files')
+        (first_file, _, _, _) = members[0]
+        return first_file._replace(key=bundle_key, path=tar.name, size=getsize(tar.name), mtime=None, members=tuple(members))
+
+    def finish_bundle(self, bundle, error):
+        try:
+            remove(bundle.path)
+            if error is not None:
+                return
+            with self.lock:
+                for (file, _, offset, checksum) in bundle.members:
+                    self.index_writer.writerow([file.key, bundle.key, offset, file.size, checksum])
+            if self.manifest is not None:
+                for (file, md5, _, checksum) in bundle.members:
+                    self.manifest.record(file.key, file.size, file.mtime, md5, checksum)
+        finally:
+            self.pending_bundles.release()
+
+    def close(self):
+        with self.lock:
+            self.index_file.close()
+        return self.index_path
+
+
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    parser = ArgumentParser(description=PROGRAM_DESCRIPTION)
+    parser.add_argument('bucket')
+    parser.add_argument('prefix')
+    parser.add_argument('key')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    client = ClientFactory().client()
+    found = find_packed_file(client, args.bucket, args.prefix, args.key)
+    if found is None:
+        logging.error(f'{args.key} is in none of the bundle indexes under {args.bucket}/{args.prefix}')
+        return 1
+    (bundle, offset, size) = found
+    try:
+        data = fetch_packed_file(client, args.bucket, args.prefix, bundle, offset, size)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'InvalidObjectState':
+            raise
+        logging.error(f'{bundle} is in Glacier, restore it first (e.g. with archive_restore.py)')
+        return 1
+    with open(args.path, 'wb') as f:
+        f.write(data)
+    logging.info(f'{args.key} written to {args.path} from {bundle}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import gzip
+import io
+import os
+import tempfile
+import unittest
+import zlib
+from collections import namedtuple
+from os.path import join, exists
+from unittest.mock import MagicMock
+
+import pack
+from checksum import encode_crc32
+
+FileEntry = namedtuple('FileEntry', ['key', 'path', 'size', 'mtime', 'members'], defaults=[None])
+
+
+class TestPacker(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bundle_dir = join(self.tmp_dir.name, 'bundles')
+        os.mkdir(self.bundle_dir)
+        self.files = []
+        for (key, data) in [('a.txt', b'a' * 10), ('nested/b.txt', b''), ('c.txt', b'c' * 700), ('big.bin', b'x' * 5000)]:
+            path = join(self.tmp_dir.name, key.replace('/', '_'))
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.files.append(FileEntry(key, path, len(data), 1700000000.0))
+        self.packer = pack.Packer(self.bundle_dir, '20240101T000000Z', 1024, 1024 * 1024)
+
+    def tearDown(self):
+        self.packer.close()
+        self.tmp_dir.cleanup()
+
+    def test_pack(self):
+        # Arrange
+        expected_big_file = self.files[3]
+
+        # Act
+        actual_entries = list(self.packer.pack(self.files))
+
+        # Assert
+        self.assertEqual(len(actual_entries), 2)
+        self.assertEqual(actual_entries[0], expected_big_file)
+        actual_bundle = actual_entries[1]
+        self.assertEqual(actual_bundle.key, 'bundles/20240101T000000Z-000001.tar')
+        self.assertEqual(actual_bundle.size, os.path.getsize(actual_bundle.path))
+        self.assertIsNone(actual_bundle.mtime)
+        self.assertEqual([file.key for (file, md5, offset, checksum) in actual_bundle.members], ['a.txt', 'nested/b.txt', 'c.txt'])
+        with open(actual_bundle.path, 'rb') as f:
+            bundle_data = f.read()
+        for (file, md5, offset, checksum) in actual_bundle.members:
+            with open(file.path, 'rb') as f:
+                self.assertEqual(bundle_data[offset:offset + file.size], f.read())
+
+    def test_pack_bundle_size(self):
+        # Arrange
+        self.packer.bundle_size = 1
+
+        # Act
+        actual_entries = list(self.packer.pack(self.files[:3]))
+
+        # Assert
+        self.assertEqual([len(bundle.members) for bundle in actual_entries], [1, 1, 1])
+        self.assertEqual(self.packer.bundle_count, 3)
+
+    def test_pack_skips_unchanged(self):
+        # Arrange
+        mock_manifest = MagicMock()
+        mock_manifest.needs_upload.side_effect = lambda file: (file.key == 'c.txt', None)
+        self.packer.manifest = mock_manifest
+
+        # Act
+        actual_entries = list(self.packer.pack(self.files[:3]))
+
+        # Assert
+        self.assertEqual([file.key for (file, md5, offset, checksum) in actual_entries[0].members], ['c.txt'])
+
+    def test_finish_bundle(self):
+        # Arrange
+        mock_manifest = MagicMock()
+        mock_manifest.needs_upload.return_value = (True, None)
+        self.packer.manifest = mock_manifest
+        (bundle,) = self.packer.pack(self.files[:3])
+
+        # Act
+        self.packer.finish_bundle(bundle, None)
+        actual_index = list(pack.read_index(self.packer.close()))
+
+        # Assert
+        self.assertFalse(exists(bundle.path))
+        self.assertEqual(
+            actual_index,
+            [(file.key, bundle.key, offset, file.size, checksum) for (file, md5, offset, checksum) in bundle.members]
+        )
+        self.assertEqual(mock_manifest.record.call_count, 3)
+        mock_manifest.record.assert_any_call('a.txt', 10, 1700000000, None, encode_crc32(zlib.crc32(b'a' * 10)))
+
+    def test_finish_bundle_failed(self):
+        # Arrange
+        mock_manifest = MagicMock()
+        mock_manifest.needs_upload.return_value = (True, None)
+        self.packer.manifest = mock_manifest
+        (bundle,) = self.packer.pack(self.files[:3])
+
+        # Act
+        self.packer.finish_bundle(bundle, OSError('Connection reset'))
+        actual_index = list(pack.read_index(self.packer.close()))
+
+        # Assert
+        self.assertFalse(exists(bundle.path))
+        self.assertEqual(actual_index, [])
+        mock_manifest.record.assert_not_called()
+
+
+class TestFetchPackedFile(unittest.TestCase):
+    def test_fetch_packed_file(self):
+        # Arrange
+        mock_client = MagicMock()
+        expected_data = b'file data'
+        mock_client.get_object.return_value = {'Body': MagicMock(read=MagicMock(return_value=expected_data))}
+
+        # Act
+        actual_data = pack.fetch_packed_file(mock_client, 'my-archive-bucket', 'archive/2024', 'bundles/1.tar', 1536, 9)
+
+        # Assert
+        self.assertEqual(actual_data, expected_data)
+        mock_client.get_object.assert_called_with(
+            Bucket='my-archive-bucket',
+            Key='archive/2024/bundles/1.tar',
+            Range='bytes=1536-1544'
+        )
+
+class TestFindPackedFile(unittest.TestCase):
+    def test_find_packed_file(self):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.get_paginator.return_value.paginate.return_value = [
+            {'Contents': [
+                {'Key': 'archive/2024/bundles/20240102T000000Z-000001.tar'},
+                {'Key': 'archive/2024/bundles/20240102T000000Z.index.csv.gz'},
+                {'Key': 'archive/2024/bundles/20240101T000000Z.index.csv.gz'},
+            ]},
+        ]
+        indexes = {
+            'archive/2024/bundles/20240101T000000Z.index.csv.gz': 'key,bundle,offset,size\nsmall.txt,b1.tar,512,3\nold.txt,b1.tar,1536,4\n',
+            'archive/2024/bundles/20240102T000000Z.index.csv.gz': 'key,bundle,offset,size,checksum\nsmall.txt,b2.tar,512,5,AAAAAA==\n',
+        }
+        mock_client.get_object.side_effect = lambda Bucket, Key: {'Body': io.BytesIO(gzip.compress(indexes[Key].encode()))}
+
+        # Act
+        actual_results = [
+            pack.find_packed_file(mock_client, 'my-archive-bucket', 'archive/2024', key)
+            for key in ('small.txt', 'old.txt', 'missing.txt')
+        ]
+
+        # Assert
+        mock_client.get_paginator.return_value.paginate.assert_called_with(
+            Bucket='my-archive-bucket',
+            Prefix='archive/2024/bundles/'
+        )
+        self.assertEqual(actual_results, [('b2.tar', 512, 5), ('b1.tar', 1536, 4), None])
+
+    def test_read_empty_index(self):
+        # Arrange
+        body = io.BytesIO(gzip.compress(b''))
+
+        # Act
+        actual_rows = list(pack.read_index(body))
+
+        # Assert
+        self.assertEqual(actual_rows, [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import logging
+import sys
+import time
+import zlib
+from argparse import ArgumentParser, ArgumentTypeError
+
+PROGRAM_DESCRIPTION = 'Merges the reports of archive_copy.py shards that ran on several hosts into one'
+LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
+LOG_LEVEL = logging.INFO
+
+
+def parse_shard(value):
+    # 'i/N', the i-th of N shards counting from 0
+    try:
+        (index, count) = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ArgumentTypeError(f'{value!r} is not a shard like 0/4') from None
+    if count < 1 or not 0 <= index < count:
+        raise ArgumentTypeError(f'{value!r} is not a shard like 0/4: i has to be between 0 and N - 1')
+    return index, count
+
+
+def shard_name(shard):
+    (index, count) = shard
+    return f'{index}-of-{count}'
+
+
+def shard_path(path, shard):
+    return f'{path}.{shard_name(shard)}'
+
+
+def in_shard(key, shard):
+    # CRC32 of the key is the same on every host and in every run, unlike hash()
+    (index, count) = shard
+    return zlib.crc32(key.encode()) % count == index
+
+
+def shard_s3objects(s3objects, shard):
+    for s3object in s3objects:
+        if in_shard(s3object.key, shard):
+            yield s3object
+
+
+class Report:
+    # Outcome of one run (or one shard of it), written as JSON so the reports of all shards can be merged
+    def __init__(self, shard=None, clock=time.time):
+        self.shard = shard
+        self.clock = clock
+        self.started = clock()
+        self.objects = 0
+        self.bytes = 0
+        self.failures = []
+
+    def count(self, s3objects):
+        # Counts the objects of the job as they go by
+        for s3object in s3objects:
+            self.objects = self.objects + 1
+            self.bytes = self.bytes + s3object.size
+            yield s3object
+
+    def to_dict(self, journal_counts=None):
+        return {
+            'shards': [shard_name(self.shard)] if self.shard is not None else [],
+            'started': self.started,
+            'finished': self.clock(),
+            'objects': self.objects,
+            'bytes': self.bytes,
+            'copied': self.objects - len(self.failures),
+            'failed': len(self.failures),
+            'failures': [{'key': key, 'error': str(error)} for (key, error) in self.failures],
+            'journal': journal_counts or {},
+        }
+
+    def write(self, path, journal_counts=None):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(journal_counts), f, indent=2)
+
+
+def merge_reports(reports):
+    merged = {'shards': [], 'started': None, 'finished': None, 'objects': 0, 'bytes': 0, 'copied': 0, 'failed': 0,
+              'failures': [], 'journal': {}}
+    for report in reports:
+        merged['shards'].extend(report['shards'])
+        merged['started'] = min(report['started'], merged['started'] or report['started'])
+        merged['finished'] = max(report['finished'], merged['finished'] or report['finished'])
+        for field in ('objects', 'bytes', 'copied', 'failed'):
+            merged[field] = merged[field] + report[field]
+        merged['failures'].extend(report['failures'])
+        for (state, count) in report['journal'].items():
+            merged['journal'][state] = merged['journal'].get(state, 0) + count
+    merged['shards'].sort(key=lambda name: int(name.split('-')[0]))
+    return merged
+
+
+def merge_report_files(output_path, paths):
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+    merged = merge_reports(reports)
+    with open(output_path, 'w') as f:
+        json.dump(merged, f, indent=2)
+    logging.info(f'{len(reports)} reports merged into {output_path}: {merged["copied"]} objects copied, '
+                 f'{merged["failed"]} failed')
+    return merged
+
+
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    parser = ArgumentParser(description=PROGRAM_DESCRIPTION)
+    parser.add_argument('merged_report')
+    parser.add_argument('reports', nargs='+')
+    args = parser.parse_args()
+
+    merged = merge_report_files(args.merged_report, args.reports)
+    return 1 if merged['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import unittest
+from argparse import ArgumentTypeError
+from collections import Counter
+from unittest.mock import patch
+
+from report import Report, parse_shard, shard_path, in_shard, shard_s3objects, merge_reports, merge_report_files
+from s3object import S3Object
+
+
+class TestShards(unittest.TestCase):
+    def test_parse_shard(self):
+        # Act
+        actual_shard = parse_shard('2/8')
+
+        # Assert
+        self.assertEqual(actual_shard, (2, 8))
+
+    def test_parse_shard_invalid(self):
+        for value in ('8/8', '-1/8', '1/0', '1', 'a/b', '1/2/3'):
+            with self.subTest(value=value):
+                # Act
+                with self.assertRaises(ArgumentTypeError):
+                    parse_shard(value)
+
+    def test_shard_path(self):
+        # Act
+        actual_path = shard_path('copy.db', (2, 8))
+
+        # Assert
+        self.assertEqual(actual_path, 'copy.db.2-of-8')
+
+    def test_in_shard(self):
+        # Arrange
+        keys = [f'archive/2024/file{i}.csv' for i in range(8000)]
+
+        # Act
+        actual_counts = Counter(index for key in keys for index in range(8) if in_shard(key, (index, 8)))
+
+        # Assert
+        self.assertEqual(sum(actual_counts.values()), len(keys))
+        self.assertTrue(all(800 < count < 1200 for count in actual_counts.values()))
+        # Stable across runs and hosts, unlike hash()
+        self.assertTrue(in_shard('archive/2024/file1.csv', (0, 8)))
+
+    def test_shard_s3objects(self):
+        # Arrange
+        s3objects = [S3Object(f'file{i}.csv', 10) for i in range(100)]
+
+        # Act
+        actual_shards = [list(shard_s3objects(s3objects, (index, 3))) for index in range(3)]
+
+        # Assert
+        self.assertEqual(sorted(s3object.key for shard in actual_shards for s3object in shard),
+                         sorted(s3object.key for s3object in s3objects))
+        # The order of the listing is kept, the sync diff depends on it
+        for shard in actual_shards:
+            self.assertEqual(shard, [s3object for s3object in s3objects if s3object in shard])
+
+
+class TestReport(unittest.TestCase):
+    def test_to_dict(self):
+        # Arrange
+        now = [100.0]
+        report = Report((1, 4), clock=lambda: now[0])
+        list(report.count([S3Object('a.csv', 10), S3Object('b.csv', 20), S3Object('c.csv', 30)]))
+        report.failures = [('b.csv', ValueError('AccessDenied'))]
+        now[0] = 160.0
+
+        # Act
+        actual_report = report.to_dict({'copied': 2, 'failed': 1})
+
+        # Assert
+        self.assertEqual(actual_report, {
+            'shards': ['1-of-4'],
+            'started': 100.0,
+            'finished': 160.0,
+            'objects': 3,
+            'bytes': 60,
+            'copied': 2,
+            'failed': 1,
+            'failures': [{'key': 'b.csv', 'error': 'AccessDenied'}],
+            'journal': {'copied': 2, 'failed': 1},
+        })
+
+    def test_merge_reports(self):
+        # Arrange
+        reports = [
+            {'shards': ['1-of-2'], 'started': 110.0, 'finished': 200.0, 'objects': 3, 'bytes': 60, 'copied': 2,
+             'failed': 1, 'failures': [{'key': 'b.csv', 'error': 'AccessDenied'}], 'journal': {'copied': 2, 'failed': 1}},
+            {'shards': ['0-of-2'], 'started': 100.0, 'finished': 150.0, 'objects': 2, 'bytes': 40, 'copied': 2,
+             'failed': 0, 'failures': [], 'journal': {'copied': 2}},
+        ]
+
+        # Act
+        actual_report = merge_reports(reports)
+
+        # Assert
+        self.assertEqual(actual_report, {
+            'shards': ['0-of-2', '1-of-2'],
+            'started': 100.0,
+            'finished': 200.0,
+            'objects': 5,
+            'bytes': 100,
+            'copied': 4,
+            'failed': 1,
+            'failures': [{'key': 'b.csv', 'error': 'AccessDenied'}],
+            'journal': {'copied': 4, 'failed': 1},
+        })
+
+    @patch('logging.info')
+    def test_merge_report_files(self, mock_logging_info):
+        with tempfile.TemporaryDirectory() as directory:
+            # Arrange
+            paths = []
+            for index in range(2):
+                report = Report((index, 2))
+                list(report.count([S3Object(f'file{index}.csv', 10)]))
+                paths.append(shard_path(os.path.join(directory, 'report.json'), (index, 2)))
+                report.write(paths[-1])
+            expected_path = os.path.join(directory, 'report.json')
+
+            # Act
+            merge_report_files(expected_path, paths)
+
+            # Assert
+            with open(expected_path) as f:
+                actual_report = json.load(f)
+            self.assertEqual((actual_report['shards'], actual_report['objects']), (['0-of-2', '1-of-2'], 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
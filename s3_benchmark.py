@@ -0,0 +1,303 @@
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser, ArgumentTypeError
+
+import boto3
+import botocore.config
+from botocore.awsrequest import AWSResponse
+
+import archive
+import archive_copy
+from clients import LIMITED_MAX_ATTEMPTS, MAX_ATTEMPTS, RETRY_MODE
+from copier import Copier, MB
+from limiter import AdaptiveLimiter, LimitedClient
+from metrics import Metrics
+from selection import parse_size
+
+PROGRAM_DESCRIPTION = ('Benchmarks archive.py and archive_copy.py against a local S3 stand-in (moto server or MinIO): '
+                       'uploads a synthetic bucket, then lists it, requests restores, checks the objects with HEAD '
+                       'and copies them to a second bucket. Latency and SlowDown responses can be injected into '
+                       'every request. Results are saved as JSON and can be compared with an earlier run')
+LOG_FORMAT = '%(levelname)s: %(asctime)s: %(message)s'
+LOG_LEVEL = logging.INFO
+S3_SERVICE_NAME = 's3'
+REGION = 'us-east-1'
+# Any credentials do for moto, MinIO's are taken from AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
+ACCESS_KEY = 'benchmark'
+SECRET_KEY = 'benchmark'
+ENDPOINT_URL = 'http://127.0.0.1:5000'
+SOURCE_BUCKET = 'benchmark-source'
+DESTINATION_BUCKET = 'benchmark-destination'
+PREFIX = 'benchmark'
+NUMBER_OF_OBJECTS = 1000
+SIZE_MIX = '4KB:90,256KB:9,8MB:1'
+PART_SIZE_MB = 5
+THREADS = 32
+LIST_SHARDS = 4
+TOLERANCE = 0.1
+SEED = 1
+SLOW_DOWN_BODY = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                  b'<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>')
+ENDPOINT_URL_FLAG_HELP_MESSAGE = f'S3 endpoint to benchmark against (default: {ENDPOINT_URL}, moto server\'s)'
+MOTO_FLAG_HELP_MESSAGE = 'start a moto server on the port of ENDPOINT_URL in this process. It needs moto[server]'
+OBJECTS_FLAG_HELP_MESSAGE = f'number of objects in the synthetic bucket (default: {NUMBER_OF_OBJECTS})'
+SIZES_FLAG_HELP_MESSAGE = (f'object sizes and their weights, e.g. {SIZE_MIX} (the default): 90%% of 4 KB, '
+                           f'9%% of 256 KB and 1%% of 8 MB')
+PART_SIZE_FLAG_HELP_MESSAGE = (f'part size in MB of multipart uploads and copies (default: {PART_SIZE_MB}), so the '
+                               f'bigger objects go through the multipart code paths')
+THREADS_FLAG_HELP_MESSAGE = f'maximum number of requests in flight for each stage (default: {THREADS})'
+LATENCY_FLAG_HELP_MESSAGE = 'milliseconds added to every request (default: 0)'
+THROTTLE_FLAG_HELP_MESSAGE = 'fraction of requests answered with 503 SlowDown instead of being sent (default: 0)'
+STORAGE_CLASS_FLAG_HELP_MESSAGE = ('storage class of the synthetic objects (default: GLACIER). MinIO only supports '
+                                   'STANDARD, which leaves the restore stage with nothing to do')
+OUTPUT_FLAG_HELP_MESSAGE = 'save the results to OUTPUT as JSON'
+BASELINE_FLAG_HELP_MESSAGE = 'compare the results with the ones saved in BASELINE and exit with 1 on a regression'
+TOLERANCE_FLAG_HELP_MESSAGE = (f'a stage regressed when its objects/s drop by more than this fraction of BASELINE\'s '
+                               f'(default: {TOLERANCE})')
+
+
+def parse_size_mix(value):
+    # '4KB:90,1MB:10' -> [(4096, 90), (1048576, 10)]
+    mix = []
+    for item in value.split(','):
+        (size, _, weight) = item.partition(':')
+        try:
+            mix.append((parse_size(size), float(weight or 1)))
+        except ValueError:
+            raise ArgumentTypeError(f'{item!r} is not a size and weight like 4KB:90') from None
+    return mix
+
+
+def object_sizes(count, mix, seed=SEED):
+    # The same sizes in the same order on every run, so runs can be compared
+    (sizes, weights) = zip(*mix)
+    return random.Random(seed).choices(sizes, weights, k=count)
+
+
+class ResponseBody:
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+def inject_faults(client, latency, throttle_rate, seed=SEED):
+    # Every request waits latency seconds, and throttle_rate of them get a 503 SlowDown without reaching
+    # the server. botocore and the limiters see the same response as from S3 and retry it the same way
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def before_send(request, **kwargs):
+        if latency:
+            time.sleep(latency)
+        with lock:
+            throttled = rng.random() < throttle_rate
+        if throttled:
+            return AWSResponse(request.url, 503, {}, ResponseBody(SLOW_DOWN_BODY))
+        return None
+
+    client.meta.events.register('before-send.s3', before_send, unique_id='benchmark-inject-faults')
+
+
+def create_client(endpoint_url, threads, max_attempts=MAX_ATTEMPTS):
+    config = botocore.config.Config(
+        max_pool_connections=threads * 2,
+        retries={'mode': RETRY_MODE, 'total_max_attempts': max_attempts}
+    )
+    return boto3.client(
+        S3_SERVICE_NAME,
+        endpoint_url=endpoint_url,
+        region_name=REGION,
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID', ACCESS_KEY),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY', SECRET_KEY),
+        config=config
+    )
+
+
+def start_moto(endpoint_url):
+    # moto is only needed when the benchmark starts its own server
+    from moto.server import ThreadedMotoServer
+    port = int(endpoint_url.rpartition(':')[2].strip('/'))
+    server = ThreadedMotoServer(port=port)
+    server.start()
+    return server
+
+
+def create_bucket(client, bucket):
+    try:
+        client.create_bucket(Bucket=bucket)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+
+def write_files(directory, sizes, seed=SEED):
+    rng = random.Random(seed)
+    for (i, size) in enumerate(sizes):
+        with open(os.path.join(directory, f'{i:08d}.bin'), 'wb') as f:
+            f.write(rng.randbytes(size))
+
+
+def run_stage(results, name, function):
+    # function returns the objects it handled
+    logging.info(f'Stage {name}...')
+    start = time.perf_counter()
+    s3objects = function()
+    seconds = time.perf_counter() - start
+    size = sum(s3object.size for s3object in s3objects)
+    results[name] = {
+        'objects': len(s3objects),
+        'bytes': size,
+        'seconds': seconds,
+        'objects_per_second': len(s3objects) / seconds,
+        'mb_per_second': size / MB / seconds,
+    }
+    logging.info(f'Stage {name}: {len(s3objects)} objects in {seconds:.2f} s, {len(s3objects) / seconds:.0f} objects/s, '
+                 f'{size / MB / seconds:.1f} MB/s')
+    return s3objects
+
+
+def upload(client, directory, storage_class, threads, part_size):
+    # archive.py uploads through its module-level client and limiter
+    archive.s3 = client
+    archive.limiter.set_limits(threads, threads)
+    files = list(archive.walk_files(directory))
+    failures = archive.put_files(files, SOURCE_BUCKET, PREFIX, threads, part_size, storage_class=storage_class)
+    if failures:
+        raise RuntimeError(f'{len(failures)} uploads failed, e.g. {failures[0][0]}: {failures[0][1]}')
+    return files
+
+
+def check(client, s3objects, threads):
+    restore_client = LimitedClient(client, AdaptiveLimiter('restore', threads, threads))
+    return [s3object for (s3object, status) in archive_copy.check_s3objects(restore_client, SOURCE_BUCKET, s3objects)]
+
+
+def copy(client, s3objects, threads, part_size):
+    copy_client = LimitedClient(client, AdaptiveLimiter('copy', threads, threads))
+    copier = Copier(copy_client, SOURCE_BUCKET, DESTINATION_BUCKET, False, part_size, threads)
+    try:
+        failures = archive_copy.copy_s3objects(copier, s3objects)
+    finally:
+        copier.close()
+    if failures:
+        raise RuntimeError(f'{len(failures)} copies failed, e.g. {failures[0][0]}: {failures[0][1]}')
+    return s3objects
+
+
+def summarize_requests(snapshot):
+    requests = {}
+    for (operation, histogram) in snapshot['latencies'].items():
+        requests[operation] = {
+            'count': histogram['count'],
+            'mean': histogram['sum'] / histogram['count'],
+            'retries': snapshot['retries'].get(operation, 0),
+            'throttles': snapshot['throttles'].get(operation, 0),
+        }
+    return requests
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Returns the stages whose throughput dropped by more than tolerance
+    regressions = []
+    for (name, stage) in results['stages'].items():
+        baseline_stage = baseline['stages'].get(name)
+        if baseline_stage is None or not baseline_stage['objects_per_second']:
+            continue
+        ratio = stage['objects_per_second'] / baseline_stage['objects_per_second']
+        logging.info(f'{name:<8} {baseline_stage["objects_per_second"]:>10.0f} -> {stage["objects_per_second"]:>10.0f} '
+                     f'objects/s ({ratio - 1:+.0%})')
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+
+    parser = ArgumentParser(description=PROGRAM_DESCRIPTION)
+    parser.add_argument('--endpoint-url', default=ENDPOINT_URL, help=ENDPOINT_URL_FLAG_HELP_MESSAGE)
+    parser.add_argument('--moto', action='store_true', help=MOTO_FLAG_HELP_MESSAGE)
+    parser.add_argument('-n', '--objects', type=int, default=NUMBER_OF_OBJECTS, help=OBJECTS_FLAG_HELP_MESSAGE)
+    parser.add_argument('--sizes', type=parse_size_mix, default=parse_size_mix(SIZE_MIX), help=SIZES_FLAG_HELP_MESSAGE)
+    parser.add_argument('--part-size', type=int, default=PART_SIZE_MB, help=PART_SIZE_FLAG_HELP_MESSAGE)
+    parser.add_argument('-t', '--threads', type=int, default=THREADS, help=THREADS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-l', '--latency', type=float, default=0, help=LATENCY_FLAG_HELP_MESSAGE)
+    parser.add_argument('--throttle', type=float, default=0, help=THROTTLE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--storage-class', default='GLACIER', help=STORAGE_CLASS_FLAG_HELP_MESSAGE)
+    parser.add_argument('-o', '--output', help=OUTPUT_FLAG_HELP_MESSAGE)
+    parser.add_argument('--baseline', help=BASELINE_FLAG_HELP_MESSAGE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help=TOLERANCE_FLAG_HELP_MESSAGE)
+    args = parser.parse_args()
+
+    server = None
+    if args.moto:
+        try:
+            server = start_moto(args.endpoint_url)
+        except ImportError:
+            logging.error('--moto needs moto: pip install "moto[server]"')
+            return 1
+
+    # Like the scripts, requests that go through a limiter are only retried by it
+    client = create_client(args.endpoint_url, args.threads)
+    limited_client = create_client(args.endpoint_url, args.threads, LIMITED_MAX_ATTEMPTS)
+    metrics = Metrics('copied')
+    for stage_client in (client, limited_client):
+        inject_faults(stage_client, args.latency / 1000, args.throttle)
+        metrics.instrument(stage_client)
+    part_size = args.part_size * MB
+    stages = {}
+    try:
+        create_bucket(client, SOURCE_BUCKET)
+        create_bucket(client, DESTINATION_BUCKET)
+        with tempfile.TemporaryDirectory() as directory:
+            write_files(directory, object_sizes(args.objects, args.sizes))
+            run_stage(stages, 'upload', lambda: upload(limited_client, directory, args.storage_class, args.threads, part_size))
+        s3objects = run_stage(stages, 'list', lambda: list(archive_copy.get_s3objects(client, SOURCE_BUCKET, LIST_SHARDS)))
+        # The first check requests the restores, the second one finds them with HEAD
+        run_stage(stages, 'restore', lambda: check(limited_client, s3objects, args.threads))
+        run_stage(stages, 'head', lambda: check(limited_client, s3objects, args.threads))
+        run_stage(stages, 'copy', lambda: copy(limited_client, s3objects, args.threads, part_size))
+    finally:
+        if server is not None:
+            server.stop()
+
+    results = {
+        'config': {
+            'endpoint_url': args.endpoint_url,
+            'objects': args.objects,
+            'sizes': args.sizes,
+            'part_size_mb': args.part_size,
+            'threads': args.threads,
+            'latency_ms': args.latency,
+            'throttle': args.throttle,
+            'storage_class': args.storage_class,
+        },
+        'stages': stages,
+        'requests': summarize_requests(metrics.snapshot()),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        logging.info(f'Results saved to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != json.loads(json.dumps(results['config'])):
+            logging.warning(f'{args.baseline} was run with other settings: {baseline["config"]}')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            logging.error(f'Stage(s) {", ".join(regressions)} regressed by more than {args.tolerance:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import unittest
+from argparse import ArgumentTypeError
+from unittest.mock import patch
+
+import botocore.exceptions
+
+import s3_benchmark
+
+
+class TestSizeMix(unittest.TestCase):
+    def test_parse_size_mix(self):
+        # Act
+        actual_mix = s3_benchmark.parse_size_mix('4KB:90, 1mb:9,100:1')
+
+        # Assert
+        self.assertEqual(actual_mix, [(4096, 90), (1024 * 1024, 9), (100, 1)])
+
+    def test_parse_size_mix_invalid(self):
+        for value in ('4XB:90', '4KB:lots', ''):
+            with self.subTest(value=value):
+                # Act
+                with self.assertRaises(ArgumentTypeError):
+                    s3_benchmark.parse_size_mix(value)
+
+    def test_object_sizes(self):
+        # Act
+        actual_sizes = [s3_benchmark.object_sizes(1000, [(1, 90), (2, 10)]) for _ in range(2)]
+
+        # Assert
+        self.assertEqual(actual_sizes[0], actual_sizes[1])
+        self.assertTrue(50 < actual_sizes[0].count(2) < 150)
+
+
+class TestInjectFaults(unittest.TestCase):
+    @patch('time.sleep')
+    def test_inject_faults(self, mock_sleep):
+        # Arrange
+        client = s3_benchmark.create_client('http://127.0.0.1:1', 1)
+        s3_benchmark.inject_faults(client, 0.05, 1)
+
+        # Act
+        with self.assertRaises(botocore.exceptions.ClientError) as context:
+            client.head_object(Bucket='benchmark-source', Key='file1.csv')
+
+        # Assert
+        self.assertEqual(context.exception.response['Error']['Code'], 'SlowDown')
+        mock_sleep.assert_any_call(0.05)
+
+
+@patch('logging.info')
+class TestCompare(unittest.TestCase):
+    def test_compare(self, mock_logging_info):
+        # Arrange
+        baseline = {'stages': {'list': {'objects_per_second': 1000}, 'copy': {'objects_per_second': 100}}}
+        results = {'stages': {'list': {'objects_per_second': 950}, 'copy': {'objects_per_second': 80},
+                              'head': {'objects_per_second': 500}}}
+
+        # Act
+        actual_regressions = s3_benchmark.compare(results, baseline, 0.1)
+
+        # Assert
+        self.assertEqual(actual_regressions, ['copy'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import re
+import sys
+from email.utils import parsedate_to_datetime
+
+NO_RESTORE = 'no-restore'
+RESTORE_UNKNOWN = 'unknown'
+RESTORE_IN_PROGRESS = 'in-progress'
+RESTORE_DONE = 'done'
+
+
+class S3Object:
+    # One of these is kept per listed key, so only the fields the copy needs are stored,
+    # in slots rather than in the listing's dict with its datetime and owner
+    __slots__ = ('key', 'size', 'etag', 'storage_class', 'restore', 'restore_expiry', 'checksum',
+                 'last_modified')
+
+    def __init__(
+            self,
+            key,
+            size=0,
+            etag=None,
+            storage_class='STANDARD',
+            restore=NO_RESTORE,
+            restore_expiry=None,
+            checksum=None,
+            last_modified=None
+    ):
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.storage_class = storage_class
+        self.restore = restore
+        self.restore_expiry = restore_expiry
+        # Full-object checksum of the copy, set once the object is copied
+        self.checksum = checksum
+        # Seconds since the epoch, for selecting objects by date
+        self.last_modified = last_modified
+
+    def __eq__(self, other):
+        return isinstance(other, S3Object) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f'S3Object({self.key!r}, size={self.size}, storage_class={self.storage_class!r}, restore={self.restore!r})'
+
+
+def from_listing(content):
+    restore = NO_RESTORE
+    restore_expiry = None
+    restore_status = content.get('RestoreStatus')
+    if restore_status is not None:
+        if restore_status.get('IsRestoreInProgress'):
+            restore = RESTORE_IN_PROGRESS
+        else:
+            restore = RESTORE_DONE
+            if 'RestoreExpiryDate' in restore_status:
+                restore_expiry = restore_status['RestoreExpiryDate'].timestamp()
+    return S3Object(
+        content['Key'],
+        content.get('Size', 0),
+        content.get('ETag'),
+        # A handful of storage classes are shared by every object, so one string each is enough
+        sys.intern(content.get('StorageClass', 'STANDARD')),
+        restore,
+        restore_expiry,
+        last_modified=content['LastModified'].timestamp() if 'LastModified' in content else None
+    )
+
+
+def parse_restore(s3object, restore):
+    # x-amz-restore: ongoing-request="false", expiry-date="Fri, 21 Dec 2012 00:00:00 GMT"
+    if 'ongoing-request="true"' in restore:
+        s3object.restore = RESTORE_IN_PROGRESS
+        return
+    s3object.restore = RESTORE_DONE
+    expiry_date = re.search(r'expiry-date="([^"]+)"', restore)
+    if expiry_date:
+        s3object.restore_expiry = parsedate_to_datetime(expiry_date.group(1)).timestamp()
+
+
+def from_head(key, head):
+    # The same record from a HEAD response, for objects that are named rather than listed
+    s3object = S3Object(
+        key,
+        head.get('ContentLength', 0),
+        head.get('ETag'),
+        sys.intern(head.get('StorageClass', 'STANDARD')),
+        last_modified=head['LastModified'].timestamp() if 'LastModified' in head else None
+    )
+    restore = head.get('Restore')
+    if restore is not None:
+        parse_restore(s3object, restore)
+    return s3object
@@ -0,0 +1,149 @@
+import heapq
+import json
+import logging
+import threading
+import time
+from itertools import count
+from urllib.parse import unquote_plus
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+# (expected restore time, first polling interval) by storage class and retrieval tier.
+# https://docs.aws.amazon.com/AmazonS3/latest/userguide/restoring-objects-retrieval-options.html
+RESTORE_TIMES = {
+    ('GLACIER', 'Expedited'): (5 * MINUTE, 1 * MINUTE),
+    ('GLACIER', 'Standard'): (3 * HOUR, 15 * MINUTE),
+    ('GLACIER', 'Bulk'): (5 * HOUR, 30 * MINUTE),
+    ('DEEP_ARCHIVE', 'Standard'): (12 * HOUR, 30 * MINUTE),
+    ('DEEP_ARCHIVE', 'Bulk'): (48 * HOUR, 2 * HOUR),
+}
+DEFAULT_RESTORE_TIME = (3 * HOUR, 15 * MINUTE)
+BACKOFF_FACTOR = 1.5
+MAX_POLLING_INTERVAL = 6 * HOUR
+EVENTS_POLLING_INTERVAL = 10
+RESTORE_COMPLETED_EVENT = 'ObjectRestore:Completed'
+
+
+class RestoreEvents:
+    # Stand-in for an SQS queue of S3 event notifications: a file that gets one message body
+    # ({"Records": [...]}) per line appended to it. Only new lines are read on every poll
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+
+    def completed_keys(self):
+        keys = []
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    self.offset = self.offset + len(line)
+                    keys.extend(self._parse(line))
+        except FileNotFoundError:
+            pass
+        return keys
+
+    @staticmethod
+    def _parse(line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            logging.warning(f'Ignoring malformed restore event: {line[:100]}')
+            return []
+        keys = []
+        for record in message.get('Records', []):
+            if record.get('eventName', '').endswith(RESTORE_COMPLETED_EVENT):
+                # Keys in event notifications are URL-encoded
+                keys.append(unquote_plus(record['s3']['object']['key']))
+        return keys
+
+
+class RestoreScheduler:
+    # Keeps the objects whose restore is pending and hands them back when they are due for a check.
+    # The first check comes after the typical restore time of the tier, then the interval grows
+    # by BACKOFF_FACTOR on every check that finds the restore still running
+    def __init__(self, tier, events=None, clock=time.time):
+        self.tier = tier
+        self.events = events
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.heap = []
+        self.pending = {}
+        self.sequence = count()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.pending)
+
+    def _push(self, s3object, delay, interval):
+        generation = next(self.sequence)
+        self.pending[s3object.key] = (s3object, interval, generation)
+        heapq.heappush(self.heap, (self.clock() + delay, generation, s3object.key))
+        self.condition.notify_all()
+
+    def add(self, s3object, just_requested):
+        (expected, interval) = RESTORE_TIMES.get((s3object.storage_class, self.tier), DEFAULT_RESTORE_TIME)
+        with self.condition:
+            if just_requested:
+                self._push(s3object, expected, interval)
+            elif s3object.key in self.pending:
+                (_, previous_interval, _) = self.pending[s3object.key]
+                interval = min(previous_interval * BACKOFF_FACTOR, MAX_POLLING_INTERVAL)
+                self._push(s3object, interval, interval)
+            else:
+                # Already restoring when first seen, there's no telling since when
+                self._push(s3object, interval, interval)
+
+    def check_now(self, s3object):
+        (_, interval) = RESTORE_TIMES.get((s3object.storage_class, self.tier), DEFAULT_RESTORE_TIME)
+        with self.condition:
+            self._push(s3object, 0, interval)
+
+    def next_due(self):
+        # Blocks until at least one object is due and returns all due objects,
+        # or returns an empty list right away if nothing is pending
+        logged = False
+        with self.condition:
+            while True:
+                if self.events is not None:
+                    for key in self.events.completed_keys():
+                        if key in self.pending:
+                            (s3object, interval, _) = self.pending[key]
+                            self._push(s3object, 0, interval)
+                self._drop_stale()
+                if not self.heap:
+                    return []
+                now = self.clock()
+                if self.heap[0][0] <= now:
+                    return self._pop_due(now)
+                wait = self.heap[0][0] - now
+                if self.events is not None:
+                    wait = min(wait, EVENTS_POLLING_INTERVAL)
+                if not logged:
+                    logging.info(f'{len(self.pending)} objects are waiting for a restore, '
+                                 f'😴 Sleeping {round(self.heap[0][0] - now)} seconds until the next check')
+                    logged = True
+                self.condition.wait(wait)
+
+    def _drop_stale(self):
+        # Entries replaced by a later push stay in the heap until they reach the top
+        while self.heap:
+            (_, generation, key) = self.heap[0]
+            if key in self.pending and self.pending[key][2] == generation:
+                return
+            heapq.heappop(self.heap)
+
+    def _pop_due(self, now):
+        due_objects = []
+        while self.heap and self.heap[0][0] <= now:
+            (_, generation, key) = heapq.heappop(self.heap)
+            if key in self.pending and self.pending[key][2] == generation:
+                due_objects.append(self.pending[key][0])
+                # Stays in pending, with its interval, until it's added again or marked done
+        return due_objects
+
+    def done(self, s3object):
+        with self.condition:
+            self.pending.pop(s3object.key, None)
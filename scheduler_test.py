@@ -0,0 +1,143 @@
+import json
+import tempfile
+import unittest
+from os.path import join
+from unittest.mock import patch
+
+import scheduler
+from s3object import S3Object
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@patch('logging.info')
+class TestRestoreScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = scheduler.RestoreScheduler('Standard', clock=self.clock)
+
+    def test_next_due_empty(self, mock_logging_info):
+        # Act
+        actual_due = self.scheduler.next_due()
+
+        # Assert
+        self.assertEqual(actual_due, [])
+
+    def test_add_just_requested(self, mock_logging_info):
+        # Arrange
+        glacier = S3Object('glacier.csv', storage_class='GLACIER')
+        deep_archive = S3Object('deep.csv', storage_class='DEEP_ARCHIVE')
+        (expected_glacier_time, _) = scheduler.RESTORE_TIMES[('GLACIER', 'Standard')]
+
+        # Act
+        self.scheduler.add(glacier, True)
+        self.scheduler.add(deep_archive, True)
+        self.clock.now = self.clock.now + expected_glacier_time
+        actual_due = self.scheduler.next_due()
+
+        # Assert
+        self.assertEqual(actual_due, [glacier])
+        self.assertEqual(len(self.scheduler), 2)
+
+    def test_add_backs_off(self, mock_logging_info):
+        # Arrange
+        s3object = S3Object('deep.csv', storage_class='DEEP_ARCHIVE')
+        (_, interval) = scheduler.RESTORE_TIMES[('DEEP_ARCHIVE', 'Standard')]
+        start = self.clock.now
+
+        # Act
+        self.scheduler.add(s3object, False)
+        self.clock.now = start + interval
+        first_due = self.scheduler.next_due()
+        self.scheduler.add(s3object, False)
+        actual_due_time = self.scheduler.heap[0][0]
+
+        # Assert
+        self.assertEqual(first_due, [s3object])
+        self.assertEqual(actual_due_time, start + interval + interval * scheduler.BACKOFF_FACTOR)
+
+    def test_done(self, mock_logging_info):
+        # Arrange
+        s3object = S3Object('glacier.csv', storage_class='GLACIER')
+        self.scheduler.add(s3object, True)
+
+        # Act
+        self.scheduler.done(s3object)
+
+        # Assert
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(self.scheduler.next_due(), [])
+
+    def test_check_now(self, mock_logging_info):
+        # Arrange
+        s3object = S3Object('glacier.csv', storage_class='GLACIER')
+        self.scheduler.add(s3object, True)
+
+        # Act
+        self.scheduler.check_now(s3object)
+        actual_due = self.scheduler.next_due()
+
+        # Assert
+        self.assertEqual(actual_due, [s3object])
+
+
+@patch('logging.info')
+class TestRestoreEvents(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.events_path = join(self.tmp_dir.name, 'events.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_event(self, event_name, key):
+        with open(self.events_path, 'a') as f:
+            f.write(json.dumps({'Records': [{'eventName': event_name, 's3': {'object': {'key': key}}}]}) + '\n')
+
+    def test_completed_keys(self, mock_logging_info):
+        # Arrange
+        events = scheduler.RestoreEvents(self.events_path)
+        self.write_event('ObjectRestore:Post', 'file1.csv')
+        self.write_event('ObjectRestore:Completed', 'my+folder/file%281%29.csv')
+
+        # Act
+        actual_keys = events.completed_keys()
+        self.write_event('ObjectRestore:Completed', 'file2.csv')
+        actual_new_keys = events.completed_keys()
+
+        # Assert
+        self.assertEqual(actual_keys, ['my folder/file(1).csv'])
+        self.assertEqual(actual_new_keys, ['file2.csv'])
+
+    def test_completed_keys_missing_file(self, mock_logging_info):
+        # Arrange
+        events = scheduler.RestoreEvents(self.events_path)
+
+        # Act
+        actual_keys = events.completed_keys()
+
+        # Assert
+        self.assertEqual(actual_keys, [])
+
+    def test_next_due_on_event(self, mock_logging_info):
+        # Arrange
+        restore_scheduler = scheduler.RestoreScheduler('Standard', scheduler.RestoreEvents(self.events_path))
+        s3object = S3Object('file1.csv', storage_class='DEEP_ARCHIVE')
+        restore_scheduler.add(s3object, True)
+        self.write_event('ObjectRestore:Completed', 'file1.csv')
+
+        # Act
+        actual_due = restore_scheduler.next_due()
+
+        # Assert
+        self.assertEqual(actual_due, [s3object])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import fnmatch
+import logging
+import re
+from argparse import ArgumentTypeError
+from datetime import datetime, timezone
+from functools import partial
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+
+import botocore.exceptions
+
+from copier import MB
+from s3object import from_head
+
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': MB, 'GB': 1024 * MB, 'TB': 1024 * 1024 * MB}
+NOT_FOUND_ERROR_CODES = ('404', 'NoSuchKey', 'NotFound')
+HEAD_THREADS = 50
+# Keys of a key list looked up at a time, so a list of millions of keys isn't held in memory
+KEY_BATCH_SIZE = 1000
+
+
+def parse_size(value):
+    match = re.fullmatch(r'(\d+)\s*(B|KB|MB|GB|TB)?', value.strip().upper())
+    if match is None:
+        raise ArgumentTypeError(f'{value!r} is not a size like 4KB')
+    return int(match.group(1)) * SIZE_UNITS[match.group(2) or 'B']
+
+
+def parse_time(value):
+    # ISO 8601 date or date and time, in UTC unless it says otherwise
+    try:
+        time = datetime.fromisoformat(value)
+    except ValueError:
+        raise ArgumentTypeError(f'{value!r} is not a date like 2024-01-31 or 2024-01-31T12:00:00+01:00') from None
+    if time.tzinfo is None:
+        time = time.replace(tzinfo=timezone.utc)
+    return time.timestamp()
+
+
+def compile_globs(patterns):
+    # One regular expression for all the patterns, so a key is matched once however many there are
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+class Selector:
+    # Picks the objects a job works on from a listing, an inventory or a key list. The prefix is also
+    # given to S3 by the listing, the other filters are applied to the objects as they stream by,
+    # so unwanted keys never reach the restore checks or the copy
+    def __init__(
+            self,
+            prefix=None,
+            include=None,
+            exclude=None,
+            min_size=None,
+            max_size=None,
+            modified_since=None,
+            modified_before=None
+    ):
+        self.prefix = prefix
+        self.include = compile_globs(include)
+        self.exclude = compile_globs(exclude)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_since = modified_since
+        self.modified_before = modified_before
+        self.active = any(value is not None for value in (prefix or None, self.include, self.exclude, min_size,
+                                                          max_size, modified_since, modified_before))
+
+    def matches(self, s3object):
+        key = s3object.key
+        if self.prefix and not key.startswith(self.prefix):
+            return False
+        if self.include is not None and not self.include.match(key):
+            return False
+        if self.exclude is not None and self.exclude.match(key):
+            return False
+        if self.min_size is not None and s3object.size < self.min_size:
+            return False
+        if self.max_size is not None and s3object.size > self.max_size:
+            return False
+        if self.modified_since is not None or self.modified_before is not None:
+            # Objects without a modification time can't be placed in the range
+            if s3object.last_modified is None:
+                return False
+            if self.modified_since is not None and s3object.last_modified < self.modified_since:
+                return False
+            if self.modified_before is not None and s3object.last_modified >= self.modified_before:
+                return False
+        return True
+
+    def select(self, s3objects):
+        skipped_count = 0
+        for s3object in s3objects:
+            if self.matches(s3object):
+                yield s3object
+            else:
+                skipped_count = skipped_count + 1
+        logging.info(f'{skipped_count} objects did not match the selection and were skipped')
+
+
+def read_keys(path):
+    with open(path) as f:
+        for line in f:
+            key = line.rstrip('\r\n')
+            if key:
+                yield key
+
+
+def head_s3object(client, bucket, key):
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in NOT_FOUND_ERROR_CODES:
+            raise
+        logging.error(f'{key} is not in {bucket}, skipped')
+        return None
+    return from_head(key, head)
+
+
+def read_key_list(client, bucket, path, threads=HEAD_THREADS):
+    # Objects of a file with one key per line, in the order of the file. A HEAD per key gives what a listing
+    # would have: the size, ETag, storage class and restore state
+    keys = read_keys(path)
+    with ThreadPool(processes=threads) as pool:
+        while batch := list(islice(keys, KEY_BATCH_SIZE)):
+            for s3object in pool.imap(partial(head_s3object, client, bucket), batch):
+                if s3object is not None:
+                    yield s3object
@@ -0,0 +1,147 @@
+import os
+import tempfile
+import unittest
+from argparse import ArgumentTypeError
+from datetime import datetime, timezone
+from unittest.mock import patch, MagicMock
+
+import botocore.exceptions
+
+from s3object import S3Object, RESTORE_DONE
+from selection import Selector, parse_size, parse_time, read_key_list
+
+JANUARY = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+FEBRUARY = datetime(2024, 2, 1, tzinfo=timezone.utc).timestamp()
+MARCH = datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp()
+
+
+class TestParse(unittest.TestCase):
+    def test_parse_size(self):
+        # Act
+        actual_sizes = [parse_size(value) for value in ['100', '4KB', '1 mb', '2TB']]
+
+        # Assert
+        self.assertEqual(actual_sizes, [100, 4096, 1024 * 1024, 2 * 1024 ** 4])
+
+    def test_parse_size_invalid(self):
+        # Act
+        with self.assertRaises(ArgumentTypeError):
+            parse_size('4 KiB')
+
+    def test_parse_time(self):
+        # Act
+        actual_times = [parse_time(value) for value in ['2024-02-01', '2024-02-01T01:00:00+01:00']]
+
+        # Assert
+        self.assertEqual(actual_times, [FEBRUARY, FEBRUARY])
+
+    def test_parse_time_invalid(self):
+        # Act
+        with self.assertRaises(ArgumentTypeError):
+            parse_time('last tuesday')
+
+
+@patch('logging.info')
+class TestSelector(unittest.TestCase):
+    def test_select_globs(self, mock_logging_info):
+        # Arrange
+        s3objects = [S3Object(key) for key in ['logs/2024-01.gz', 'logs/a/2024-02.gz', 'logs/2024-02.txt', 'tmp/2024.gz']]
+        selector = Selector(prefix='logs/', include=['*.gz', '*.txt'], exclude=['*.txt'])
+
+        # Act
+        actual_keys = [s3object.key for s3object in selector.select(s3objects)]
+
+        # Assert
+        self.assertEqual(actual_keys, ['logs/2024-01.gz', 'logs/a/2024-02.gz'])
+        mock_logging_info.assert_called_with('2 objects did not match the selection and were skipped')
+
+    def test_select_sizes(self, mock_logging_info):
+        # Arrange
+        s3objects = [S3Object(f'file{size}.csv', size) for size in [0, 10, 20, 30]]
+        selector = Selector(min_size=10, max_size=20)
+
+        # Act
+        actual_keys = [s3object.key for s3object in selector.select(s3objects)]
+
+        # Assert
+        self.assertEqual(actual_keys, ['file10.csv', 'file20.csv'])
+
+    def test_select_dates(self, mock_logging_info):
+        # Arrange
+        s3objects = [
+            S3Object('january.csv', last_modified=JANUARY),
+            S3Object('february.csv', last_modified=FEBRUARY),
+            S3Object('march.csv', last_modified=MARCH),
+            S3Object('unknown.csv'),
+        ]
+        selector = Selector(modified_since=FEBRUARY, modified_before=MARCH)
+
+        # Act
+        actual_keys = [s3object.key for s3object in selector.select(s3objects)]
+
+        # Assert
+        self.assertEqual(actual_keys, ['february.csv'])
+
+    def test_active(self, mock_logging_info):
+        # Act
+        actual_active = [Selector().active, Selector(prefix='').active, Selector(exclude=['*.tmp']).active]
+
+        # Assert
+        self.assertEqual(actual_active, [False, False, True])
+
+
+@patch('logging.error')
+class TestReadKeyList(unittest.TestCase):
+    def test_read_key_list(self, mock_logging_error):
+        # Arrange
+        mock_client = MagicMock()
+        heads = {
+            'file1.csv': {'ContentLength': 10, 'ETag': '"etag1"', 'LastModified': datetime(2024, 1, 1, tzinfo=timezone.utc)},
+            'file3.csv': {
+                'ContentLength': 30,
+                'ETag': '"etag3"',
+                'StorageClass': 'GLACIER',
+                'Restore': 'ongoing-request="false", expiry-date="Fri, 21 Dec 2012 00:00:00 GMT"'
+            },
+        }
+
+        def head_object(Bucket, Key):
+            if Key not in heads:
+                raise botocore.exceptions.ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+            return heads[Key]
+
+        mock_client.head_object.side_effect = head_object
+        expected_s3objects = [
+            S3Object('file1.csv', 10, '"etag1"', last_modified=JANUARY),
+            S3Object('file3.csv', 30, '"etag3"', 'GLACIER', RESTORE_DONE, 1356048000.0),
+        ]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'keys.txt')
+            with open(path, 'w') as f:
+                f.write('file1.csv\nfile2.csv\n\nfile3.csv\n')
+
+            # Act
+            actual_s3objects = list(read_key_list(mock_client, 'my-old-archives', path, threads=2))
+
+        # Assert
+        self.assertEqual(actual_s3objects, expected_s3objects)
+        mock_logging_error.assert_called_once_with('file2.csv is not in my-old-archives, skipped')
+
+    def test_read_key_list_error(self, mock_logging_error):
+        # Arrange
+        mock_client = MagicMock()
+        mock_client.head_object.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'HeadObject')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'keys.txt')
+            with open(path, 'w') as f:
+                f.write('file1.csv\n')
+
+            # Act
+            with self.assertRaises(botocore.exceptions.ClientError):
+                list(read_key_list(mock_client, 'my-old-archives', path, threads=2))
+
+
+if __name__ == '__main__':
+    unittest.main()